@@ -1,63 +1,57 @@
+import argparse
+import os
 import sys
-import turtle
-from cilly_interpreter import cilly_eval, cilly_lexer, cilly_parser
-
-env = {
-    "forward": lambda *args: turtle.forward(*args),
-    "backward": lambda *args: turtle.backward(*args),
-    "right": lambda *args: turtle.right(*args),
-    "left": lambda *args: turtle.left(*args),
-    "penup": lambda: turtle.penup(),
-    "pendown": lambda: turtle.pendown(),
-    "pencolor": lambda *args: turtle.pencolor(*args),
-    "color": lambda *args: turtle.color(*args),
-}
-
-
-def reply():
+from cilly_interpreter import cilly_eval, make_incremental_parser
+from cilly_cache import cilly_load_file
+from cilly_optimizer import cilly_optimize
+from cilly_builtins import array_builtins
+from cilly_turtle import TurtleBatcher, TurtleRecorder
+from cilly_output import BufferedSink
+
+
+# 绘图函数由 renderer 提供：TurtleBatcher 画在窗口里，TurtleRecorder 只记录路径
+def mk_env(renderer):
+    return {**renderer.env(), **array_builtins()}
+
+
+# optimize: 传给 cilly_load_file，None 时不做 AST 优化
+def reply(env, renderer, optimize="eval"):
     print("Cilly 交互式环境。输入 'exit' 退出，'load <文件>' 加载文件。")
+    # 增量解析器保存已输入的 token，每行只处理新输入的文本
+    feed, reset, has_pending = make_incremental_parser()
     while True:
-        buffer = []
-        while True:
+        try:
+            prompt = "...... " if has_pending() else "cilly> "
+            line = input(prompt).strip()
+        except EOFError:
+            print("再见！")
+            sys.exit(0)
+        if line.lower() == "exit":
+            print("再见！")
+            sys.exit(0)
+        if line.lower().startswith("load "):
+            reset()
+            filename = line.split(" ", 1)[1]
             try:
-                prompt = "cilly> " if not buffer else "...... "
-                line = input(prompt).strip()
-                if line.lower() == "exit":
-                    print("再见！")
-                    sys.exit(0)
-                if line.lower().startswith("load "):
-                    filename = line.split(" ", 1)[1]
-                    with open(filename, "r") as f:
-                        code = f.read()
-                    tokens = cilly_lexer(code)
-                    # print(tokens)
-                    ast = cilly_parser(tokens)
-                    # print(ast)
-                    cilly_eval(ast, env)
-                    break
-                if line:
-                    buffer.append(line)
-                code = "\n".join(buffer)
-                if not code:
-                    continue
-                # 尝试解析代码
-                tokens = cilly_lexer(code)
-                # print(tokens)
-                ast = cilly_parser(tokens)
+                # 源码没变时直接读 __cillycache__ 里的 AST
+                ast = cilly_load_file(filename, optimize=optimize)
                 # print(ast)
-                break  # 解析成功，退出输入循环
+                cilly_eval(ast, env)
             except Exception as e:
-                # print(e)
-                if "期望" in str(e) and "eof" in str(e):
-                    continue  # 需要更多输入
-                elif "需要" in str(e):
-                    continue
-                else:
-                    print(f"解析错误：{e}")
-                    buffer = []
-                    break
-        if not buffer:
+                print(f"执行错误：{e}")
+            renderer.flush()
+            continue
+
+        r = feed(line + "\n")
+        if r[0] == "incomplete":
+            continue  # 需要更多输入
+        if r[0] == "error":
+            print(f"解析错误：{r[1]}")
             continue
+
+        ast = r[1]
+        if optimize is not None:
+            ast = cilly_optimize(ast, optimize)
         try:
             # print(ast)
             result = cilly_eval(ast, env)
@@ -65,7 +59,64 @@ def reply():
                 print(result[1])
         except Exception as e:
             print(f"执行错误：{e}")
+        renderer.flush()
+
+
+# 不打开窗口，每个文件画成一个 SVG；一个文件失败不影响其他文件
+def render_svg(files, out, optimize="eval"):
+    if len(files) > 1 or os.path.isdir(out):
+        os.makedirs(out, exist_ok=True)
+        targets = [os.path.join(out, os.path.splitext(os.path.basename(f))[0] + ".svg") for f in files]
+    else:
+        targets = [out]
+
+    failed = 0
+    sink = BufferedSink()
+    for filename, target in zip(files, targets):
+        rec = TurtleRecorder()
+        try:
+            cilly_eval(cilly_load_file(filename, optimize=optimize), mk_env(rec), out=sink)
+        except Exception as e:
+            print(f"{filename}: 执行错误：{e}", file=sys.stderr)
+            failed += 1
+            continue
+        rec.write_svg(target)
+
+    return failed
+
+
+def run_files(files, batch_size, optimize="eval"):
+    import turtle
+
+    renderer = TurtleBatcher(batch_size)
+    env = mk_env(renderer)
+    for filename in files:
+        cilly_eval(cilly_load_file(filename, optimize=optimize), env)
+        renderer.flush()
+    turtle.done()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cilly 解释器，不给文件时进入交互环境")
+    parser.add_argument("files", nargs="*", help="要执行的 cilly 源文件")
+    parser.add_argument("--svg", metavar="PATH", help="不打开窗口，把绘图写成 SVG；多个文件时 PATH 是目录")
+    parser.add_argument("--batch", type=int, default=1000, metavar="N", help="窗口绘图时每 N 个命令刷新一次屏幕")
+    parser.add_argument("--no-opt", action="store_true", help="不做 AST 优化（常量折叠、删除死代码）")
+    args = parser.parse_args(argv)
+    optimize = None if args.no_opt else "eval"
+
+    if args.svg is not None:
+        if not args.files:
+            parser.error("--svg 需要给出源文件")
+        sys.exit(1 if render_svg(args.files, args.svg, optimize) else 0)
+
+    if args.files:
+        run_files(args.files, args.batch, optimize)
+        return
+
+    renderer = TurtleBatcher(args.batch)
+    reply(mk_env(renderer), renderer, optimize)
 
 
 if __name__ == "__main__":
-    reply()
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import socket
+import threading
+import time
+
+from cilly_interpreter import cilly_lexer, cilly_parser
+from cilly_optimizer import cilly_optimize
+from cilly_stackless import cilly_eval_stackless, MAX_DEPTH
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm_machine
+from cilly_builtins import HostRegistry
+
+"""
+cilly 异步执行
+
+cilly_vm / cilly_eval 调用 python 函数时会一直等它返回。python 函数要做网络请求之类的 I/O 时，
+整个线程都在等，一个服务里同时跑很多程序只能一个一个来，或者每个程序占一个线程。
+这里的两个解释器是 asyncio 的协程，HostRegistry 里登记的 async def 函数被 cilly 程序调用时，
+程序在这里暂停，事件循环去执行别的程序，等 I/O 完成后再从调用处继续：
+
+    host = HostRegistry()
+
+    @host.function()
+    async def fetch(key):
+        reader, writer = await asyncio.open_connection(...)
+        ...
+
+    names, values = host.vm_scope()
+    code, consts, _ = cilly_vm_compiler(ast, [], [], [names])
+    await asyncio.gather(
+        cilly_vm_async(code, consts, [values]),
+        cilly_eval_async(ast2, host.env()),
+    )
+
+1. cilly_vm_async：cilly_vm 的异步版本。CALL 指令遇到返回 awaitable 的内置函数时，
+   虚拟机把 (awaitable, 返回地址) 交出来并停下，这里 await 得到结果、压栈，再从返回地址继续
+2. cilly_eval_async：基于 cilly_stackless，ev_call 把 awaitable yield 出来，由外层 await
+
+普通函数和 async 函数可以登记在同一个 HostRegistry 里，同步的调用不受影响。
+用同步的 cilly_vm / cilly_eval_stackless 执行调用了 async 函数的程序时报错。
+计算密集的程序每执行 quantum 条指令（cilly_eval_async 是 ASYNC_QUANTUM 个节点）让出一次事件循环，
+不会让其他程序一直等着。直接放进 env 的旧式 python 函数仍然同步执行，返回值也不会被 await。
+
+python cilly_async.py 运行基准测试：本地起一个每个请求延迟若干毫秒的 TCP 服务代替远端，
+比较很多个 cilly 程序用阻塞的 socket 依次执行和用 asyncio 并发执行的总耗时。
+"""
+
+
+# out: 和 cilly_vm 一样，传入时 print 的输出写到 out
+# quantum: 不调用 async 函数时，最多连续执行多少条指令就让出一次事件循环
+async def cilly_vm_async(code, consts, scopes, out=None, quantum=1000):
+    _, run_for, stack, _, suspended = cilly_vm_machine(code, consts, scopes, out=out, async_calls=True)
+    end = len(code)
+    pc = 0
+    try:
+        while True:
+            pc, _ = run_for(pc, quantum)
+            if suspended:
+                aw, pc = suspended.pop()
+                stack.append(await aw)
+            elif pc >= end:
+                break
+            else:
+                await asyncio.sleep(0)
+    finally:
+        if out is not None:
+            out.flush()
+
+
+async def cilly_eval_async(ast, env, max_depth=MAX_DEPTH):
+    return await cilly_eval_stackless(ast, env, async_calls=True, max_depth=max_depth)
+
+
+# ---------- 基准测试 ----------
+
+BENCH_PROGRAM = """
+var total = 0;
+var i = 0;
+while (i < {calls}) {{
+    total = total + fetch(i);
+    i = i + 1;
+}}
+print(total);
+"""
+
+
+# 代替远端服务：每行一个整数，延迟 delay 秒后回复它的两倍
+async def handle_request(reader, writer, delay):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            await asyncio.sleep(delay)
+            writer.write(f"{int(line) * 2}\n".encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+# 在后台线程里运行服务，返回 (端口, 停止函数)
+def start_server(delay):
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    port = []
+
+    async def serve():
+        done = asyncio.Event()
+        server = await asyncio.start_server(
+            lambda r, w: handle_request(r, w, delay), "127.0.0.1", 0, backlog=1024
+        )
+        port.append((server.sockets[0].getsockname()[1], done))
+        ready.set()
+        await done.wait()
+        server.close()
+        await server.wait_closed()
+
+    thread = threading.Thread(target=lambda: loop.run_until_complete(serve()), daemon=True)
+    thread.start()
+    ready.wait()
+    number, done = port[0]
+
+    def stop():
+        loop.call_soon_threadsafe(done.set)
+        thread.join()
+        loop.close()
+
+    return number, stop
+
+
+# 每个 fetch 一个连接，和调用互不相关的远端接口一样
+def blocking_host(port):
+    host = HostRegistry()
+
+    @host.function()
+    def fetch(key):
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(f"{key}\n".encode())
+            return int(s.makefile().readline())
+
+    return host
+
+
+def async_host(port):
+    host = HostRegistry()
+
+    @host.function()
+    async def fetch(key):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(f"{key}\n".encode())
+            return int(await reader.readline())
+        finally:
+            writer.close()
+
+    return host
+
+
+def compile_program(src, host):
+    names, values = host.vm_scope()
+    # 同一个 AST 两个后端都要执行，按 cilly_eval 的语义优化
+    ast = cilly_optimize(cilly_parser(cilly_lexer(src)))
+    code, consts, _ = cilly_vm_compiler(ast, [], [], [names])
+    return ast, code, consts, values
+
+
+def benchmark(programs=100, calls=5, delay=0.01, backend="vm"):
+    port, stop = start_server(delay)
+    src = BENCH_PROGRAM.format(calls=calls)
+    expected = f"{calls * (calls - 1)} \n" * programs
+
+    # cilly_eval_stackless 没有 out 参数，print 的输出从 stdout 捕获
+    def run_blocking():
+        ast, code, consts, values = compile_program(src, blocking_host(port))
+        env = blocking_host(port).env()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            for _ in range(programs):
+                if backend == "vm":
+                    run, _, _, _, _ = cilly_vm_machine(code, consts, [values], out=out)
+                    run()
+                else:
+                    cilly_eval_stackless(ast, dict(env))
+        return out.getvalue()
+
+    async def run_async():
+        host = async_host(port)
+        ast, code, consts, values = compile_program(src, host)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            if backend == "vm":
+                jobs = [cilly_vm_async(code, consts, [values], out=out) for _ in range(programs)]
+            else:
+                jobs = [cilly_eval_async(ast, host.env()) for _ in range(programs)]
+            await asyncio.gather(*jobs)
+        return out.getvalue()
+
+    try:
+        # 阻塞方式：一个接一个执行，每个 fetch 都要等完整的延迟
+        start = time.perf_counter()
+        blocking_out = run_blocking()
+        blocking_time = time.perf_counter() - start
+
+        # asyncio：所有程序同时执行，等待 I/O 时互相让出
+        start = time.perf_counter()
+        async_out = asyncio.run(run_async())
+        async_time = time.perf_counter() - start
+    finally:
+        stop()
+
+    if blocking_out != expected or async_out != expected:
+        raise AssertionError("两种方式的输出和预期不同")
+
+    total = programs * calls
+    print(f"{programs} 个程序，每个 {calls} 次请求，每次请求延迟 {delay * 1000:g}ms，后端 {backend}")
+    print(f"[阻塞] 总耗时: {blocking_time:.3f}秒，{total / blocking_time:.1f} 次请求/秒")
+    print(f"[asyncio] 总耗时: {async_time:.3f}秒，{total / async_time:.1f} 次请求/秒")
+    print(f"加速比: {blocking_time / async_time:.1f}x")
+    return blocking_time, async_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较阻塞和 asyncio 方式执行做 I/O 的 cilly 程序")
+    parser.add_argument("-n", "--programs", type=int, default=100, help="同时执行的程序个数")
+    parser.add_argument("--calls", type=int, default=5, help="每个程序的请求次数")
+    parser.add_argument("--delay", type=float, default=0.01, metavar="SECONDS", help="每次请求的延迟")
+    parser.add_argument("--backend", choices=["vm", "eval"], default="vm")
+    args = parser.parse_args(argv)
+    benchmark(args.programs, args.calls, args.delay, args.backend)
+
+
+if __name__ == "__main__":
+    main()
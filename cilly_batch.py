@@ -0,0 +1,295 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from cilly_interpreter import cilly_eval, val, NULL
+from cilly_cache import source_digest, cilly_parse_cached
+from cilly_builtins import array_builtins
+
+"""
+cilly 批量运行
+
+一次运行成千上万个小的 cilly 程序时，每个程序起一个 python 进程，时间主要花在
+启动解释器和 import 上。这里用 ProcessPoolExecutor 开固定个数的 worker 进程，
+worker 一直复用，import 过的模块、解析好的 AST（进程内的字典 + 磁盘上的 __cillycache__）、
+转译好的代码都留着给后面的程序用：
+
+    python cilly_batch.py scripts/ -j 8 --timeout 5 --memory 512
+    python cilly_batch.py manifest.txt --backend vm --json results.json
+
+解析后默认做 AST 优化（cilly_optimizer），--no-opt 时不做。
+参数是目录时运行其中（含子目录）所有 .cl 文件；是 .cl 文件时只运行它；
+否则当作清单，每行一个路径（相对清单所在目录），空行和 # 开头的行忽略。
+
+每个程序的结果是一个字典：path、ok、stdout（print 的输出）、
+result（程序最后的值的字符串，没有值时为 None；vm 执行完不留下值，--backend vm 时总是 None）、
+error、time（在 worker 里的耗时，包括读文件和解析）。最后报告吞吐量（程序/秒）
+和耗时的 p50/p90/p99/max。
+
+timeout 在 worker 里用 SIGALRM 实现，超时的程序报错，worker 继续运行后面的程序；
+一直在 C 代码里不返回的程序要等它返回才能中断。memory 限制的是每个 worker 进程
+整个地址空间（RLIMIT_AS，包括 python 本身），超出时程序得到 MemoryError。
+"""
+
+BACKENDS = ["eval", "closure", "python", "vm"]
+
+# 每个 worker 进程里缓存的 AST 个数上限
+AST_CACHE_SIZE = 256
+
+
+# 继承 BaseException，不会被解释器调用 python 函数时的 except Exception 吞掉
+class JobTimeout(BaseException):
+    pass
+
+
+# ---------- worker 进程 ----------
+
+worker_backend = "eval"
+worker_timeout = None
+worker_optimize = "eval"
+ast_cache = {}
+
+
+def on_alarm(signum, frame):
+    raise JobTimeout()
+
+
+def init_worker(backend, timeout, memory_mb, optimize=True):
+    global worker_backend, worker_timeout, worker_optimize
+    worker_backend = backend
+    worker_timeout = timeout
+    # vm 的 return 会真正返回，可以按 vm 的语义多删掉一些死代码
+    if not optimize:
+        worker_optimize = None
+    else:
+        worker_optimize = "vm" if backend == "vm" else "eval"
+
+    if memory_mb is not None:
+        import resource
+
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, on_alarm)
+
+    # 提前 import 各个后端，第一个程序不用等
+    if backend == "closure":
+        import cilly_closure_compiler
+    elif backend == "python":
+        import cilly_transpiler
+    elif backend == "vm":
+        import cilly_vm_compiler
+
+
+def load_ast(path, src):
+    key = (path, source_digest(src))
+    ast = ast_cache.get(key)
+    if ast is None:
+        ast = cilly_parse_cached(src, path, optimize=worker_optimize)
+        if len(ast_cache) >= AST_CACHE_SIZE:
+            del ast_cache[next(iter(ast_cache))]
+        ast_cache[key] = ast
+    return ast
+
+
+# 执行一个程序，print 的输出写到 out，返回程序的值（vm 没有，返回 None）
+def run_source(path, src, out):
+    if worker_backend == "python":
+        from cilly_transpiler import cilly_run_python
+
+        return cilly_run_python(src, array_builtins(), worker_optimize)
+
+    ast = load_ast(path, src)
+
+    if worker_backend == "closure":
+        from cilly_closure_compiler import cilly_closure_compile
+
+        return cilly_closure_compile(ast)(array_builtins())
+
+    if worker_backend == "vm":
+        from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+        # 内置函数放在最外层作用域，和 HostRegistry.vm_scope 一样
+        env = array_builtins()
+        code, consts, scopes = cilly_vm_compiler(ast, [], [], [list(env)])
+        cilly_vm(code, consts, [list(env.values())], out=out)
+        return None
+
+    return cilly_eval(ast, array_builtins(), out=out)
+
+
+def run_job(path):
+    buf = io.StringIO()
+    r = {"path": path, "ok": False, "stdout": "", "result": None, "error": None, "time": 0.0}
+
+    start = time.perf_counter()
+    if worker_timeout is not None:
+        signal.setitimer(signal.ITIMER_REAL, worker_timeout)
+    # 定时器在内层的 finally 里关掉，之前任何时候（包括处理别的异常时）到期抛出的 JobTimeout
+    # 都在外层的 try 里，不会跑出 run_job
+    try:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                src = f.read()
+            # 程序里调用的 python 函数直接 print 的内容也一起捕获，和 print 语句的输出按顺序排在一起
+            with contextlib.redirect_stdout(buf):
+                v = run_source(path, src, buf)
+        finally:
+            if worker_timeout is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        r["ok"] = True
+        if v is not None and v is not NULL:
+            r["result"] = str(val(v))
+    except JobTimeout:
+        r["error"] = f"超时: {worker_timeout} 秒"
+    except MemoryError:
+        r["error"] = "内存超出限制"
+    except RecursionError:
+        r["error"] = "递归层数过多"
+    except Exception as e:
+        r["error"] = str(e)
+    r["time"] = time.perf_counter() - start
+    r["stdout"] = buf.getvalue()
+    return r
+
+
+# 一次发给 worker 一组程序，减少进程间通信的次数
+def run_chunk(paths):
+    return [run_job(p) for p in paths]
+
+
+# ---------- 主进程 ----------
+
+
+def collect_scripts(target):
+    if os.path.isdir(target):
+        return sorted(glob.glob(os.path.join(target, "**", "*.cl"), recursive=True))
+
+    if target.endswith(".cl"):
+        return [target]
+
+    base = os.path.dirname(os.path.abspath(target))
+    paths = []
+    with open(target, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(os.path.join(base, line))
+    return paths
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def failed_result(path, error):
+    return {"path": path, "ok": False, "stdout": "", "result": None, "error": error, "time": 0.0}
+
+
+# 返回 (每个程序的结果，按 paths 的顺序, 统计)
+def run_batch(paths, workers=None, timeout=None, memory_mb=None, backend="eval", chunksize=None, optimize=True):
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的后端: {backend}，可选 {BACKENDS}")
+
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(32, len(paths) // (workers * 4)))
+    chunks = [paths[i : i + chunksize] for i in range(0, len(paths), chunksize)]
+
+    results = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(backend, timeout, memory_mb, optimize)) as pool:
+        futures = {pool.submit(run_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                for r in future.result():
+                    results[r["path"]] = r
+            except BrokenProcessPool:
+                # worker 进程被杀掉（例如超出内存被系统终止）时，这一组程序都记为失败
+                for p in futures[future]:
+                    results[p] = failed_result(p, "worker 进程异常退出")
+            except (Exception, JobTimeout) as e:
+                # run_job 自己处理了程序的错误，到这里的是 worker 里的意外错误，只影响这一组程序
+                for p in futures[future]:
+                    results[p] = failed_result(p, f"worker 出错: {e!r}")
+    wall = time.perf_counter() - start
+
+    ordered = [results[p] for p in paths]
+    latencies = sorted(r["time"] for r in ordered)
+    stats = {
+        "scripts": len(ordered),
+        "failed": sum(1 for r in ordered if not r["ok"]),
+        "workers": workers,
+        "wall_time": wall,
+        "throughput": len(ordered) / wall if wall > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else 0.0,
+    }
+    return ordered, stats
+
+
+def print_report(results, stats, file=None):
+    file = file or sys.stdout
+    for r in results:
+        if not r["ok"]:
+            print(f"{r['path']}: {r['error']}", file=file)
+
+    print(
+        f"{stats['scripts']} 个程序，失败 {stats['failed']} 个，{stats['workers']} 个 worker，"
+        f"总耗时 {stats['wall_time']:.3f}秒，吞吐量 {stats['throughput']:.1f} 个/秒",
+        file=file,
+    )
+    print(
+        "单个程序耗时: "
+        + ", ".join(f"{k} {stats[k] * 1000:.2f}ms" for k in ["p50", "p90", "p99", "max"]),
+        file=file,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用进程池批量运行 cilly 程序")
+    parser.add_argument("target", help="目录、.cl 文件或清单文件")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker 进程数，默认 CPU 核数")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS", help="每个程序的时间上限")
+    parser.add_argument("--memory", type=int, default=None, metavar="MB", help="每个 worker 进程的内存上限")
+    parser.add_argument("--backend", choices=BACKENDS, default="eval")
+    parser.add_argument("--chunksize", type=int, default=None, help="一次发给 worker 的程序个数")
+    parser.add_argument("--no-opt", action="store_true", help="不做 AST 优化")
+    parser.add_argument("--json", metavar="FILE", help="把每个程序的结果和统计写成 JSON")
+    parser.add_argument("--show-output", action="store_true", help="打印每个程序的输出")
+    args = parser.parse_args(argv)
+
+    paths = collect_scripts(args.target)
+    results, stats = run_batch(
+        paths, args.workers, args.timeout, args.memory, args.backend, args.chunksize, not args.no_opt
+    )
+
+    if args.show_output:
+        for r in results:
+            print(f"== {r['path']}")
+            sys.stdout.write(r["stdout"])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"stats": stats, "results": results}, f, ensure_ascii=False, indent=2)
+
+    print_report(results, stats)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+import inspect
+import operator
+from array import array
+from itertools import repeat
+
+from cilly_interpreter import error, NumArray, pack_nums, mk_array, mk_builtin
+from cilly_interpreter import mk_struct, struct_shape, close_awaitable, NULL, TRUE, FALSE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+cilly 内置函数
+
+HostRegistry 登记 python 实现的函数，cilly 程序调用它们时能拿到返回值
+（直接把 python 函数放进 env 的旧方式只能产生副作用，返回值总是 null）：
+
+    host = HostRegistry()
+    host.register("clamp", clamp)                         # 参数个数从函数签名得出
+    host.register("hypot", math.hypot, arity=2)           # 读不到签名的 C 函数要声明参数个数
+    host.register("greet", greet, arity=1, mode="boxed")
+
+    cilly_eval(ast, host.env())
+
+    names, values = host.vm_scope()
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [names])
+    cilly_vm(code, consts, [values])
+
+登记后的函数是 ["builtin", name, arity, fn] 值，所有解释器和 cilly_vm 调用时
+只比较参数个数，然后 fn(*args)。参数个数在登记时就和 python 函数的签名核对过，
+按 mode 决定参数和返回值怎么转换，转换函数也在登记时生成好
+（fn 也可以是 async def 定义的函数，这时程序要用 cilly_async 里的解释器执行）：
+1. "raw"：参数转换成 python 值（数组 -> list，结构体 -> dict），
+   返回的 python 值再转换回 cilly 值
+2. "boxed"：参数和返回值都是 cilly 的装箱值（["num", 1] 等），不做任何转换，最快
+3. "batch"：同 raw，但数值数组直接传底层的 array.array（不复制，不要修改它），
+   适合一次处理整个数组的函数；返回 list 或 array.array 时得到数组
+
+array_builtins() 是用 boxed 方式登记的一组数值数组函数，放进 env 里就能使用：
+
+    env.update(array_builtins())
+
+    var a = num_array(1000000, 0.5);
+    print(sum(a), dot(a, a), max(add(a, scale(a, 2))));
+
+num_array(n, init) 创建 n 个元素都是 init 的数值数组；16 个元素以上、
+元素全是整数或全是浮点数的数组字面量也会自动存成数值数组（见 cilly_interpreter 的 NumArray）。
+sum/min/max/dot 返回一个数，scale(a, k) 和 add(a, b) 返回新数组，
+整个循环都在 C 里完成，不用每个元素解释执行一次。
+
+参数也可以是元素都是数字的普通数组，结果和用 cilly 循环逐个计算一样。
+装了 numpy 时浮点数组的运算交给 numpy（直接在数组的内存上计算，不复制），
+这时浮点数求和的舍入可能和逐个相加略有不同；整数数组总是用 python 的整数精确计算，
+结果超出 64 位时返回普通数组。
+"""
+
+HOST_MODES = ["raw", "boxed", "batch"]
+
+
+# 函数值（cilly 函数、内置函数、cilly_vm 的函数）原样传给 python，python 函数返回时原样传回来
+def is_fun_value(v):
+    if type(v) is tuple:
+        return len(v) == 4 and v[0] == "compiled_proc"
+    if type(v) is list and len(v) > 0:
+        # cilly_resolver 的函数值多带了定义处的帧和局部变量个数
+        return (v[0] == "proc" and len(v) in [3, 5]) or (v[0] == "builtin" and len(v) == 4)
+    return False
+
+
+# cilly 值 -> python 值
+def to_py(v):
+    tag = v[0]
+
+    if tag == "array":
+        items = v[1]
+        if type(items) is NumArray:
+            return items.data.tolist()
+        return [to_py(e) for e in items]
+
+    if tag == "struct":
+        return {name: to_py(e) for name, e in zip(v[1].shape, v[1].values)}
+
+    if tag in ["proc", "builtin", "compiled_proc"]:
+        return v
+
+    return v[1]
+
+
+# batch 方式：数值数组不转换，直接传底层的 array
+def to_py_batch(v):
+    if v[0] == "array" and type(v[1]) is NumArray:
+        return v[1].data
+    return to_py(v)
+
+
+# python 值 -> cilly 值
+def from_py(x):
+    if x is None:
+        return NULL
+
+    if x is True:
+        return TRUE
+
+    if x is False:
+        return FALSE
+
+    t = type(x)
+
+    if t is int or t is float:
+        return ["num", x]
+
+    if t is str:
+        return ["str", x]
+
+    if is_fun_value(x):
+        return x
+
+    if t is list or t is tuple:
+        return mk_array([from_py(e) for e in x])
+
+    if t is array:
+        if x.typecode in ["q", "d"]:
+            return ["array", NumArray(x)]
+        return mk_array([from_py(e) for e in x])
+
+    if t is dict:
+        return mk_struct(struct_shape(x), [from_py(e) for e in x.values()])
+
+    # async def 定义的函数：等 await 得到结果时再转换，由 cilly_async 里的解释器负责 await
+    if inspect.isawaitable(x):
+        return AwaitedResult(x)
+
+    error("cilly host", f"不支持的返回值类型: {t.__name__}")
+
+
+# await 时得到转换好的 cilly 值；同步执行时解释器调用 close，关掉里面还没开始的协程
+class AwaitedResult:
+    __slots__ = ("aw",)
+
+    def __init__(self, aw):
+        self.aw = aw
+
+    def __await__(self):
+        return from_py((yield from self.aw.__await__()))
+
+    def close(self):
+        close_awaitable(self.aw)
+
+
+# 没有声明参数个数时从签名得出：只能有固定个数的位置参数
+def signature_arity(name, fn):
+    try:
+        params = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        error("cilly host", f"{name}: 无法读取函数签名，需要声明参数个数")
+
+    arity = 0
+    for p in params:
+        if p.kind == p.VAR_POSITIONAL:
+            error("cilly host", f"{name}: 参数个数不固定，需要声明参数个数")
+        if p.kind in [p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD] and p.default is p.empty:
+            arity += 1
+    return arity
+
+
+# 声明的参数个数和签名对不上时报错；读不到签名的（部分 C 函数）不检查
+def check_arity(name, fn, arity):
+    try:
+        sig = inspect.signature(fn)
+    except (TypeError, ValueError):
+        return
+
+    try:
+        sig.bind(*range(arity))
+    except TypeError:
+        error("cilly host", f"{name}: 声明了 {arity} 个参数，和函数签名 {sig} 不符")
+
+
+# 按 raw/batch 方式转换参数和返回值；常见的参数个数单独生成，省掉打包参数列表
+def adapt(fn, arity, conv):
+    if arity == 0:
+        return lambda: from_py(fn())
+
+    if arity == 1:
+        return lambda a: from_py(fn(conv(a)))
+
+    if arity == 2:
+        return lambda a, b: from_py(fn(conv(a), conv(b)))
+
+    return lambda *args: from_py(fn(*map(conv, args)))
+
+
+class HostRegistry:
+    def __init__(self):
+        self.funcs = {}
+
+    def register(self, name, fn, arity=None, mode="raw"):
+        if not isinstance(name, str) or not name.isidentifier():
+            error("cilly host", f"非法函数名: {name}")
+        if name in self.funcs:
+            error("cilly host", f"重复登记的函数: {name}")
+        if mode not in HOST_MODES:
+            error("cilly host", f"{name}: 未知的调用方式 {mode}，可选 {HOST_MODES}")
+        if not callable(fn):
+            error("cilly host", f"{name}: 不是可调用对象")
+
+        if arity is None:
+            arity = signature_arity(name, fn)
+        else:
+            if not isinstance(arity, int) or arity < 0:
+                error("cilly host", f"{name}: 参数个数必须是非负整数: {arity}")
+            check_arity(name, fn, arity)
+
+        if mode == "raw":
+            fn = adapt(fn, arity, to_py)
+        elif mode == "batch":
+            fn = adapt(fn, arity, to_py_batch)
+
+        f = self.funcs[name] = mk_builtin(name, arity, fn)
+        return f
+
+    # 装饰器形式：@host.function(arity=2)
+    def function(self, name=None, arity=None, mode="raw"):
+        def decorate(fn):
+            self.register(name or fn.__name__, fn, arity, mode)
+            return fn
+
+        return decorate
+
+    def __contains__(self, name):
+        return name in self.funcs
+
+    def __len__(self):
+        return len(self.funcs)
+
+    # cilly_eval 等解释器的全局环境
+    def env(self):
+        return dict(self.funcs)
+
+    # cilly_vm 的最外层作用域：编译时的变量名列表和运行时的值列表，顺序一致
+    def vm_scope(self):
+        return list(self.funcs), list(self.funcs.values())
+
+
+# 参数数组里的数：数值数组直接用底层的 array，普通数组逐个检查拆箱
+def nums(name, v):
+    if v[0] != "array":
+        error(name, "参数必须是数组")
+
+    items = v[1]
+    if type(items) is NumArray:
+        return items.data
+
+    values = []
+    for e in items:
+        if e[0] != "num":
+            error(name, f"数组元素必须是数字: {e}")
+        values.append(e[1])
+    return values
+
+
+def num(name, v):
+    if v[0] != "num":
+        error(name, f"参数必须是数字: {v}")
+    return v[1]
+
+
+# 元素类型 'q' / 'd'，普通列表（类型不定）是 None
+def typecode_of(x):
+    if type(x) is array:
+        return x.typecode
+    if type(x) is int:
+        return "q"
+    if type(x) is float:
+        return "d"
+    return None
+
+
+# 两个操作数运算结果的元素类型：有浮点数就是浮点数
+def result_typecode(x, y):
+    t1, t2 = typecode_of(x), typecode_of(y)
+    if t1 is None or t2 is None:
+        return None
+    return "d" if "d" in [t1, t2] else "q"
+
+
+# numpy 在 array 内存上的视图，不复制
+def view(x):
+    if type(x) is array:
+        return np.frombuffer(x, dtype=np.float64 if x.typecode == "d" else np.int64)
+    return x
+
+
+# 结果列表 -> 数组值，打包不了（类型混杂或超出 64 位）时用普通数组
+def num_result(values, typecode):
+    if typecode is not None:
+        try:
+            return ["array", NumArray(array(typecode, values))]
+        except OverflowError:
+            pass
+
+    data = pack_nums(values)
+    if data is None:
+        return ["array", [["num", x] for x in values]]
+    return ["array", NumArray(data)]
+
+
+def b_num_array(n, init):
+    n = num("num_array", n)
+    x = num("num_array", init)
+    if not isinstance(n, int) or n < 0:
+        error("num_array", f"数组长度必须是非负整数: {n}")
+
+    typecode = typecode_of(x)
+    try:
+        return ["array", NumArray(array(typecode, [x]) * n)]
+    except OverflowError:
+        return ["array", [["num", x]] * n]
+
+
+def b_sum(a):
+    data = nums("sum", a)
+    if np is not None and typecode_of(data) == "d":
+        return ["num", float(np.sum(view(data)))]
+    return ["num", sum(data)]
+
+
+def b_min(a):
+    data = nums("min", a)
+    if len(data) == 0:
+        error("min", "数组不能为空")
+    return ["num", min(data)]
+
+
+def b_max(a):
+    data = nums("max", a)
+    if len(data) == 0:
+        error("max", "数组不能为空")
+    return ["num", max(data)]
+
+
+def b_dot(a, b):
+    x, y = nums("dot", a), nums("dot", b)
+    if len(x) != len(y):
+        error("dot", f"数组长度不一致: {len(x)} 和 {len(y)}")
+
+    if np is not None and result_typecode(x, y) == "d":
+        return ["num", float(np.dot(view(x), view(y)))]
+    return ["num", sum(map(operator.mul, x, y))]
+
+
+# 逐个元素运算 op(x[i], y[i])，y 是数组或一个数
+def elementwise(op, np_op, x, y):
+    typecode = result_typecode(x, y)
+    if np is not None and typecode == "d":
+        out = array("d", bytes(8 * len(x)))
+        np_op(view(x), view(y), out=view(out))
+        return ["array", NumArray(out)]
+
+    if type(y) is int or type(y) is float:
+        y = repeat(y, len(x))
+    return num_result(list(map(op, x, y)), typecode)
+
+
+def b_scale(a, k):
+    x = nums("scale", a)
+    return elementwise(operator.mul, np and np.multiply, x, num("scale", k))
+
+
+def b_add(a, b):
+    x, y = nums("add", a), nums("add", b)
+    if len(x) != len(y):
+        error("add", f"数组长度不一致: {len(x)} 和 {len(y)}")
+    return elementwise(operator.add, np and np.add, x, y)
+
+
+def array_builtins():
+    host = HostRegistry()
+    host.register("num_array", b_num_array, 2, mode="boxed")
+    host.register("sum", b_sum, 1, mode="boxed")
+    host.register("min", b_min, 1, mode="boxed")
+    host.register("max", b_max, 1, mode="boxed")
+    host.register("dot", b_dot, 2, mode="boxed")
+    host.register("scale", b_scale, 2, mode="boxed")
+    host.register("add", b_add, 2, mode="boxed")
+    return host.env()
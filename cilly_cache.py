@@ -0,0 +1,132 @@
+import gc
+import hashlib
+import marshal
+import os
+import tempfile
+
+from cilly_interpreter import PARSER_VERSION, cilly_lexer_compact, cilly_parser
+from cilly_optimizer import OPTIMIZER_VERSION, cilly_optimize
+
+"""
+cilly 解析缓存
+
+和 __pycache__ 类似，把解析好的 AST 用 marshal 序列化后存到源文件旁边的
+__cillycache__ 目录里。缓存文件头记录解析器、优化器的版本和源码内容的 sha256，
+任何一个对不上就重新解析并覆盖，写入时先写临时文件再 os.replace，
+保证其它进程不会读到写了一半的缓存。
+
+解析后默认用 cilly_optimize 按 cilly_eval 的语义优化（optimize="eval"），
+optimize="vm" 时按 vm 的语义，None 时不优化。
+缓存的是优化后的 AST，和 python 的 .opt-1.pyc 一样，每种优化方式单独一个缓存文件。
+"""
+
+CACHE_DIR_NAME = "__cillycache__"
+CACHE_SUFFIX = ".cillyc"
+CACHE_MAGIC = b"CILLYC\0"
+
+
+def source_digest(src):
+    return hashlib.sha256(src.encode("utf-8")).digest()
+
+
+def cache_header(digest):
+    return (
+        CACHE_MAGIC
+        + PARSER_VERSION.to_bytes(4, "little")
+        + OPTIMIZER_VERSION.to_bytes(4, "little")
+        + marshal.version.to_bytes(4, "little")
+        + digest
+    )
+
+
+def opt_suffix(optimize):
+    return CACHE_SUFFIX if optimize is None else f".opt-{optimize}{CACHE_SUFFIX}"
+
+
+def cache_path(filename, cache_dir=None, optimize="eval"):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+
+    return os.path.join(cache_dir, os.path.basename(filename) + opt_suffix(optimize))
+
+
+def cilly_parse_source(src, optimize="eval"):
+    ast = cilly_parser(cilly_lexer_compact(src))
+    if optimize is not None:
+        ast = cilly_optimize(ast, optimize)
+    return ast
+
+
+def read_cache(path, digest):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    header = cache_header(digest)
+    if not data.startswith(header):
+        return None
+
+    # 反序列化会一次性创建大量列表，期间关掉 gc，否则大部分时间都花在 gc 扫描上
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+        # 缓存损坏，当作没有缓存
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def write_cache(path, digest, ast):
+    directory = os.path.dirname(path)
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(cache_header(digest))
+                f.write(marshal.dumps(ast))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        # 目录不可写等情况下不缓存，和 python 的行为一致
+        pass
+
+
+# 带缓存地解析一段源码。filename 为 None 时按内容 hash 命名缓存文件，
+# 放在 cache_dir（默认当前目录下的 __cillycache__）里
+def cilly_parse_cached(src, filename=None, cache_dir=None, optimize="eval"):
+    digest = source_digest(src)
+
+    if filename is None:
+        if cache_dir is None:
+            cache_dir = CACHE_DIR_NAME
+        path = os.path.join(cache_dir, digest.hex()[:32] + opt_suffix(optimize))
+    else:
+        path = cache_path(filename, cache_dir, optimize)
+
+    ast = read_cache(path, digest)
+    if ast is not None:
+        return ast
+
+    ast = cilly_parse_source(src, optimize)
+    write_cache(path, digest, ast)
+
+    return ast
+
+
+def cilly_load_file(filename, cache_dir=None, use_cache=True, optimize="eval"):
+    with open(filename, "r", encoding="utf-8") as f:
+        src = f.read()
+
+    if not use_cache:
+        return cilly_parse_source(src, optimize)
+
+    return cilly_parse_cached(src, filename, cache_dir, optimize)
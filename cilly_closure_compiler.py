@@ -0,0 +1,502 @@
+import operator
+
+from cilly_interpreter import error, mk_proc, val, NULL, TRUE, FALSE
+from cilly_interpreter import lookup_var, define_var
+from cilly_interpreter import mk_struct, struct_shape, struct_cache_miss
+from cilly_interpreter import mk_array, array_store, call_builtin, host_arg
+
+"""
+cilly 闭包编译器
+
+把 AST 一次性编译成嵌套的 python 闭包，每个节点一个闭包，
+运算符、字面量和访问方式都在编译期确定，运行时不再查 visitors 字典，
+也不再比较 tag 字符串。语义（值表示、动态作用域、调用时复制环境、
+错误信息）与 cilly_eval 完全一致，可以直接替换 cilly_eval(ast, env)。
+"""
+
+# 本后端里 break/continue 只会产生这两个对象，循环和块里按 is 判断
+BREAK = ["break"]
+CONTINUE = ["continue"]
+
+NUM_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "^": operator.pow,
+}
+
+BOOL_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def cilly_closure_compile(ast):
+
+    def err(msg):
+        return error("cilly eval", msg)
+
+    # 函数体 AST -> 编译好的闭包。proc 的值表示仍是 ["proc", params, body]，
+    # 调用时按 body 找到对应的闭包；用 id 做键，同时保存 body 本身防止 id 被复用
+    compiled_bodies = {}
+
+    def compile_body(body):
+        entry = compiled_bodies.get(id(body))
+        if entry is None or entry[0] is not body:
+            entry = (body, comp(body))
+            compiled_bodies[id(body)] = entry
+
+        return entry[1]
+
+    def comp_program(node):
+        _, statements = node
+        stats = [comp(s) for s in statements]
+
+        def run(env):
+            r = NULL
+            for s in stats:
+                r = s(env)
+            return r
+
+        return run
+
+    def comp_expr_stat(node):
+        _, e = node
+        return comp(e)
+
+    def comp_print(node):
+        _, args = node
+        args = [comp(a) for a in args]
+
+        def run(env):
+            for a in args:
+                print(a(env)[1], end=" ")
+
+            print("")
+
+            return NULL
+
+        return run
+
+    def comp_for(node):
+        _, init, cond, step, body = node
+        init = comp(init)
+        cond = comp(cond)
+        step = comp(step)
+        body = comp(body)
+
+        def run(env):
+            init(env)
+            while True:
+                if not cond(env)[1]:
+                    break
+                res = body(env)
+                if res is BREAK:
+                    break
+                step(env)
+            return NULL
+
+        return run
+
+    def comp_literal(node):
+        tag = node[0]
+
+        if tag in ["num", "str"]:
+            return lambda env: node
+
+        if tag in ["true", "false"]:
+            v = TRUE if tag == "true" else FALSE
+            return lambda env: v
+
+        if tag == "null":
+            return lambda env: NULL
+
+        return lambda env: err(f"非法字面量{node}")
+
+    def comp_unary(node):
+        _, op, e = node
+        e = comp(e)
+
+        if op == "-":
+            return lambda env: ["num", -e(env)[1]]
+
+        if op == "!":
+            return lambda env: FALSE if e(env)[1] else TRUE
+
+        def run(env):
+            val(e(env))
+            err(f"非法一元运算符{op}")
+
+        return run
+
+    def comp_binary(node):
+        _, op, e1, e2 = node
+        c1 = comp(e1)
+        c2 = comp(e2)
+
+        if op == "&&":
+
+            def run(env):
+                if c1(env)[1] == False:
+                    return FALSE
+                else:
+                    return c2(env)
+
+            return run
+
+        if op == "||":
+
+            def run(env):
+                if c1(env)[1] == True:
+                    return TRUE
+                else:
+                    return c2(env)
+
+            return run
+
+        # 右操作数是数字字面量时把它的值直接捕获进闭包
+        right_const = e2[0] == "num"
+        k = e2[1] if right_const else None
+
+        if op in NUM_OPS:
+            f = NUM_OPS[op]
+            if op == "+":
+                if right_const:
+                    return lambda env: ["num", c1(env)[1] + k]
+                return lambda env: ["num", c1(env)[1] + c2(env)[1]]
+            if op == "-":
+                if right_const:
+                    return lambda env: ["num", c1(env)[1] - k]
+                return lambda env: ["num", c1(env)[1] - c2(env)[1]]
+            if right_const:
+                return lambda env: ["num", f(c1(env)[1], k)]
+            return lambda env: ["num", f(c1(env)[1], c2(env)[1])]
+
+        if op in BOOL_OPS:
+            f = BOOL_OPS[op]
+            if right_const:
+                return lambda env: TRUE if f(c1(env)[1], k) else FALSE
+            return lambda env: TRUE if f(c1(env)[1], c2(env)[1]) else FALSE
+
+        def run(env):
+            val(c1(env))
+            val(c2(env))
+            err(f"非法二元运算符{op}")
+
+        return run
+
+    def comp_if(node):
+        _, cond, true_s, false_s = node
+        cond = comp(cond)
+        true_s = comp(true_s)
+
+        if false_s is None:
+
+            def run(env):
+                if cond(env) == TRUE:
+                    return true_s(env)
+                return NULL
+
+            return run
+
+        false_s = comp(false_s)
+
+        def run(env):
+            if cond(env) == TRUE:
+                return true_s(env)
+            return false_s(env)
+
+        return run
+
+    def comp_if_expr(node):
+        _, cond, true_e, false_e = node
+        cond = comp(cond)
+        true_e = comp(true_e)
+        false_e = comp(false_e)
+
+        return lambda env: true_e(env) if cond(env)[1] else false_e(env)
+
+    def comp_while(node):
+        _, cond, body = node
+        cond = comp(cond)
+        body = comp(body)
+
+        def run(env):
+            r = NULL
+            prev_r = NULL
+            while cond(env) == TRUE:
+                r = body(env)
+                if r is BREAK:
+                    r = prev_r
+                    break
+
+                if r is CONTINUE:
+                    continue
+                prev_r = r
+
+            return r
+
+        return run
+
+    def comp_break(node):
+        return lambda env: BREAK
+
+    def comp_continue(node):
+        return lambda env: CONTINUE
+
+    def comp_block(node):
+        _, statements = node
+        stats = [comp(s) for s in statements]
+
+        def run(env):
+            r = NULL
+
+            for s in stats:
+                r = s(env)
+                if r is BREAK or r is CONTINUE:
+                    return r
+
+            return r
+
+        return run
+
+    def comp_id(node):
+        _, name = node
+
+        def run(env):
+            try:
+                return env[name]
+            except KeyError:
+                return lookup_var(env, name)
+
+        return run
+
+    def comp_define(node):
+        _, name, e = node
+        e = comp(e)
+
+        def run(env):
+            define_var(env, name, e(env))
+            return NULL
+
+        return run
+
+    def comp_assign(node):
+        _, target, value_expr = node
+        value_expr = comp(value_expr)
+        tag = target[0]
+
+        if tag == "id":
+            name = target[1]
+
+            def run(env):
+                value = value_expr(env)
+                if name not in env:
+                    error("set var", f"未定义变量{name}")
+                env[name] = value
+                return NULL
+
+            return run
+
+        if tag == "array_access":
+            arr_expr = comp(target[1])
+            index_expr = comp(target[2])
+
+            def run(env):
+                value = value_expr(env)
+                arr = arr_expr(env)
+                index = index_expr(env)[1]
+                if arr[0] != "array":
+                    error("assign", "只能对数组类型进行索引赋值")
+                if not isinstance(index, int):
+                    error("assign", "数组索引必须是整数")
+                if index < 0 or index >= len(arr[1]):
+                    error("assign", f"数组索引越界: {index}")
+                items = arr[1]
+                if type(items) is list:
+                    items[index] = value
+                else:
+                    array_store(arr, index, value)
+                return NULL
+
+            return run
+
+        if tag == "struct_access":
+            obj_expr = comp(target[1])
+            field = target[2]
+            cache = [None, 0]
+
+            def run(env):
+                value = value_expr(env)
+                obj = obj_expr(env)
+                if obj[0] != "struct":
+                    error("assign", "只能对结构体类型进行属性赋值")
+                fields = obj[1]
+                if fields.shape is cache[0]:
+                    fields.values[cache[1]] = value
+                else:
+                    fields.values[struct_cache_miss(fields, field, cache, "assign")] = value
+                return NULL
+
+            return run
+
+        def run(env):
+            value_expr(env)
+            err("非法的左值表达式")
+
+        return run
+
+    def comp_return(node):
+        _, e = node
+
+        if e is None:
+            return lambda env: NULL
+
+        return comp(e)
+
+    def comp_fun_expr(node):
+        _, params, body = node
+        compile_body(body)
+
+        return lambda env: mk_proc(params, body)
+
+    def comp_fun_def(node):
+        _, name, params, body = node
+        compile_body(body)
+
+        def run(env):
+            define_var(env, name, ["proc", params, body])
+            return NULL
+
+        return run
+
+    def comp_array(node):
+        _, elements = node
+        elements = [comp(e) for e in elements]
+
+        return lambda env: mk_array([e(env) for e in elements])
+
+    def comp_struct(node):
+        _, fields = node
+        shape = struct_shape(fields)
+        fields = [comp(e) for e in fields.values()]
+
+        return lambda env: mk_struct(shape, [e(env) for e in fields])
+
+    def comp_array_access(node):
+        _, arr_expr, index_expr = node
+        arr_expr = comp(arr_expr)
+        index_expr = comp(index_expr)
+
+        def run(env):
+            arr = arr_expr(env)
+            index = index_expr(env)[1]
+
+            if arr[0] != "array":
+                err("只能对数组类型进行索引访问")
+            if not isinstance(index, int):
+                err("数组索引必须是整数")
+            if index < 0 or index >= len(arr[1]):
+                err(f"数组索引越界: {index}")
+            return arr[1][index]
+
+        return run
+
+    def comp_struct_access(node):
+        _, obj_expr, field = node
+        obj_expr = comp(obj_expr)
+        # 这一处访问的内联缓存 [形状, 槽位]
+        cache = [None, 0]
+
+        def run(env):
+            obj = obj_expr(env)
+
+            if obj[0] != "struct":
+                error("struct_access", "只能对结构体类型进行属性访问")
+            fields = obj[1]
+            if fields.shape is cache[0]:
+                return fields.values[cache[1]]
+            return fields.values[struct_cache_miss(fields, field, cache, "struct_access")]
+
+        return run
+
+    def comp_call(node):
+        _, f_expr, args = node
+        f_expr = comp(f_expr)
+        args = [comp(a) for a in args]
+        argc = len(args)
+
+        def run(env):
+            f = f_expr(env)
+            if isinstance(f, list) and f[0] == "proc":
+                _, params, body = f
+                evaluated_args = [a(env) for a in args]
+                if len(params) != argc:
+                    err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {argc} 个")
+                local_env = env.copy()
+                for param, arg in zip(params, evaluated_args):
+                    local_env[param] = arg
+                return compile_body(body)(local_env)
+            elif isinstance(f, list) and f[0] == "builtin":
+                return call_builtin(f, [a(env) for a in args])
+            elif callable(f):
+                evaluated_args = [host_arg(a(env)) for a in args]
+                try:
+                    f(*evaluated_args)
+                    return NULL
+                except Exception as e:
+                    err(f"调用 Python 函数时出错: {e}")
+            else:
+                err(f"非法函数: {f}")
+
+        return run
+
+    compilers = {
+        "program": comp_program,
+        "expr_stat": comp_expr_stat,
+        "print": comp_print,
+        "if": comp_if,
+        "while": comp_while,
+        "break": comp_break,
+        "continue": comp_continue,
+        "block": comp_block,
+        "define": comp_define,
+        "assign": comp_assign,
+        "unary": comp_unary,
+        "binary": comp_binary,
+        "return": comp_return,
+        "fun_expr": comp_fun_expr,
+        "call": comp_call,
+        "id": comp_id,
+        "num": comp_literal,
+        "str": comp_literal,
+        "true": comp_literal,
+        "false": comp_literal,
+        "null": comp_literal,
+        "for": comp_for,
+        "fun_def": comp_fun_def,
+        "if_expr": comp_if_expr,
+        "array": comp_array,
+        "struct": comp_struct,
+        "array_access": comp_array_access,
+        "struct_access": comp_struct_access,
+    }
+
+    def comp(node):
+        tag = node[0]
+        if tag not in compilers:
+            # 与 cilly_eval 一样，执行到这个节点时才报错
+            return lambda env: err(f"非法节点{node}")
+
+        return compilers[tag](node)
+
+    return comp(ast)
+
+
+def cilly_eval_closure(ast, env):
+    return cilly_closure_compile(ast)(env)
@@ -1,29 +1,35 @@
 import time
-from cilly_interpreter import cilly_parser, cilly_lexer, cilly_eval
+import tracemalloc
+from cilly_interpreter import cilly_parser, cilly_lexer, cilly_eval, cilly_lexers, cilly_lexer_compact
 from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+from cilly_cache import cilly_parse_cached
+from cilly_closure_compiler import cilly_closure_compile
+from cilly_unboxed import cilly_eval_unboxed
+from cilly_resolver import cilly_resolve, cilly_eval_resolved
+from cilly_memo import MemoCache
+from cilly_transpiler import cilly_run_python
+from cilly_builtins import array_builtins
 
 
-def time_interpreter(test_code, runs=100):
+def time_interpreter(test_code, runs=100, optimize="eval"):
     total = 0
     for _ in range(runs):
         env = {}
-        tokens = cilly_lexer(test_code)
-        ast = cilly_parser(tokens)
-
+        ast = cilly_parse_cached(test_code, optimize=optimize)
 
         start = time.perf_counter()
         cilly_eval(ast, env)
         total += time.perf_counter() - start
 
     avg_time = total / runs
-    print(f"[解释器] 平均耗时 ({runs}次): {avg_time:.6f}秒")
+    label = "解释器" if optimize is not None else "解释器，不做 AST 优化"
+    print(f"[{label}] 平均耗时 ({runs}次): {avg_time:.6f}秒")
     return avg_time
 
 
 def time_vm_compiler(test_code, runs=100):
     total = 0
-    tokens = cilly_lexer(test_code)
-    ast = cilly_parser(tokens)
+    ast = cilly_parse_cached(test_code, optimize="vm")
 
     code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
 
@@ -37,6 +43,234 @@ def time_vm_compiler(test_code, runs=100):
     return avg_time
 
 
+def time_closure(test_code, runs=100):
+    total = 0
+    ast = cilly_parse_cached(test_code)
+
+    # 只编译一次，和虚拟机一样只统计执行时间
+    run = cilly_closure_compile(ast)
+
+    for _ in range(runs):
+        env = {}
+        start = time.perf_counter()
+        run(env)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    print(f"[闭包编译] 平均耗时 ({runs}次): {avg_time:.6f}秒")
+    return avg_time
+
+
+def time_unboxed(test_code, runs=100):
+    total = 0
+    ast = cilly_parse_cached(test_code)
+
+    for _ in range(runs):
+        env = {}
+        start = time.perf_counter()
+        cilly_eval_unboxed(ast, env)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    print(f"[非装箱解释器] 平均耗时 ({runs}次): {avg_time:.6f}秒")
+    return avg_time
+
+
+def time_resolved(test_code, runs=100):
+    total = 0
+    ast = cilly_resolve(cilly_parse_cached(test_code))
+
+    for _ in range(runs):
+        env = {}
+        start = time.perf_counter()
+        cilly_eval_resolved(ast, env)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    print(f"[词法作用域解释器] 平均耗时 ({runs}次): {avg_time:.6f}秒")
+    return avg_time
+
+
+def time_memo(test_code, runs=10, maxsize=1024):
+    total = 0
+    ast = cilly_parse_cached(test_code)
+
+    for _ in range(runs):
+        memo = MemoCache(ast, maxsize)
+        start = time.perf_counter()
+        cilly_eval(ast, {}, memo=memo)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    stats = memo.stats()
+    print(f"[记忆化解释器] 平均耗时 ({runs}次): {avg_time:.6f}秒, 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次")
+    return avg_time
+
+
+def time_python(test_code, runs=100):
+    total = 0
+    # 第一次运行时转译并缓存代码对象，不计入耗时
+    cilly_run_python(test_code, {})
+
+    for _ in range(runs):
+        env = {}
+        start = time.perf_counter()
+        cilly_run_python(test_code, env)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    print(f"[python 转译] 平均耗时 ({runs}次): {avg_time:.6f}秒")
+    return avg_time
+
+
+def time_lexer(test_code, runs=10):
+    size_mb = len(test_code.encode("utf-8")) / (1024 * 1024)
+    results = {}
+
+    for backend in cilly_lexers:
+        total = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            tokens = cilly_lexer(test_code, backend)
+            total += time.perf_counter() - start
+
+        avg_time = total / runs
+        results[backend] = tokens
+        print(f"[词法-{backend}] 平均耗时 ({runs}次): {avg_time:.6f}秒, {size_mb / avg_time:.2f} MB/s")
+
+    total = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        buf = cilly_lexer_compact(test_code)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    results["compact"] = list(buf)
+    print(f"[词法-compact] 平均耗时 ({runs}次): {avg_time:.6f}秒, {size_mb / avg_time:.2f} MB/s")
+
+    # 所有词法解析器的输出必须一致
+    outputs = list(results.values())
+    if any(ts != outputs[0] for ts in outputs):
+        print("[词法] 警告: 不同词法解析器输出不一致")
+
+    return results
+
+
+def token_memory(test_code):
+    # 比较 token 列表和紧凑 TokenBuffer 的内存占用
+    for name, lexer in [("list", cilly_lexer), ("compact", cilly_lexer_compact)]:
+        tracemalloc.start()
+        tokens = lexer(test_code)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"[词法-{name}] {len(tokens)} 个 token, 占用 {current / (1024 * 1024):.2f} MB")
+        del tokens
+
+
+def gen_program(n):
+    # 生成 n 组语句的大程序，用于词法/语法吞吐测试
+    lines = []
+    for i in range(n):
+        lines.append(f'var v{i} = {i} * 2 + (3.5 - {i}) / 7;')
+        lines.append(f'if (v{i} >= 10 && v{i} != 42) {{ print("value of v{i} is", v{i}); }}')
+    return "\n".join(lines)
+
+
+def gen_statements(n):
+    # 生成恰好 n 条语句、不输出的程序，用于 AST 内存/时间对比
+    lines = []
+    for i in range(n // 2):
+        lines.append(f"var v{i} = ({i} + 1) * 2 - {i} / 4;")
+        lines.append(f"if (v{i} > 10 && v{i} != 42) {{ v{i} = v{i} - 1; }}")
+    return "\n".join(lines)
+
+
+def gen_calls(n):
+    # 调用密集的程序：每条语句都是函数调用语句
+    lines = []
+    for i in range(n):
+        lines.append(f"draw(x{i % 10}, scale(y, {i}), fun(a) {{ return a + {i}; }}(z));")
+        lines.append(f"log(\"step\", {i}, at(pts, {i % 7}).x);")
+    return "\n".join(lines)
+
+
+def time_parser(test_code, runs=5):
+    buf = cilly_lexer_compact(test_code)
+
+    total = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        ast = cilly_parser(buf)
+        total += time.perf_counter() - start
+
+    avg_time = total / runs
+    print(
+        f"[语法] 平均耗时 ({runs}次): {avg_time:.6f}秒, "
+        f"{len(buf) / avg_time:.0f} token/s, {len(ast[1]) / avg_time:.0f} 语句/s"
+    )
+    return avg_time
+
+
+def ast_comparison(n=100000):
+    buf = cilly_lexer_compact(gen_statements(n))
+
+    for mode in ["list", "slots"]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        ast = cilly_parser(buf, mode)
+        parse_time = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        cilly_eval(ast, {})
+        eval_time = time.perf_counter() - start
+
+        print(
+            f"[AST-{mode}] {n} 条语句: 内存 {current / (1024 * 1024):.2f} MB, "
+            f"解析 {parse_time:.3f}秒, 解释执行 {eval_time:.3f}秒"
+        )
+        del ast
+
+
+def num_array_comparison(n=100000):
+    # 数值数组和装箱列表的内存，内置函数和 cilly 循环的速度
+    env = array_builtins()
+    tracemalloc.start()
+    cilly_eval(cilly_parser(cilly_lexer(f"var a = num_array({n}, 1.5);")), env)
+    typed, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del env
+
+    tracemalloc.start()
+    boxed = ["array", [["num", 1.5 + 0 * i] for i in range(n)]]
+    boxed_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del boxed
+    print(f"[数值数组] {n} 个元素: 内存 {typed / (1024 * 1024):.2f} MB, 装箱列表 {boxed_size / (1024 * 1024):.2f} MB")
+
+    loop_code = f"""
+    var a = num_array({n}, 1.5);
+    var s = 0;
+    var i = 0;
+    while (i < {n}) {{
+        s = s + a[i] * a[i];
+        i = i + 1;
+    }}
+    """
+    builtin_code = f"""
+    var a = num_array({n}, 1.5);
+    var s = dot(a, a);
+    """
+    times = []
+    for code in [loop_code, builtin_code]:
+        run = cilly_closure_compile(cilly_parse_cached(code))
+        start = time.perf_counter()
+        run(array_builtins())
+        times.append(time.perf_counter() - start)
+    print(f"[数值数组] 点积: 循环 {times[0]:.4f}秒, dot {times[1]:.4f}秒, 速度提升 {times[0] / times[1]:.1f}倍")
+
+
 if __name__ == "__main__":
     test_code = """
     var i = 5;
@@ -66,5 +300,66 @@ if __name__ == "__main__":
     runs = 1000
     interpreter_avg = time_interpreter(test_code, runs)
     vm_avg = time_vm_compiler(test_code, runs)
+    closure_avg = time_closure(test_code, runs)
+
+    print(f"速度提升: 虚拟机 {interpreter_avg / vm_avg:.1f}倍, 闭包编译 {interpreter_avg / closure_avg:.1f}倍")
+
+    # 循环里的常量表达式和不会执行的调试分支，AST 优化在解析后就把它们算好、删掉
+    const_code = """
+    var s = 0;
+    var i = 0;
+    while (i < 20000) {
+        s = s + 60 * 60 * 24 - 2 ^ 10 / 4;
+        if (false) { print("debug", i, s); }
+        i = i + 1;
+    }
+    """
+    no_opt_avg = time_interpreter(const_code, 10, optimize=None)
+    opt_avg = time_interpreter(const_code, 10)
+    print(f"速度提升: AST 优化 {no_opt_avg / opt_avg:.1f}倍")
+
+    # 紧凑的数值循环，装箱/拆箱开销占比最大
+    numeric_code = """
+    var s = 0;
+    var i = 0;
+    while (i < 20000) {
+        s = s + i * i - (i / 2);
+        i = i + 1;
+    }
+    """
+    interpreter_avg = time_interpreter(numeric_code, 10)
+    unboxed_avg = time_unboxed(numeric_code, 10)
+    python_avg = time_python(numeric_code, 10)
+    print(f"速度提升: 非装箱解释器 {interpreter_avg / unboxed_avg:.1f}倍, python 转译 {interpreter_avg / python_avg:.1f}倍")
+
+    # 全局变量很多时 cilly_eval 每次调用都要复制整个环境
+    call_code = "".join(f"var g{i} = {i};\n" for i in range(200)) + """
+    fun add(a, b) { return a + b; }
+    var s = 0;
+    var i = 0;
+    while (i < 2000) {
+        s = add(s, i);
+        i = i + 1;
+    }
+    """
+    interpreter_avg = time_interpreter(call_code, 10)
+    resolved_avg = time_resolved(call_code, 10)
+    print(f"速度提升: 词法作用域解释器 {interpreter_avg / resolved_avg:.1f}倍")
+
+    fib_code = """
+    var fib = fun(n) { if (n < 2) return n; else return fib(n - 1) + fib(n - 2); };
+    fib(18);
+    """
+    interpreter_avg = time_interpreter(fib_code, 10)
+    memo_avg = time_memo(fib_code, 10)
+    print(f"速度提升: 记忆化 {interpreter_avg / memo_avg:.1f}倍")
+
+    big_code = gen_program(5000)
+    time_lexer(big_code, 5)
+    token_memory(big_code)
+
+    time_parser(gen_calls(5000))
+
+    ast_comparison(100000)
 
-    print(f"速度提升: {interpreter_avg / vm_avg:.1f}倍")
\ No newline at end of file
+    num_array_comparison(100000)
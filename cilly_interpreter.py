@@ -115,10 +115,23 @@ ws : (' ' | '\r' | '\n' | '\t)+
 
 """
 
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from collections.abc import MutableMapping, MutableSequence
+
+
 def error(src, msg):
     raise Exception(f"{src} : {msg}")
 
 
+# 解析到输入末尾时出错，说明输入还不完整，补上更多输入后可能就能解析成功
+class CillyIncompleteError(Exception):
+    pass
+
+
 def mk_tk(tag, val=None):
     return [tag, val]
 
@@ -191,8 +204,8 @@ cilly_keywords = [
 ]
 
 
-# 词法解析器
-def cilly_lexer(prog):
+# 词法解析器（逐字符扫描版本，保留用于对拍）
+def cilly_lexer_char_iter(prog):
 
     def err(msg):
         error("cilly lexer", msg)
@@ -200,16 +213,12 @@ def cilly_lexer(prog):
     peek, match, next = make_str_reader(prog, err)
 
     def program():
-        r = []
-
         while True:
             skip_ws()
             if peek() == "eof":
                 break
 
-            r.append(token())
-
-        return r
+            yield token()
 
     def skip_ws():
         while peek() in [" ", "\t", "\r", "\n"]:
@@ -296,337 +305,747 @@ def cilly_lexer(prog):
     return program()
 
 
+def cilly_lexer_char(prog):
+    return list(cilly_lexer_char_iter(prog))
+
+
+# 单遍正则词法解析器：所有 token 规则合并成一个预编译的交替正则，
+# 用 lastgroup 分派，一次 finditer 扫完整个源码，不再逐字符拼接字符串
+cilly_token_re = re.compile(
+    r"""
+    (?P<ws>[ \t\r\n]+)
+  | (?P<num>[0-9]+(?:\.[0-9]*)?)
+  | (?P<str>"[^"]*")
+  | (?P<id>[_A-Za-z][_A-Za-z0-9]*)
+  | (?P<op>>=|<=|==|!=|&&|\|\||[-(){}\[\],;+*/^:.?><=!&|])
+  | (?P<bad>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+cilly_keyword_set = frozenset(cilly_keywords)
+
+
+def cilly_lexer_regex_iter(prog):
+
+    def err(msg):
+        error("cilly lexer", msg)
+
+    for m in cilly_token_re.finditer(prog):
+        kind = m.lastgroup
+        text = m.group()
+
+        if kind == "ws":
+            continue
+
+        if kind == "op":
+            yield mk_tk(text)
+        elif kind == "id":
+            if text in cilly_keyword_set:
+                yield mk_tk(text)
+            else:
+                yield mk_tk("id", sys.intern(text))
+        elif kind == "num":
+            yield mk_tk("num", float(text) if "." in text else int(text))
+        elif kind == "str":
+            yield mk_tk("str", text[1:-1])
+        elif text == '"':
+            # 未闭合的字符串，与逐字符版本报同样的错误
+            err('期望", 实际eof')
+        else:
+            err(f"非法字符{text}")
+
+
+def cilly_lexer_regex(prog):
+    return list(cilly_lexer_regex_iter(prog))
+
+
+cilly_lexers = {
+    "char": cilly_lexer_char,
+    "regex": cilly_lexer_regex,
+}
+
+# 流式版本：按需产生 token，供 cilly_parser 边读边解析
+cilly_lexer_iters = {
+    "char": cilly_lexer_char_iter,
+    "regex": cilly_lexer_regex_iter,
+}
+
+# 默认词法解析器，可改为 "char" 切回逐字符版本
+LEXER_BACKEND = "regex"
+
+
+def cilly_lexer(prog, backend=None):
+    if backend is None:
+        backend = LEXER_BACKEND
+
+    if backend not in cilly_lexers:
+        error("cilly lexer", f"未知词法解析器: {backend}")
+
+    return cilly_lexers[backend](prog)
+
+
+def cilly_lexer_iter(prog, backend=None):
+    if backend is None:
+        backend = LEXER_BACKEND
+
+    if backend not in cilly_lexer_iters:
+        error("cilly lexer", f"未知词法解析器: {backend}")
+
+    return cilly_lexer_iters[backend](prog)
+
+
 EOF = mk_tk("eof")
 
 
+# 紧凑 token 表示：tag 编码为小整数，值和起始偏移分列存放
+cilly_tk_names = ["eof", "id", "num", "str", "?"] + cilly_keywords + cilly_op1 + [
+    t for c, cc in cilly_op2.items() for t in (c, cc)
+]
+cilly_tk_codes = {name: i for i, name in enumerate(cilly_tk_names)}
+
+TK_EOF = cilly_tk_codes["eof"]
+TK_ID = cilly_tk_codes["id"]
+TK_NUM = cilly_tk_codes["num"]
+TK_STR = cilly_tk_codes["str"]
+
+# 语法分析器用到的 token，peek/match 直接比较编码，不用再查 tag 名
+TK_VAR = cilly_tk_codes["var"]
+TK_PRINT = cilly_tk_codes["print"]
+TK_IF = cilly_tk_codes["if"]
+TK_ELSE = cilly_tk_codes["else"]
+TK_WHILE = cilly_tk_codes["while"]
+TK_BREAK = cilly_tk_codes["break"]
+TK_CONTINUE = cilly_tk_codes["continue"]
+TK_RETURN = cilly_tk_codes["return"]
+TK_FOR = cilly_tk_codes["for"]
+TK_FUN = cilly_tk_codes["fun"]
+TK_LPAREN = cilly_tk_codes["("]
+TK_RPAREN = cilly_tk_codes[")"]
+TK_LBRACKET = cilly_tk_codes["["]
+TK_RBRACKET = cilly_tk_codes["]"]
+TK_LBRACE = cilly_tk_codes["{"]
+TK_RBRACE = cilly_tk_codes["}"]
+TK_SEMI = cilly_tk_codes[";"]
+TK_COMMA = cilly_tk_codes[","]
+TK_ASSIGN = cilly_tk_codes["="]
+TK_COLON = cilly_tk_codes[":"]
+TK_DOT = cilly_tk_codes["."]
+TK_QUESTION = cilly_tk_codes["?"]
+
+
+class TokenBuffer:
+    # tags[i] 是第 i 个 token 的 tag 编码，vals[i] 是它的值（没有值为 None），
+    # offsets[i] 是它在源码中的起始偏移；newlines 是所有换行符的偏移，
+    # 用于把偏移换算成行列号
+    __slots__ = ("src", "tags", "vals", "offsets", "newlines")
+
+    def __init__(self, src):
+        self.src = src
+        self.tags = array("B")
+        self.vals = []
+        self.offsets = array("q")
+        self.newlines = array("q", [m.start() for m in re.finditer("\n", src)])
+
+    def __len__(self):
+        return len(self.tags)
+
+    def tag(self, i):
+        return cilly_tk_names[self.tags[i]]
+
+    def token(self, i):
+        return mk_tk(cilly_tk_names[self.tags[i]], self.vals[i])
+
+    def __iter__(self):
+        for i in range(len(self.tags)):
+            yield self.token(i)
+
+    # 偏移 -> (行, 列)，都从 1 开始
+    def line_col(self, offset):
+        line = bisect_right(self.newlines, offset - 1)
+        if line == 0:
+            col = offset + 1
+        else:
+            col = offset - self.newlines[line - 1]
+        return line + 1, col
+
+    def token_line_col(self, i):
+        if i >= len(self.offsets):
+            return self.line_col(len(self.src))
+        return self.line_col(self.offsets[i])
+
+
+def cilly_lexer_compact(prog):
+
+    def err(msg):
+        error("cilly lexer", msg)
+
+    buf = TokenBuffer(prog)
+    tags = buf.tags
+    vals = buf.vals
+    offsets = buf.offsets
+    codes = cilly_tk_codes
+
+    for m in cilly_token_re.finditer(prog):
+        kind = m.lastgroup
+
+        if kind == "ws":
+            continue
+
+        text = m.group()
+
+        if kind == "op":
+            tags.append(codes[text])
+            vals.append(None)
+        elif kind == "id":
+            if text in cilly_keyword_set:
+                tags.append(codes[text])
+                vals.append(None)
+            else:
+                tags.append(TK_ID)
+                # 同名标识符共享一个字符串对象，大程序的 AST 能省不少内存
+                vals.append(sys.intern(text))
+        elif kind == "num":
+            tags.append(TK_NUM)
+            vals.append(float(text) if "." in text else int(text))
+        elif kind == "str":
+            tags.append(TK_STR)
+            vals.append(text[1:-1])
+        elif text == '"':
+            line, col = buf.line_col(m.start())
+            err(f'期望", 实际eof (第{line}行第{col}列)')
+        else:
+            line, col = buf.line_col(m.start())
+            err(f"非法字符{text} (第{line}行第{col}列)")
+
+        offsets.append(m.start())
+
+    return buf
+
+
+# token reader 的 peek 返回 tag 编码（见 cilly_tk_codes），match 也接受编码。
+# ts 既可以是 token 列表，也可以是 cilly_lexer_iter 产生的迭代器。
+# 解析器不回退，buf 里只保留当前 token 和 peek 预读的 token，
+# 流式解析时内存与整个程序的长度无关
 def make_token_reader(ts, err):
-    pos = -1
+    codes = cilly_tk_codes
+    names = cilly_tk_names
+    pull = iter(ts).__next__
+    buf = []  # buf[0] 是当前 token，后面是预读的 token
     cur = None
-    opos = -1
 
-    # 返回token标识符
+    # 保证当前位置之后第 p 个 token 已读入 buf，流结束时返回 False
+    def fill(p):
+        while p >= len(buf):
+            try:
+                buf.append(pull())
+            except StopIteration:
+                return False
+
+        return True
+
+    # 返回token标识符的编码
     def peek(p=0):
-        if pos + p >= len(ts):
-            return "eof"
+        if not fill(p):
+            return TK_EOF
         else:
-            return tk_tag(ts[pos + p])
+            return codes[tk_tag(buf[p])]
 
     # 匹配给定字符，不是则报错，是则返回当前token
     def match(t):
         if peek() != t:
-            err(f"期望{t},实际为{cur}")
+            err(f"期望{names[t]},实际为{cur}")
 
         return next()
 
     # 读下一个token，返回当前token
+    def next():
+        nonlocal cur
+
+        old = cur
+
+        # 第一次调用时 buf 为空，还没有当前 token
+        if cur is not None and buf:
+            del buf[0]
+
+        if not fill(0):
+            cur = EOF
+        else:
+            cur = buf[0]
+
+        return old
+
+    # 普通 token 没有位置信息
+    def where():
+        return ""
+
+    def line():
+        return None
+
+    next()
+
+    return peek, match, next, where, line
+
+
+# TokenBuffer 可以随机访问，peek 直接返回 tag 编码列里的值，
+# 只有真正被 next 取走的 token 才会生成 [tag, val] 列表
+def make_compact_token_reader(buf, err):
+    names = cilly_tk_names
+    tags = buf.tags
+    n = len(tags)
+    pos = -1
+    cur = None
+
+    def peek(p=0):
+        i = pos + p
+        if i >= n:
+            return TK_EOF
+        else:
+            return tags[i]
+
+    def match(t):
+        if peek() != t:
+            err(f"期望{names[t]},实际为{cur}")
+
+        return next()
+
     def next():
         nonlocal pos, cur
 
         old = cur
         pos = pos + 1
 
-        if pos >= len(ts):
+        if pos >= n:
             cur = EOF
         else:
-            cur = ts[pos]
+            cur = buf.token(pos)
 
         return old
-    
-    def mark():
-        nonlocal opos
-        opos = pos
 
-    def backroll():
-        nonlocal pos, cur
-        pos = opos
-        cur = ts[pos]
+    def where():
+        line, col = buf.token_line_col(pos)
+        return f" (第{line}行第{col}列)"
+
+    # 当前 token 所在的行号
+    def line():
+        return buf.token_line_col(pos)[0]
 
     next()
 
-    return peek, match, next, mark, backroll
+    return peek, match, next, where, line
+
+
+# AST 节点字段。每个字段的种类: node 子节点, nodes 子节点列表,
+# fields 字段名到子节点的字典, 其余为原样保存的值（运算符、变量名、参数列表等）
+cilly_ast_fields = {
+    "program": (("statements", "nodes"),),
+    "define": (("name", "raw"), ("expr", "node")),
+    "assign": (("target", "node"), ("expr", "node")),
+    "print": (("args", "nodes"),),
+    "if": (("cond", "node"), ("true_stat", "node"), ("false_stat", "node")),
+    "for": (("init", "node"), ("cond", "node"), ("step", "node"), ("body", "node")),
+    "fun_def": (("name", "raw"), ("params", "raw"), ("body", "node")),
+    "while": (("cond", "node"), ("body", "node")),
+    "continue": (),
+    "break": (),
+    "return": (("expr", "node"),),
+    "block": (("statements", "nodes"),),
+    "expr_stat": (("expr", "node"),),
+    "unary": (("op", "raw"), ("expr", "node")),
+    "fun_expr": (("params", "raw"), ("body", "node")),
+    "array": (("elements", "nodes"),),
+    "struct": (("fields", "fields"),),
+    "binary": (("op", "raw"), ("left", "node"), ("right", "node")),
+    "if_expr": (("cond", "node"), ("true_expr", "node"), ("false_expr", "node")),
+    "call": (("fun", "node"), ("args", "nodes")),
+    "array_access": (("array", "node"), ("index", "node")),
+    "struct_access": (("obj", "node"), ("field", "raw")),
+    "id": (("value", "raw"),),
+    "num": (("value", "raw"),),
+    "str": (("value", "raw"),),
+    "true": (("value", "raw"),),
+    "false": (("value", "raw"),),
+    "null": (("value", "raw"),),
+}
+
+
+# slots 模式的 AST 节点：namedtuple 本身 __slots__ = ()，没有实例 __dict__，
+# 比列表节点省内存，第 0 个字段仍是 tag，原有的 node[0] 和解包写法不用改
+def mk_ast_class(tag, fields):
+    name = "".join(w.capitalize() for w in tag.split("_")) + "Node"
+    return namedtuple(name, ("tag",) + tuple(f for f, _ in fields))
+
+
+cilly_ast_classes = {tag: mk_ast_class(tag, fields) for tag, fields in cilly_ast_fields.items()}
+
+
+# 字面量节点在 slots 模式下也是列表：cilly_eval 等解释器直接把 num/str 节点当作运行时的值
+# （数组元素、结构体字段），必须和 ["num", 1] 这样的值相等、打印相同
+LITERAL_TAGS = {"num", "str", "true", "false", "null"}
+
+
+# 按 cilly_ast_fields 依次给出节点的子节点，list 和 slots 两种 AST 都适用
+def ast_children(node):
+    for (_, kind), v in zip(cilly_ast_fields[node[0]], node[1:]):
+        if v is None or kind == "raw":
+            continue
+
+        if kind == "node":
+            yield v
+        elif kind == "nodes":
+            yield from v
+        elif kind == "fields":
+            yield from v.values()
+
+
+def mk_list_node(*n):
+    return list(n)
+
+
+def mk_slots_node(tag, *fields):
+    if tag in LITERAL_TAGS:
+        return [tag, *fields]
+    return tuple.__new__(cilly_ast_classes[tag], (tag,) + fields)
+
+
+ast_node_makers = {
+    "list": mk_list_node,
+    "slots": mk_slots_node,
+}
+
+
+# 把列表 AST（例如从 .cillyc 缓存读出来的）转换成 slots AST
+def to_slots_ast(node):
+    if node is None:
+        return None
+
+    tag = node[0]
+    r = [tag]
+
+    for (_, kind), v in zip(cilly_ast_fields[tag], node[1:]):
+        if kind == "node":
+            v = to_slots_ast(v)
+        elif kind == "nodes":
+            v = [to_slots_ast(e) for e in v]
+        elif kind == "fields":
+            v = {k: to_slots_ast(e) for k, e in v.items()}
+        r.append(v)
+
+    return mk_slots_node(*r)
+
+
+# AST 结构有变化时递增，使磁盘上的解析缓存(.cillyc)失效
+PARSER_VERSION = 1
 
 
 # 语法分析器
-def cilly_parser(tokens):
+# lines: 传入字典时记下语句、函数调用和函数节点所在的行，id(节点) -> 行号，
+# 只有 cilly_lexer_compact 产生的 TokenBuffer 带位置信息
+def cilly_parser(tokens, ast_mode="list", lines=None):
     def err(msg):
-        error("cilly parser", msg)
+        if peek() == TK_EOF:
+            raise CillyIncompleteError(f"cilly parser : {msg}{where()}")
+
+        error("cilly parser", msg + where())
 
     def check(msg):
-        if peek() == "eof":
+        if peek() == TK_EOF:
             err(f"需要" + msg)
 
-    peek, match, next, mark, backroll = make_token_reader(tokens, err)
+    if isinstance(tokens, TokenBuffer):
+        reader = make_compact_token_reader(tokens, err)
+    else:
+        reader = make_token_reader(tokens, err)
+
+    peek, match, next, where, line = reader
+
+    if ast_mode not in ast_node_makers:
+        error("cilly parser", f"未知 AST 模式: {ast_mode}")
+
+    mk_node = ast_node_makers[ast_mode]
+
+    # 节点从当前 token 开始时，在解析前取 ln = line()，解析后调用 at_line(ln, 节点)
+    def at_line(ln, node):
+        if lines is not None and ln is not None:
+            lines[id(node)] = ln
+        return node
 
     def program():
 
         r = []
 
-        while peek() != "eof":
+        while peek() != TK_EOF:
             r.append(statement())
 
-        return ["program", r]
+        return mk_node("program", r)
 
     def statement():
+        ln = line()
+        return at_line(ln, statement_by_token())
+
+    def statement_by_token():
         t = peek()
 
         # 变量声明符
-        if t == "var":
+        if t == TK_VAR:
             return define_stat()
 
-        if t == "print":
+        if t == TK_PRINT:
             return print_stat()
 
-        if t == "if":
+        if t == TK_IF:
             return if_stat()
 
-        if t == "while":
+        if t == TK_WHILE:
             return while_stat()
 
-        if t == "break":
+        if t == TK_BREAK:
             return break_stat()
 
-        if t == "continue":
+        if t == TK_CONTINUE:
             return continue_stat()
 
-        if t == "return":
+        if t == TK_RETURN:
             return return_stat()
 
-        if t == "{":
+        if t == TK_LBRACE:
             return block_stat()
 
-        if t == "for":  # 新增 'for'
+        if t == TK_FOR:  # 新增 'for'
             return for_stat()
 
-        if t == "fun":  # 新增 'fun'
+        if t == TK_FUN:  # 新增 'fun'
             return fun_stat()
     
     
         return assign_stat()
 
     def define_stat():
-        match("var")
+        match(TK_VAR)
 
-        id = tk_val(match("id"))
+        id = tk_val(match(TK_ID))
 
-        match("=")
+        match(TK_ASSIGN)
 
         e = expr()
 
-        match(";")
+        match(TK_SEMI)
 
-        return ["define", id, e]
+        return mk_node("define", id, e)
 
     def assign_stat():
 
-        mark()
-
+        # 左边的表达式只解析一次，再根据后面是不是 '=' 决定是赋值语句还是表达式语句
         id = expr()
 
-        if peek() != "=":
-            backroll()
-            return expr_stat()
+        if peek() != TK_ASSIGN:
+            return expr_stat(id)
 
-        match("=")
+        match(TK_ASSIGN)
 
         e = expr()
 
-        if peek() != ")":
-            match(";")
+        if peek() != TK_RPAREN:
+            match(TK_SEMI)
 
-        return ["assign", id, e]
+        return mk_node("assign", id, e)
 
     def print_stat():
-        match("print")
-        match("(")
+        match(TK_PRINT)
+        match(TK_LPAREN)
 
-        if peek() == ")":
+        if peek() == TK_RPAREN:
             alist = []
         else:
             alist = args()
 
-        match(")")
-        match(";")
+        match(TK_RPAREN)
+        match(TK_SEMI)
 
-        return ["print", alist]
+        return mk_node("print", alist)
 
     def args():
 
         r = [expr()]
 
-        while peek() == ",":
-            match(",")
+        while peek() == TK_COMMA:
+            match(TK_COMMA)
             r.append(expr())
 
         return r
 
     def if_stat():  # if ( expr ) statement (else statment)?
-        match("if")
-        match("(")
+        match(TK_IF)
+        match(TK_LPAREN)
         cond = expr()
-        match(")")
+        match(TK_RPAREN)
 
         check("一个语句")
         true_stat = statement()
 
-        if peek() == "else":
-            match("else")
+        if peek() == TK_ELSE:
+            match(TK_ELSE)
             check("一个语句")
             false_stat = statement()
         else:
             false_stat = None
-        return ["if", cond, true_stat, false_stat]
+        return mk_node("if", cond, true_stat, false_stat)
 
     def for_stat():
-        match("for")
-        match("(")
+        match(TK_FOR)
+        match(TK_LPAREN)
 
         init = assign_stat()
         # print(init)
-        # match(";")
+        # match(TK_SEMI)
         cond = expr()
         # print(cond)
-        match(";")
+        match(TK_SEMI)
         step = assign_stat()
         # print(step)
-        match(")")
+        match(TK_RPAREN)
 
         check("一个语句")
         body = statement()
 
-        return ["for", init, cond, step, body]
+        return mk_node("for", init, cond, step, body)
 
     def fun_stat():
-        match("fun")
-        id = tk_val(match("id"))
-        match("(")
-        if peek() == ")":
+        match(TK_FUN)
+        id = tk_val(match(TK_ID))
+        match(TK_LPAREN)
+        if peek() == TK_RPAREN:
             alist = []
         else:
             alist = params()
-        match(")")
+        match(TK_RPAREN)
         check("一个语句")
         body = statement()
-        return ["fun_def", id, alist, body]
+        return mk_node("fun_def", id, alist, body)
 
     def while_stat():
-        match("while")
-        match("(")
+        match(TK_WHILE)
+        match(TK_LPAREN)
         cond = expr()
-        match(")")
+        match(TK_RPAREN)
         check("一个语句")
         body = statement()
-        return ["while", cond, body]
+        return mk_node("while", cond, body)
 
     def continue_stat():
-        match("continue")
-        match(";")
-        return ["continue"]
+        match(TK_CONTINUE)
+        match(TK_SEMI)
+        return mk_node("continue")
 
     def break_stat():
-        match("break")
-        match(";")
-        return ["break"]
+        match(TK_BREAK)
+        match(TK_SEMI)
+        return mk_node("break")
 
     def return_stat():
-        match("return")
-        if peek() != ";":
+        match(TK_RETURN)
+        if peek() != TK_SEMI:
             e = expr()
         else:
             e = None
-        match(";")
-        return ["return", e]
+        match(TK_SEMI)
+        return mk_node("return", e)
 
     def block_stat():
-        match("{")
+        match(TK_LBRACE)
         r = []
         check("一个语句")
-        while peek() != "}":
+        while peek() != TK_RBRACE:
             r.append(statement())
 
-        match("}")
-        return ["block", r]
+        match(TK_RBRACE)
+        return mk_node("block", r)
 
-    def expr_stat():
-        e = expr()
-        match(";")
-        return ["expr_stat", e]
+    def expr_stat(e):
+        match(TK_SEMI)
+        return mk_node("expr_stat", e)
 
     def literal(bp=0):
-        return next()
+        if ast_mode == "list":
+            return next()
+
+        t = next()
+        return mk_node(tk_tag(t), tk_val(t))
 
     def unary(bp):
         op = tk_tag(next())
         e = expr(bp)
 
-        return ["unary", op, e]
+        return mk_node("unary", op, e)
 
     def fun_expr(bp=0):
-        match("fun")
-        match("(")
-        if peek() == ")":
+        ln = line()
+        match(TK_FUN)
+        match(TK_LPAREN)
+        if peek() == TK_RPAREN:
             plist = []
         else:
             plist = params()
 
-        match(")")
+        match(TK_RPAREN)
 
         check("block_statement")
         body = block_stat()
 
-        return ["fun_expr", plist, body]
+        return at_line(ln, mk_node("fun_expr", plist, body))
 
     def params():
-        r = [tk_val(match("id"))]
+        r = [tk_val(match(TK_ID))]
 
-        while peek() == ",":
-            match(",")
-            r.append(tk_val(match("id")))
+        while peek() == TK_COMMA:
+            match(TK_COMMA)
+            r.append(tk_val(match(TK_ID)))
 
         return r
 
     def parens(bp=0):
-        match("(")
+        match(TK_LPAREN)
 
         e = expr()
 
-        match(")")
+        match(TK_RPAREN)
 
         return e
 
     def array_expr(bp=0):
-        match("[")
+        match(TK_LBRACKET)
         elements = []
         while True:
-            if peek() == ",":
-                elements.append(mk_tk("null"))
-                match(",")
-            elif peek() == "]":
-                elements.append(mk_tk("null"))
+            if peek() == TK_COMMA:
+                elements.append(mk_node("null", None))
+                match(TK_COMMA)
+            elif peek() == TK_RBRACKET:
+                elements.append(mk_node("null", None))
                 break    
             else:
                 elements.append(expr()) 
-                if peek() == "]":
+                if peek() == TK_RBRACKET:
                     break
-                match(",")
-        match("]")
-        return ["array", elements]
+                match(TK_COMMA)
+        match(TK_RBRACKET)
+        return mk_node("array", elements)
 
     def struct_expr(bp=0):
-        match("{")
+        match(TK_LBRACE)
         fields = {}
-        if peek() != "}":
-            key = tk_val(match("id"))
-            match(":")
+        if peek() != TK_RBRACE:
+            key = tk_val(match(TK_ID))
+            match(TK_COLON)
             value = expr()
             fields[key] = value
-            while peek() == ",":
-                match(",")
-                key = tk_val(match("id"))
-                match(":")
+            while peek() == TK_COMMA:
+                match(TK_COMMA)
+                key = tk_val(match(TK_ID))
+                match(TK_COLON)
                 value = expr()
                 fields[key] = value                
-        match("}")
-        return ["struct", fields]
+        match(TK_RBRACE)
+        return mk_node("struct", fields)
 
     op1 = {
         "id": (100, literal),
@@ -642,53 +1061,55 @@ def cilly_parser(tokens):
         "[": (100, array_expr),
         "{" : (100, struct_expr),
     }
+    op1 = {cilly_tk_codes[t]: v for t, v in op1.items()}
 
     def get_op1_parser(t):
         if t not in op1:
-            err(f"非法token: {t}")
+            err(f"非法token: {cilly_tk_names[t]}")
 
         return op1[t]
 
     def binary(left, bp):
         op = tk_tag(next())
         right = expr(bp)
-        return ["binary", op, left, right]
+        return mk_node("binary", op, left, right)
 
     def if_expr(left, bp=0):
-        match("?")
+        match(TK_QUESTION)
         true_expr = expr(bp)
-        match(":")
+        match(TK_COLON)
         false_expr = expr(bp)
-        return ["if_expr", left, true_expr, false_expr]
+        return mk_node("if_expr", left, true_expr, false_expr)
 
     def call(fun_expr, bp=0):
-        match("(")
-        if peek() != ")":
+        ln = line()
+        match(TK_LPAREN)
+        if peek() != TK_RPAREN:
             alist = args()
         else:
             alist = []
-        match(")")
-        return ["call", fun_expr, alist]
+        match(TK_RPAREN)
+        return at_line(ln, mk_node("call", fun_expr, alist))
 
     # def assign_expr(left, bp):
     #     # 处理形如 id = expr 的赋值表达式, 用于for循环
     #     if left[0] != "id":
     #         error(f"赋值表达式左侧必须为标识符，实际得到 {left}")
 
-    #     match("=")
+    #     match(TK_ASSIGN)
     #     value = expr(bp)
     #     return ["assign", left, value]
 
     def array_access_expr(left, bp=0):
-        match("[")
+        match(TK_LBRACKET)
         index = expr()
-        match("]")
-        return ["array_access", left, index]
+        match(TK_RBRACKET)
+        return mk_node("array_access", left, index)
 
     def struct_access_expr(left, bp=0):
-        match(".")
-        field = tk_val(match("id"))
-        return ["struct_access", left, field]
+        match(TK_DOT)
+        field = tk_val(match(TK_ID))
+        return mk_node("struct_access", left, field)
 
     op2 = {
         "*": (80, 81, binary),
@@ -711,6 +1132,7 @@ def cilly_parser(tokens):
         "[": (90, 91, array_access_expr),
         ".": (90, 91, struct_access_expr),
     }
+    op2 = {cilly_tk_codes[t]: v for t, v in op2.items()}
 
     def get_op2_parser(t):
         if t not in op2:
@@ -739,6 +1161,70 @@ def cilly_parser(tokens):
     return program()
 
 
+# 交互环境用的增量解析器。每次 feed 只对新输入的文本做词法分析和括号计数，
+# 括号配平后才尝试解析积攒下来的 token，返回值是带标签的结果：
+#   ["complete", ast]  已构成完整的程序
+#   ["incomplete"]     还需要更多输入
+#   ["error", msg]     输入有错，状态已清空
+def make_incremental_parser(ast_mode="list"):
+    tokens = []
+    pending = ""  # 未闭合字符串所在的文本，等字符串闭合后再一起做词法分析
+    depth = 0  # 未闭合的 ( [ { 数量
+
+    opens = {"(", "[", "{"}
+    closes = {")", "]", "}"}
+
+    def reset():
+        nonlocal tokens, pending, depth
+        tokens = []
+        pending = ""
+        depth = 0
+
+    def has_pending():
+        return bool(tokens) or pending != ""
+
+    def feed(text):
+        nonlocal pending, depth
+
+        # 语言没有转义字符，引号个数为奇数说明字符串还没结束
+        text = pending + text
+        if text.count('"') % 2 == 1:
+            pending = text
+            return ["incomplete"]
+        pending = ""
+
+        try:
+            new_tokens = cilly_lexer(text)
+        except Exception as e:
+            reset()
+            return ["error", str(e)]
+
+        for t in new_tokens:
+            tag = tk_tag(t)
+            if tag in opens:
+                depth += 1
+            elif tag in closes:
+                depth -= 1
+
+        tokens.extend(new_tokens)
+
+        if not tokens or depth > 0:
+            return ["incomplete"]
+
+        try:
+            ast = cilly_parser(tokens, ast_mode)
+        except CillyIncompleteError:
+            return ["incomplete"]
+        except Exception as e:
+            reset()
+            return ["error", str(e)]
+
+        reset()
+        return ["complete", ast]
+
+    return feed, reset, has_pending
+
+
 def mk_num(i):
     return ["num", i]
 
@@ -762,6 +1248,319 @@ def mk_proc(params, body):
 NULL = ["null", None]
 
 
+# 结构体是 ["struct", StructFields]，字段值按槽位存在 values 列表里，
+# 字段名 -> 槽位的字典是它的形状 shape。字段名和顺序都相同的结构体共享同一个形状，
+# cilly 不能给结构体增加字段，形状创建后不再改变，比较形状用 is 就够了
+struct_shapes = {}
+
+
+def struct_shape(names):
+    names = tuple(names)
+    shape = struct_shapes.get(names)
+    if shape is None:
+        shape = struct_shapes[names] = {name: i for i, name in enumerate(names)}
+    return shape
+
+
+class StructFields:
+    __slots__ = ("shape", "values")
+
+    def __init__(self, shape, values):
+        self.shape = shape
+        self.values = values
+
+    # 字段名 -> 值
+    def as_dict(self):
+        return dict(zip(self.shape, self.values))
+
+    # 和原来的字段字典一样，空结构体是假值
+    def __len__(self):
+        return len(self.values)
+
+    # 打印和比较的结果与字段字典一样
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def __eq__(self, other):
+        if not isinstance(other, StructFields):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        if not isinstance(other, StructFields):
+            return NotImplemented
+        return self.as_dict() != other.as_dict()
+
+    __hash__ = None
+
+
+def mk_struct(shape, values):
+    return ["struct", StructFields(shape, values)]
+
+
+# 字段访问处的内联缓存 cache = [形状, 槽位]，与上次见到的结构体形状相同时直接按槽位读写；
+# 形状不同时调用这个函数查出槽位并更新缓存，src 是出错时报告的来源
+def struct_cache_miss(fields, field, cache, src):
+    shape = fields.shape
+    slot = shape.get(field)
+    if slot is None:
+        error(src, f"不存在的字段: {field}")
+
+    cache[0] = shape
+    cache[1] = slot
+    return slot
+
+
+# 数值数组：元素都是 int（array('q')）或都是 float（array('d')）的数组不装箱存放，
+# 还是 ["array", NumArray]，NumArray 和元素列表一样支持 len、下标读（返回装箱值）、
+# 迭代和打印，原来按列表处理数组的代码不用改。
+# 写入类型不同的值（或超出 64 位的整数）时，由 array_store 把它换回普通列表
+class NumArray:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return ["num", self.data[index]]
+
+    def __iter__(self):
+        for x in self.data:
+            yield ["num", x]
+
+    # 装箱的元素列表
+    def boxed(self):
+        return [["num", x] for x in self.data]
+
+    # 写入非装箱的数，放不下时返回 False
+    def store_raw(self, index, x):
+        if type(x) is not (int if self.data.typecode == "q" else float):
+            return False
+
+        try:
+            self.data[index] = x
+        except OverflowError:
+            return False
+        return True
+
+    def store(self, index, value):
+        return value[0] == "num" and self.store_raw(index, value[1])
+
+    def __repr__(self):
+        return repr(self.boxed())
+
+    def __eq__(self, other):
+        if isinstance(other, NumArray):
+            return self.data == other.data
+        # 非装箱解释器里的普通数组存放的是不装箱的数
+        if isinstance(other, list):
+            return other == self.boxed() or other == self.data.tolist()
+        return NotImplemented
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        return r if r is NotImplemented else not r
+
+    __hash__ = None
+
+
+# 少于这么多个元素的数组字面量仍用普通列表：下标读写列表更快，小数组也省不了多少内存
+NUM_ARRAY_MIN_LEN = 16
+
+
+# 元素都是 int 或都是 float 时打包成 array('q') / array('d')，否则返回 None
+def pack_nums(values):
+    if not values:
+        return None
+
+    t = type(values[0])
+    if t is int:
+        typecode = "q"
+    elif t is float:
+        typecode = "d"
+    else:
+        return None
+
+    for x in values:
+        if type(x) is not t:
+            return None
+
+    try:
+        return array(typecode, values)
+    except OverflowError:
+        return None
+
+
+# 数组字面量的值，items 是装箱的元素
+def mk_array(items):
+    if len(items) < NUM_ARRAY_MIN_LEN:
+        return ["array", items]
+
+    values = []
+    for v in items:
+        if v[0] != "num":
+            return ["array", items]
+        values.append(v[1])
+
+    data = pack_nums(values)
+    if data is None:
+        return ["array", items]
+    return ["array", NumArray(data)]
+
+
+# 给数组元素赋值，下标已经检查过
+def array_store(arr, index, value):
+    items = arr[1]
+    if type(items) is not NumArray:
+        items[index] = value
+    elif not items.store(index, value):
+        items = arr[1] = items.boxed()
+        items[index] = value
+
+
+# python 实现的内置函数，参数和返回值都是装箱值：["builtin", name, arity, fn]
+def mk_builtin(name, arity, fn):
+    return ["builtin", name, arity, fn]
+
+
+def call_builtin(f, evaluated_args):
+    _, name, arity, fn = f
+    if len(evaluated_args) != arity:
+        error(name, f"参数数量不匹配: 期望 {arity} 个，实际 {len(evaluated_args)} 个")
+    return fn(*evaluated_args)
+
+
+# 结构体、数组里存放的元素 -> 旧式 python 函数看到的值：嵌套的结构体、数值数组也换成视图
+def host_elem(v):
+    t = type(v[1])
+    if t is StructFields:
+        return ["struct", StructView(v[1])]
+    if t is NumArray:
+        return ["array", ArrayView(v)]
+    return v
+
+
+# python 函数写入的值 -> 存放的元素：视图换回它背后的结构体、数组
+def host_store(v):
+    x = v[1]
+    if isinstance(x, StructView):
+        return ["struct", x.fields]
+    if isinstance(x, ArrayView):
+        return x.arr
+    return v
+
+
+# 旧式 python 函数看到的结构体：字段名 -> 值 的 dict，读写都直接作用在结构体上。
+# 增加、删除字段时结构体换成新的形状，字段访问处的内联缓存比较形状时不会再命中。
+# load / save 在存放的元素和 python 函数看到的装箱值之间转换，非装箱解释器里覆盖它们
+class StructView(MutableMapping):
+    __slots__ = ("fields",)
+
+    load = staticmethod(host_elem)
+    save = staticmethod(host_store)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __getitem__(self, name):
+        return self.load(self.fields.values[self.fields.shape[name]])
+
+    def __setitem__(self, name, value):
+        fields = self.fields
+        slot = fields.shape.get(name)
+        if slot is None:
+            fields.shape = struct_shape([*fields.shape, name])
+            fields.values.append(self.save(value))
+        else:
+            fields.values[slot] = self.save(value)
+
+    def __delitem__(self, name):
+        fields = self.fields
+        slot = fields.shape[name]
+        fields.shape = struct_shape([n for n in fields.shape if n != name])
+        del fields.values[slot]
+
+    def __iter__(self):
+        return iter(self.fields.shape)
+
+    def __len__(self):
+        return len(self.fields.values)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# 旧式 python 函数看到的数组：装箱元素的 list，读写都直接作用在数组 arr 上。
+# 写入的值放不进 NumArray、或者改变数组长度时，数组换回普通列表；load / save 同 StructView
+class ArrayView(MutableSequence):
+    __slots__ = ("arr",)
+
+    load = staticmethod(host_elem)
+    save = staticmethod(host_store)
+
+    def __init__(self, arr):
+        self.arr = arr
+
+    def list_items(self):
+        items = self.arr[1]
+        if type(items) is NumArray:
+            items = self.arr[1] = [self.save(v) for v in items]
+        return items
+
+    def __getitem__(self, index):
+        items = self.arr[1]
+        if type(index) is slice:
+            return [self[i] for i in range(*index.indices(len(items)))]
+        if type(items) is NumArray:
+            return items[index]
+        return self.load(items[index])
+
+    def __setitem__(self, index, value):
+        items = self.arr[1]
+        if type(index) is slice:
+            self.list_items()[index] = [self.save(v) for v in value]
+        elif type(items) is not NumArray or not items.store(index, value):
+            self.list_items()[index] = self.save(value)
+
+    def __delitem__(self, index):
+        del self.list_items()[index]
+
+    def insert(self, index, value):
+        self.list_items().insert(index, self.save(value))
+
+    def __len__(self):
+        return len(self.arr[1])
+
+    def __eq__(self, other):
+        return list(self) == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+# 直接放进 env 的旧式 python 函数收到的参数是 val(v)；结构体、数值数组换了存放方式，
+# 这里转换回原来的样子：结构体是 StructView，数值数组是 ArrayView，
+# 和原来的 dict、list 一样可以读写，修改会反映到 cilly 程序里；普通数组本来就是 list
+def host_arg(v):
+    x = v[1]
+    t = type(x)
+    if t is StructFields:
+        return StructView(x)
+    if t is NumArray:
+        return ArrayView(v)
+    return x
+
+
+# 同步执行时内置函数返回的协程不会被 await，要关掉，否则 python 会警告 coroutine was never awaited
+def close_awaitable(aw):
+    close = getattr(aw, "close", None)
+    if close is not None:
+        close()
+
+
 def val(v):
     return v[1]
 
@@ -787,7 +1586,9 @@ def define_var(env, var, val):
     env[var] = val
 
 
-def cilly_eval(ast, env):
+# memo: cilly_memo.MemoCache，传入时缓存纯函数的调用结果
+# profiler: cilly_profiler.Profiler，传入时记录函数耗时和节点执行次数
+def cilly_eval(ast, env, memo=None, profiler=None, out=None):
     def err(msg):
         return error("cilly eval", msg)
 
@@ -815,6 +1616,17 @@ def cilly_eval(ast, env):
 
         return NULL
 
+    # 传入 out 时（见 cilly_output）print 写到 out，输出的文本和 ev_print 相同
+    def ev_print_out(node, env):
+        _, args = node
+
+        for a in args:
+            out.write(str(val(visit(a, env))) + " ")
+
+        out.write("\n")
+
+        return NULL
+
     def ev_for(node, env):
         _, init, cond, step, body = node
         visit(init, env)
@@ -986,7 +1798,7 @@ def cilly_eval(ast, env):
             if index < 0 or index >= len(arr[1]):
                 error("assign", f"数组索引越界: {index}")
             # 执行赋值
-            arr[1][index] = value
+            array_store(arr, index, value)
         elif target[0] == "struct_access":
             # 结构体属性赋值 obj.field = 5
             obj_expr, field = target[1], target[2]
@@ -994,10 +1806,11 @@ def cilly_eval(ast, env):
             # 类型检查
             if obj[0] != "struct":
                 error("assign", "只能对结构体类型进行属性赋值")
-            if field not in obj[1]:
+            slot = obj[1].shape.get(field)
+            if slot is None:
                 error("assign", f"不存在的字段: {field}")
             # 执行赋值
-            obj[1][field] = value
+            obj[1].values[slot] = value
         else:
             err("非法的左值表达式")
         return NULL
@@ -1022,14 +1835,12 @@ def cilly_eval(ast, env):
     def ev_array(node, env):
         _, elements = node
         evaluated_elements = [visit(e, env) for e in elements]
-        return ["array", evaluated_elements]
+        return mk_array(evaluated_elements)
 
     def ev_struct(node, env):
         _, fields = node
-        evaluated_fields = {}
-        for key, value_expr in fields.items():
-            evaluated_fields[key] = visit(value_expr, env)
-        return ["struct", evaluated_fields]
+        values = [visit(value_expr, env) for value_expr in fields.values()]
+        return mk_struct(struct_shape(fields), values)
 
     def ev_array_access(node, env):
         _, arr_expr, index_expr = node
@@ -1053,32 +1864,134 @@ def cilly_eval(ast, env):
         # 类型检查
         if obj[0] != "struct":
             error("struct_access", "只能对结构体类型进行属性访问")
-        if field not in obj[1]:
+        slot = obj[1].shape.get(field)
+        if slot is None:
             error("struct_access", f"不存在的字段: {field}")
-        return obj[1][field]
+        return obj[1].values[slot]
 
-    def ev_call(node, env):
-        _, f_expr, args = node
-        f = visit(f_expr, env)
+    def apply(f, args, env, tail):
         if isinstance(f, list) and f[0] == "proc":
-            _, params, body = f
             evaluated_args = [visit(a, env) for a in args]
-            if len(params) != len(evaluated_args):
-                err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(evaluated_args)} 个")
-            local_env = env.copy()
-            for param, arg in zip(params, evaluated_args):
-                local_env[param] = arg
-            return visit(body, local_env)
+            return call_proc(f, evaluated_args, env, tail)
+        elif isinstance(f, list) and f[0] == "builtin":
+            return call_builtin(f, [visit(a, env) for a in args])
         elif callable(f):
-            evaluated_args = [val(visit(a, env)) for a in args]
-            try:
-                f(*evaluated_args)
-                return NULL
-            except Exception as e:
-                err(f"调用 Python 函数时出错: {e}")
+            evaluated_args = [host_arg(visit(a, env)) for a in args]
+            return call_host(f, evaluated_args)
         else:
             err(f"非法函数: {f}")
 
+    # tail 为真时调用处在尾位置，cilly 函数不在这里执行，
+    # 而是返回 ["tail_call", body, local_env, key]，由外层 call_proc 的循环接着执行；
+    # key 是要缓存结果的调用的键（不缓存时为 None），尾调用的结果就是它自己的结果，
+    # 外层循环拿到最终结果后一起存进缓存
+    def call_proc(f, evaluated_args, env, tail):
+        _, params, body = f
+        if len(params) != len(evaluated_args):
+            err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(evaluated_args)} 个")
+
+        key = None
+        if memo is not None and memo.is_pure_body(body):
+            key = memo.key(("eval", id(body)), evaluated_args)
+            if key is not None:
+                hit, r = memo.lookup(key)
+                if hit:
+                    return r
+
+        local_env = env.copy()
+        for param, arg in zip(params, evaluated_args):
+            local_env[param] = arg
+        if tail:
+            return ["tail_call", body, local_env, key]
+
+        pending = None
+        r = visit_tail(body, local_env)
+        while r[0] == "tail_call":
+            _, body, local_env, tail_key = r
+            if tail_key is not None:
+                if pending is None:
+                    pending = []
+                pending.append(tail_key)
+            r = visit_tail(body, local_env)
+
+        # 最外层的调用最后存，缓存满了先淘汰尾调用链深处的结果
+        if pending is not None:
+            for tail_key in reversed(pending):
+                memo.store(tail_key, r)
+        if key is not None:
+            memo.store(key, r)
+        return r
+
+    def call_host(f, evaluated_args):
+        try:
+            f(*evaluated_args)
+            return NULL
+        except Exception as e:
+            err(f"调用 Python 函数时出错: {e}")
+
+    def ev_call(node, env):
+        _, f_expr, args = node
+        f = visit(f_expr, env)
+        return apply(f, args, env, False)
+
+    # 在尾位置求值：返回值就是所在函数的返回值。
+    # cilly 的 return 不会中断所在的块，块的值是最后一条语句的值，
+    # 所以尾位置是函数体块的最后一条语句，以及其中 if 的分支、return、表达式语句和 ?: 的分支
+    def tail_block(node, env):
+        _, statements = node
+        if not statements:
+            return NULL
+
+        for s in statements[:-1]:
+            r = visit(s, env)
+            if r[0] in ["break", "continue"]:
+                return r
+
+        return visit_tail(statements[-1], env)
+
+    def tail_if(node, env):
+        _, cond, true_s, false_s = node
+
+        if visit(cond, env) == TRUE:
+            return visit_tail(true_s, env)
+
+        if false_s != None:
+            return visit_tail(false_s, env)
+
+        return NULL
+
+    def tail_return(node, env):
+        e = node[1]
+        if e == None:
+            return NULL
+        return visit_tail(e, env)
+
+    def tail_if_expr(node, env):
+        _, cond, true_e, false_e = node
+        c = visit(cond, env)
+        return visit_tail(true_e, env) if val(c) else visit_tail(false_e, env)
+
+    def tail_call(node, env):
+        _, f_expr, args = node
+        f = visit(f_expr, env)
+        return apply(f, args, env, True)
+
+    tail_visitors = {
+        "block": tail_block,
+        "if": tail_if,
+        "return": tail_return,
+        "expr_stat": tail_return,
+        "if_expr": tail_if_expr,
+        "call": tail_call,
+    }
+
+    def visit_tail(node, env):
+        tag = node[0]
+        if tag in tail_visitors:
+            return tail_visitors[tag](node, env)
+
+        return visit(node, env)
+
     visitors = {
         "program": ev_program,
         "expr_stat": ev_expr_stat,
@@ -1117,7 +2030,20 @@ def cilly_eval(ast, env):
 
         return visitors[tag](node, env)
 
-    return visit(ast, env)
+    if out is not None:
+        visitors["print"] = ev_print_out
+
+    # 只在传入 profiler 时替换 visitors 和调用函数，不传时没有额外开销
+    if profiler is not None:
+        call_proc, call_host = profiler.instrument_eval(ast, visitors, tail_visitors, call_proc, call_host)
+
+    if out is None:
+        return visit(ast, env)
+
+    try:
+        return visit(ast, env)
+    finally:
+        out.flush()
 
 
 # p1 = """
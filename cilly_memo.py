@@ -0,0 +1,236 @@
+from collections import OrderedDict
+
+from cilly_interpreter import ast_children
+
+"""
+cilly 纯函数记忆化
+
+analyze_purity 找出程序里的纯函数，MemoCache 按参数缓存它们的返回值，
+cilly_eval(ast, env, memo=memo) 和 cilly_vm(code, consts, scopes, memo=memo, procs=procs) 都可以用
+（procs 是编译时传给 cilly_vm_compiler(..., procs=procs) 的字典）：
+
+    memo = MemoCache(ast, maxsize=1024)
+    cilly_eval(ast, {}, memo=memo)
+    print(memo.stats())
+
+纯函数的判定是保守的，函数体（不含嵌套函数的函数体）里：
+1. 没有 print
+2. 只调用程序顶层定义的纯函数，不调用 python 函数、参数或局部变量里的函数
+3. 只给自己的参数和局部变量赋值，不给数组元素、结构体字段赋值
+4. 读到的变量只有自己的参数、局部变量和顶层的纯函数名
+
+顶层函数名只在定义时出现一次，程序里没有再赋值、重新定义，也没有被用作参数名
+或局部变量名时，才当作固定不变的函数。cilly_eval 是动态作用域，
+调用处的同名变量会遮住函数名，这样就排除了这种情况。
+
+只缓存参数和返回值都是 num/str/bool/null 的调用；数组、结构体是可变的，
+函数值带着作用域，这些调用照常执行。缓存命中时函数体不执行，
+cilly_eval 里函数体 var 定义的变量与调用处变量同名时本该报的错也不会再报。
+"""
+
+SCALAR_TAGS = ["num", "str", "bool", "null"]
+
+
+# 返回纯函数节点（fun_def / fun_expr）的集合，按 id 保存
+def analyze_purity(ast):
+    funs = []
+    top_funs = {}
+    define_count = {}
+    unstable = set()
+
+    def collect(node, in_fun):
+        tag = node[0]
+
+        if tag in ["define", "fun_def"]:
+            name = node[1]
+            define_count[name] = define_count.get(name, 0) + 1
+            if in_fun:
+                unstable.add(name)
+
+        if tag in ["fun_def", "fun_expr"]:
+            funs.append(node)
+            params = node[2] if tag == "fun_def" else node[1]
+            unstable.update(params)
+            in_fun = True
+
+        if tag == "assign" and node[1][0] == "id":
+            unstable.add(node[1][1])
+
+        for c in ast_children(node):
+            collect(c, in_fun)
+
+    collect(ast, False)
+
+    # 顶层的 fun f(...) {...} 和 var f = fun(...) {...}
+    if ast[0] == "program":
+        for s in ast[1]:
+            if s[0] == "fun_def":
+                top_funs[s[1]] = s
+            elif s[0] == "define" and s[2][0] == "fun_expr":
+                top_funs[s[1]] = s[2]
+
+    top_funs = {
+        name: f for name, f in top_funs.items() if name not in unstable and define_count.get(name) == 1
+    }
+
+    # 名字 -> 被定义、赋值或用作参数的次数
+    def count_binds(node, counts):
+        tag = node[0]
+        names = []
+        if tag in ["fun_def", "fun_expr"]:
+            names += node[2] if tag == "fun_def" else node[1]
+        if tag in ["define", "fun_def"]:
+            names.append(node[1])
+        if tag == "assign" and node[1][0] == "id":
+            names.append(node[1][1])
+        for name in names:
+            counts[name] = counts.get(name, 0) + 1
+        for c in ast_children(node):
+            count_binds(c, counts)
+        return counts
+
+    def mentions(node, name):
+        if node[0] == "id" and node[1] == name:
+            return True
+        return any(mentions(c, name) for c in ast_children(node))
+
+    program_binds = count_binds(ast, {})
+
+    # 函数的局部变量：参数，以及函数体最外层定义、定义之前没有读到的名字。
+    # 嵌套的块（if、while 等）里的定义不一定会执行，没执行时读到的是外面的同名变量，
+    # 只有程序里别处没有定义、赋值过这个名字时才当作局部变量
+    def local_names(fun):
+        names = set(fun[2] if fun[0] == "fun_def" else fun[1])
+        body = fun[-1]
+        stmts = body[1] if body[0] == "block" else [body]
+        fun_binds = count_binds(fun, {})
+
+        def walk(node):
+            if node[0] in ["define", "fun_def"] and fun_binds[node[1]] == program_binds[node[1]]:
+                names.add(node[1])
+            if node[0] in ["fun_def", "fun_expr"]:
+                return
+            for c in ast_children(node):
+                walk(c)
+
+        for i, s in enumerate(stmts):
+            if s[0] in ["define", "fun_def"]:
+                name = s[1]
+                if not any(mentions(t, name) for t in stmts[:i]) and not mentions(s, name):
+                    names.add(name)
+            walk(s)
+
+        return names
+
+    def is_pure(fun, pure_names):
+        names = local_names(fun)
+
+        def check(node):
+            tag = node[0]
+
+            if tag == "print":
+                return False
+
+            if tag == "id":
+                return node[1] in names or node[1] in pure_names
+
+            if tag == "assign":
+                target = node[1]
+                if target[0] != "id" or target[1] not in names:
+                    return False
+                return check(node[2])
+
+            if tag == "call":
+                f = node[1]
+                if f[0] != "id" or f[1] in names or f[1] not in pure_names:
+                    return False
+                return all(check(a) for a in node[2])
+
+            # 嵌套函数只是一个值，它的函数体单独判定
+            if tag in ["fun_def", "fun_expr"]:
+                return True
+
+            return all(check(c) for c in ast_children(node))
+
+        return check(fun[-1])
+
+    # 不断去掉不纯的顶层函数，直到不再变化；互相递归的纯函数保留
+    pure_names = set(top_funs)
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure_names):
+            if not is_pure(top_funs[name], pure_names):
+                pure_names.discard(name)
+                changed = True
+
+    return {id(f): f for f in funs if is_pure(f, pure_names)}
+
+
+class MemoCache:
+    def __init__(self, ast, maxsize=1024):
+        if maxsize <= 0:
+            raise ValueError("maxsize 必须大于 0")
+
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.pure_funs = analyze_purity(ast)
+        # cilly_eval 的函数值是 ["proc", params, body]，按函数体识别
+        self.pure_bodies = {id(f[-1]) for f in self.pure_funs.values()}
+
+    def is_pure_body(self, body):
+        return id(body) in self.pure_bodies
+
+    # cilly_vm 的函数值按入口地址识别，procs 是 vm 编译器记录的 入口地址 -> 函数节点
+    def vm_entries(self, procs):
+        return {entry for entry, f in procs.items() if id(f) in self.pure_funs}
+
+    # 参数都是标量时返回缓存的键，否则返回 None
+    def key(self, fun_id, args):
+        k = [fun_id]
+        for a in args:
+            tag = a[0]
+            if tag not in SCALAR_TAGS:
+                return None
+            k.append((tag, type(a[1]), a[1]))
+        return tuple(k)
+
+    # 返回 (是否命中, 值)
+    def lookup(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return True, self.cache[key]
+
+        self.misses += 1
+        return False, None
+
+    def store(self, key, value):
+        if value[0] not in SCALAR_TAGS:
+            return
+
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.cache),
+            "maxsize": self.maxsize,
+            "pure_functions": len(self.pure_funs),
+        }
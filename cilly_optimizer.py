@@ -0,0 +1,342 @@
+import argparse
+import pprint
+import sys
+
+from cilly_interpreter import error, mk_num, to_slots_ast
+
+"""
+cilly AST 优化器
+
+在 cilly_parser 和两个后端之间做 AST 到 AST 的变换：
+1. 常量折叠：字面量上的算术、比较、^、一元运算和 ? : 在编译期算好
+2. 常量分支：if(true)/if(false)/while(false) 直接换成对应分支或删掉
+3. 死代码：块内 break/continue 之后的语句删掉；
+   vm 后端的 RETURN 会真正返回，所以 return 之后的语句也删掉。
+   cilly_eval 的 return 不会中断所在的块，return 之后的语句仍会执行，
+   backend="eval" 时保留它们
+
+只做两个后端结果都不变的变换。条件只折叠 true/false 字面量：
+cilly_eval 的 if/while 判断 == TRUE，vm 判断 == FALSE，
+if(1) 在两个后端的结果本来就不一样，不能替它们决定。
+"""
+
+# 优化结果有变化时递增，使磁盘上优化过的解析缓存(.opt-*.cillyc)失效
+OPTIMIZER_VERSION = 1
+
+LITERALS = ["num", "str", "true", "false", "null"]
+
+# 字面量 tag -> 运行时 val() 的值
+LITERAL_CONSTS = {"true": True, "false": False, "null": None}
+
+# 二元运算在运行时的计算方式和结果类型，与 cilly_eval 的 ev_binary 一致
+FOLD_NUM_OPS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+    "^": lambda a, b: a**b,
+}
+
+FOLD_BOOL_OPS = {
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+# 指数超过这个值就不折叠，避免编译期算出巨大的整数
+MAX_FOLD_EXPONENT = 64
+
+
+def mk_lit_bool(b):
+    return ["true", None] if b else ["false", None]
+
+
+def cilly_optimize(ast, backend="eval"):
+
+    def err(msg):
+        error("cilly optimizer", msg)
+
+    if backend not in ["eval", "vm"]:
+        err(f"未知后端: {backend}")
+
+    return_exits = backend == "vm"
+
+    def is_lit(node):
+        return node[0] in LITERALS
+
+    def lit_val(node):
+        tag = node[0]
+        if tag in LITERAL_CONSTS:
+            return LITERAL_CONSTS[tag]
+        return node[1]
+
+    def is_bool_lit(node):
+        return node[0] in ["true", "false"]
+
+    # 空块在两个后端都是什么也不做、值为 NULL 的语句
+    def empty_stat():
+        return ["block", []]
+
+    def opt_binary(node):
+        _, op, e1, e2 = node
+        e1 = opt(e1)
+        e2 = opt(e2)
+
+        if op == "&&" and is_bool_lit(e1):
+            return e2 if e1[0] == "true" else e1
+
+        if op == "||" and is_bool_lit(e1):
+            return e1 if e1[0] == "true" else e2
+
+        if is_lit(e1) and is_lit(e2):
+            v1, v2 = lit_val(e1), lit_val(e2)
+
+            if op == "*" and (isinstance(v1, str) or isinstance(v2, str)):
+                # "ab" * 100000 这种留到运行时
+                return ["binary", op, e1, e2]
+
+            if op == "^" and isinstance(v2, int) and abs(v2) > MAX_FOLD_EXPONENT:
+                return ["binary", op, e1, e2]
+
+            try:
+                if op in FOLD_NUM_OPS:
+                    return mk_num(FOLD_NUM_OPS[op](v1, v2))
+                if op in FOLD_BOOL_OPS:
+                    return mk_lit_bool(FOLD_BOOL_OPS[op](v1, v2))
+            except Exception:
+                # 除零、类型不匹配等错误留到运行时报
+                pass
+
+        return ["binary", op, e1, e2]
+
+    def opt_unary(node):
+        _, op, e = node
+        e = opt(e)
+
+        if is_lit(e):
+            v = lit_val(e)
+            try:
+                if op == "-":
+                    return mk_num(-v)
+                if op == "!":
+                    return mk_lit_bool(not v)
+            except Exception:
+                pass
+
+        return ["unary", op, e]
+
+    def opt_if_expr(node):
+        _, cond, true_e, false_e = node
+        cond = opt(cond)
+        true_e = opt(true_e)
+        false_e = opt(false_e)
+
+        # 和 opt_if 一样只折叠 true/false，其他字面量作条件时各后端的判断不完全一致
+        if is_bool_lit(cond):
+            return true_e if cond[0] == "true" else false_e
+
+        return ["if_expr", cond, true_e, false_e]
+
+    # 语句被整个删掉时返回 None
+    def opt_if(node):
+        _, cond, true_s, false_s = node
+        cond = opt(cond)
+
+        if is_bool_lit(cond):
+            s = true_s if cond[0] == "true" else false_s
+            return opt_stat(s) if s is not None else None
+
+        true_s = opt_stat(true_s) or empty_stat()
+        if false_s is not None:
+            false_s = opt_stat(false_s) or empty_stat()
+
+        return ["if", cond, true_s, false_s]
+
+    def opt_while(node):
+        _, cond, body = node
+        cond = opt(cond)
+
+        if cond[0] == "false":
+            return None
+
+        return ["while", cond, opt_stat(body) or empty_stat()]
+
+    def opt_for(node):
+        _, init, cond, step, body = node
+        return ["for", opt_stat(init), opt(cond), opt_stat(step), opt_stat(body) or empty_stat()]
+
+    def opt_statements(statements, in_block):
+        r = []
+        removed_last = False
+
+        for i, s in enumerate(statements):
+            s = opt_stat(s)
+            removed_last = s is None
+            if s is None:
+                continue
+
+            r.append(s)
+
+            # 程序顶层的 break 不会中断 cilly_eval 的 ev_program，只在块里删
+            if in_block and (s[0] in ["break", "continue"] or (return_exits and s[0] == "return")):
+                removed_last = False
+                # 后面的语句不会执行，但块开头会预先登记其中 var/fun 定义的名字，
+                # 前面的闭包可能引用它们，只保留定义、去掉初始值
+                for rest in statements[i + 1 :]:
+                    if rest[0] in ["define", "fun_def"]:
+                        r.append(["define", rest[1], ["null", None]])
+                break
+
+        # cilly_eval 里块的值是最后一条语句的值（函数没有 return 时的返回值），
+        # 被删掉的语句值为 NULL，用空块占位保持这个值不变
+        if removed_last and r and not return_exits:
+            r.append(empty_stat())
+
+        return r
+
+    def opt_block(node):
+        _, statements = node
+        return ["block", opt_statements(statements, True)]
+
+    def opt_program(node):
+        _, statements = node
+        return ["program", opt_statements(statements, False)]
+
+    def opt_define(node):
+        _, name, e = node
+        return ["define", name, opt(e)]
+
+    def opt_assign(node):
+        _, target, e = node
+        return ["assign", opt(target), opt(e)]
+
+    def opt_print(node):
+        _, args = node
+        return ["print", [opt(a) for a in args]]
+
+    def opt_return(node):
+        _, e = node
+        return ["return", opt(e) if e is not None else None]
+
+    def opt_expr_stat(node):
+        _, e = node
+        return ["expr_stat", opt(e)]
+
+    def opt_fun_expr(node):
+        _, params, body = node
+        return ["fun_expr", params, opt_stat(body) or empty_stat()]
+
+    def opt_fun_def(node):
+        _, name, params, body = node
+        return ["fun_def", name, params, opt_stat(body) or empty_stat()]
+
+    def opt_call(node):
+        _, f, args = node
+        return ["call", opt(f), [opt(a) for a in args]]
+
+    def opt_array(node):
+        _, elements = node
+        return ["array", [opt(e) for e in elements]]
+
+    def opt_struct(node):
+        _, fields = node
+        return ["struct", {k: opt(e) for k, e in fields.items()}]
+
+    def opt_array_access(node):
+        _, arr, index = node
+        return ["array_access", opt(arr), opt(index)]
+
+    def opt_struct_access(node):
+        _, obj, field = node
+        return ["struct_access", opt(obj), field]
+
+    def opt_leaf(node):
+        return list(node)
+
+    optimizers = {
+        "program": opt_program,
+        "block": opt_block,
+        "expr_stat": opt_expr_stat,
+        "print": opt_print,
+        "if": opt_if,
+        "while": opt_while,
+        "for": opt_for,
+        "break": opt_leaf,
+        "continue": opt_leaf,
+        "define": opt_define,
+        "assign": opt_assign,
+        "return": opt_return,
+        "fun_expr": opt_fun_expr,
+        "fun_def": opt_fun_def,
+        "unary": opt_unary,
+        "binary": opt_binary,
+        "if_expr": opt_if_expr,
+        "call": opt_call,
+        "array": opt_array,
+        "struct": opt_struct,
+        "array_access": opt_array_access,
+        "struct_access": opt_struct_access,
+        "id": opt_leaf,
+        "num": opt_leaf,
+        "str": opt_leaf,
+        "true": opt_leaf,
+        "false": opt_leaf,
+        "null": opt_leaf,
+    }
+
+    def opt(node):
+        tag = node[0]
+        if tag not in optimizers:
+            err(f"非法节点{node}")
+
+        return optimizers[tag](node)
+
+    opt_stat = opt
+
+    r = opt(ast)
+
+    # slots AST 进来的，结果也转成 slots AST
+    if not isinstance(ast, list):
+        r = to_slots_ast(r)
+
+    return r
+
+
+# 命令行: 分别用 --no-opt 和不加参数运行，diff 两次的输出即可看到优化效果
+#   python cilly_optimizer.py prog.cilly --dump ast
+#   python cilly_optimizer.py prog.cilly --dump dis --backend vm
+#   python cilly_optimizer.py prog.cilly --dump run --no-opt
+def main(argv=None):
+    from cilly_cache import cilly_load_file
+    from cilly_interpreter import cilly_eval
+
+    parser = argparse.ArgumentParser(description="cilly AST 优化器")
+    parser.add_argument("file")
+    parser.add_argument("--no-opt", action="store_true", help="不做优化，输出原始结果用于对比")
+    parser.add_argument("--backend", choices=["eval", "vm"], default="eval")
+    parser.add_argument("--dump", choices=["ast", "dis", "run"], default="ast")
+    args = parser.parse_args(argv)
+
+    ast = cilly_load_file(args.file, optimize=None if args.no_opt else args.backend)
+
+    if args.dump == "ast":
+        pprint.pprint(ast)
+    elif args.dump == "dis":
+        from cilly_vm_compiler import cilly_vm_compiler, cilly_vm_dis, vars_name
+
+        code, consts, _ = cilly_vm_compiler(ast, [], [], [])
+        cilly_vm_dis(code, consts, vars_name)
+    elif args.backend == "vm":
+        from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+        code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
+        cilly_vm(code, consts, scopes)
+    else:
+        cilly_eval(ast, {})
+
+
+if __name__ == "__main__":
+    sys.exit(main())
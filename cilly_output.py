@@ -0,0 +1,76 @@
+import sys
+import time
+
+"""
+cilly print 的输出目标
+
+cilly_eval 和 cilly_vm 默认每个 print 参数、每个换行各调用一次 python 的 print，
+输出很多的程序大部分时间花在写 stdout 上。传入 out 参数后 print 的输出改为写到 out：
+
+    out = BufferedSink()                   # 攒够 buffer_size 个字符或隔 flush_interval 秒才写一次 stdout
+    cilly_eval(ast, env, out=out)
+
+    cap = CaptureSink()                    # 输出留在内存里，测试和服务里取结果用
+    cilly_vm(code, consts, scopes, out=cap)
+    print(cap.getvalue())
+
+out 是只要有 write(s) 和 flush() 的对象都可以（例如打开的文件、io.StringIO），
+每次运行传自己的 out，几个程序的输出就不会混在一起。解释器在运行结束（包括出错）时调用 out.flush()。
+输出的文本和默认方式完全相同：每个参数后面一个空格，最后换行。
+
+BufferedSink 只在 write 时检查是否超时，程序长时间不输出时缓冲区里的内容要等到下次输出或运行结束才写出。
+"""
+
+
+class BufferedSink:
+    # stream 为 None 时每次写出时才取 sys.stdout，redirect_stdout 之类的重定向仍然有效
+    def __init__(self, stream=None, buffer_size=8192, flush_interval=0.1):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.parts = []
+        self.size = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        if self.parts:
+            stream.write("".join(self.parts))
+            self.parts.clear()
+            self.size = 0
+        stream.flush()
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        return False
+
+
+class CaptureSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+    # 按行拆开，每行去掉 print 在参数后面加的空格
+    def lines(self):
+        return [line.rstrip(" ") for line in self.getvalue().splitlines()]
+
+    def clear(self):
+        self.parts.clear()
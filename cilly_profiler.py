@@ -0,0 +1,557 @@
+import json
+import signal
+import sys
+import threading
+import time
+
+from cilly_interpreter import ast_children, cilly_eval
+from cilly_vm_compiler import cilly_vm
+
+"""
+cilly 性能分析器
+
+Profiler 是确定性的分析器：
+
+    profiler = Profiler(ast)
+    cilly_eval(ast, env, profiler=profiler)     # 或 cilly_vm(code, consts, scopes, profiler=profiler, procs=procs)
+    profiler.print_stats()
+    profiler.write_chrome_trace("trace.json")   # chrome://tracing 或 Perfetto 打开
+
+记录每个函数的调用次数、自身耗时（tottime）和包含子调用的耗时（cumtime），
+以及每种 AST 节点 / vm 指令的执行次数。
+
+只有传入 profiler 时，cilly_eval / cilly_vm 才把 visitors / ops 表里的函数换成
+带统计的版本，不传时分发循环和原来完全一样，没有额外的判断。
+
+函数名取自定义处：fun f() {...}、var f = fun() {...}、f = fun() {...}，
+其余的匿名函数记为 <anonymous>。python 函数按 __name__ 记录。
+cilly_eval 会自动读取 AST 里的函数名，cilly_vm 看不到 AST，需要创建时传入 Profiler(ast)，
+编译时传入 procs={} 记下 入口地址 -> 函数，再把它传给 cilly_vm。
+尾调用替换当前函数的帧：调用者的计时在发起尾调用时结束，之后的时间记给被调函数。
+
+每次调用都计时会放大短小的热点循环里函数调用的开销，SamplingProfiler 是采样分析器，
+不改动解释器，只在定时器到期时查看 python 调用栈，找出正在执行的 cilly 函数和源码行：
+
+    buf = cilly_lexer_compact(src)
+    lines = {}
+    ast = cilly_parser(buf, lines=lines)
+
+    sampler = SamplingProfiler(ast, lines)
+    with sampler:
+        cilly_eval(ast, env)
+    sampler.write_collapsed("out.folded")       # flamegraph.pl 或 speedscope 打开
+
+cilly_vm 还需要编译时生成的 pc -> (行号, 函数) 表：
+
+    pc_table = []
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [], lines=lines, pc_table=pc_table)
+    sampler = SamplingProfiler(ast, lines, pc_table)
+
+cilly_eval 从 call_proc 的帧里的函数体、各层 visit 的 node 得到函数和行，
+cilly_vm 从 run 的 pc 和调用栈里的返回地址得到。
+默认用 SIGPROF 定时器（按 CPU 时间采样，只能在主线程启动），
+没有 setitimer 的平台用后台线程读 sys._current_frames()。
+"""
+
+PROGRAM = "<program>"
+ANONYMOUS = "<anonymous>"
+
+SORT_KEYS = {
+    "ncalls": lambda r: r["ncalls"],
+    "tottime": lambda r: r["tottime"],
+    "cumtime": lambda r: r["cumtime"],
+    "name": lambda r: r["name"],
+}
+
+
+# 函数节点 / 函数体的 id -> 函数名
+def fun_names(ast):
+    names = {}
+
+    def name_fun(name, fun):
+        names[id(fun)] = name
+        names[id(fun[-1])] = name
+
+    def walk(node):
+        tag = node[0]
+        if tag == "fun_def":
+            name_fun(node[1], node)
+        elif tag == "define" and node[2][0] == "fun_expr":
+            name_fun(node[1], node[2])
+        elif tag == "assign" and node[1][0] == "id" and node[2][0] == "fun_expr":
+            name_fun(node[1][1], node[2])
+
+        for c in ast_children(node):
+            walk(c)
+
+    walk(ast)
+    return names
+
+
+class Profiler:
+    def __init__(self, ast=None, timer=time.perf_counter, max_events=100000):
+        self.timer = timer
+        self.max_events = max_events
+
+        # 函数名 -> [ncalls, 非递归调用次数, tottime, cumtime]
+        self.funcs = {}
+        self.node_counts = {}
+        self.op_counts = {}
+
+        # 调用栈，每帧 [name, start, 子调用耗时]
+        self.stack = []
+        # 函数名 -> 当前在调用栈上的层数，递归调用只在最外层计 cumtime
+        self.active = {}
+
+        self.events = []
+        self.dropped_events = 0
+        self.t0 = None
+
+        # 函数节点 / 函数体的 id -> 函数名
+        self.fun_names = {}
+        if ast is not None:
+            self.add_names(ast)
+
+    # ---------- 函数名 ----------
+
+    def add_names(self, ast):
+        self.fun_names.update(fun_names(ast))
+
+    def name_of(self, obj):
+        return self.fun_names.get(id(obj), ANONYMOUS)
+
+    # ---------- 计时 ----------
+
+    def enter(self, name):
+        now = self.timer()
+        if self.t0 is None:
+            self.t0 = now
+
+        rec = self.funcs.get(name)
+        if rec is None:
+            rec = self.funcs[name] = [0, 0, 0.0, 0.0]
+
+        depth = self.active.get(name, 0)
+        rec[0] += 1
+        if depth == 0:
+            rec[1] += 1
+        self.active[name] = depth + 1
+
+        self.stack.append([name, now, 0.0])
+
+    def close(self, frame, now):
+        name, start, child = frame
+        total = now - start
+
+        rec = self.funcs[name]
+        rec[2] += total - child
+        depth = self.active[name] - 1
+        self.active[name] = depth
+        if depth == 0:
+            rec[3] += total
+
+        if len(self.events) < self.max_events:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "cilly",
+                    "ph": "X",
+                    "ts": (start - self.t0) * 1e6,
+                    "dur": total * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                }
+            )
+        else:
+            self.dropped_events += 1
+
+        return total
+
+    def exit(self):
+        now = self.timer()
+        frame = self.stack.pop()
+        total = self.close(frame, now)
+
+        if self.stack:
+            self.stack[-1][2] += total
+
+    # 刚进入的被调函数在尾位置：调用者的帧到此结束，被调函数接替它的位置
+    def tail_replace(self):
+        now = self.timer()
+        callee = self.stack.pop()
+        caller = self.stack.pop()
+
+        # 被调函数不在调用者里面，尾递归时调用者的时间也要计入 cumtime
+        self.active[callee[0]] -= 1
+        total = self.close(caller, now)
+        self.active[callee[0]] += 1
+
+        if self.stack:
+            self.stack[-1][2] += total
+
+        callee[1] = now
+        callee[2] = 0.0
+        self.stack.append(callee)
+
+    # 出错时把没有正常返回的帧都结束掉
+    def unwind(self, depth):
+        while len(self.stack) > depth:
+            self.exit()
+
+    # ---------- cilly_eval ----------
+
+    def instrument_eval(self, ast, visitors, tail_visitors, call_proc, call_host):
+        self.add_names(ast)
+
+        node_counts = self.node_counts
+
+        def count_node(tag, f):
+            node_counts.setdefault(tag, 0)
+
+            def run(node, env):
+                node_counts[tag] += 1
+                return f(node, env)
+
+            return run
+
+        for tag, f in list(visitors.items()):
+            visitors[tag] = count_node(tag, f)
+
+        # 函数体尾位置上的节点不经过 visitors
+        for tag, f in list(tail_visitors.items()):
+            tail_visitors[tag] = count_node(tag, f)
+
+        program = visitors["program"]
+
+        def run_program(node, env):
+            depth = len(self.stack)
+            self.enter(PROGRAM)
+            try:
+                return program(node, env)
+            finally:
+                self.unwind(depth)
+
+        visitors["program"] = run_program
+
+        def profiled_call_proc(f, evaluated_args, env, tail):
+            depth = len(self.stack)
+            self.enter(self.name_of(f[2]))
+            try:
+                r = call_proc(f, evaluated_args, env, tail)
+            except BaseException:
+                self.unwind(depth)
+                raise
+
+            if tail and r[0] == "tail_call":
+                self.tail_replace()
+            else:
+                self.exit()
+            return r
+
+        def profiled_call_host(f, evaluated_args):
+            depth = len(self.stack)
+            self.enter(getattr(f, "__name__", repr(f)))
+            try:
+                return call_host(f, evaluated_args)
+            finally:
+                self.unwind(depth)
+
+        return profiled_call_proc, profiled_call_host
+
+    # ---------- cilly_vm ----------
+
+    # opcode_names: opcode -> 名字；procs: 入口地址 -> 函数节点；call_depth() 返回调用栈深度
+    def instrument_vm(self, ops, run, opcode_names, procs, call_depth, call_op, return_op):
+        op_counts = self.op_counts
+
+        def count_op(name, f):
+            op_counts.setdefault(name, 0)
+
+            def op(pc):
+                op_counts[name] += 1
+                return f(pc)
+
+            return op
+
+        for opcode, f in list(ops.items()):
+            ops[opcode] = count_op(opcode_names[opcode], f)
+
+        call = ops[call_op]
+        ret = ops[return_op]
+
+        # 记忆化命中时 CALL 不进入函数，调用栈深度不变
+        def profiled_call(pc):
+            depth = call_depth()
+            new_pc = call(pc)
+            if call_depth() > depth:
+                self.enter(self.name_of(procs.get(new_pc)))
+            return new_pc
+
+        def profiled_ret(pc):
+            new_pc = ret(pc)
+            if len(self.stack) > 1:
+                self.exit()
+            return new_pc
+
+        ops[call_op] = profiled_call
+        ops[return_op] = profiled_ret
+
+        def run_program():
+            depth = len(self.stack)
+            self.enter(PROGRAM)
+            try:
+                return run()
+            finally:
+                self.unwind(depth)
+
+        return run_program
+
+    # ---------- 输出 ----------
+
+    def stats(self):
+        rows = []
+        for name, (ncalls, primitive, tottime, cumtime) in self.funcs.items():
+            rows.append(
+                {
+                    "name": name,
+                    "ncalls": ncalls,
+                    "primitive_calls": primitive,
+                    "tottime": tottime,
+                    "cumtime": cumtime,
+                }
+            )
+
+        return {
+            "functions": rows,
+            "nodes": dict(self.node_counts),
+            "opcodes": dict(self.op_counts),
+        }
+
+    def print_stats(self, sort="tottime", limit=None, file=None):
+        if sort not in SORT_KEYS:
+            raise ValueError(f"未知排序方式: {sort}")
+
+        file = file or sys.stdout
+        rows = sorted(self.stats()["functions"], key=SORT_KEYS[sort], reverse=sort != "name")
+        if limit is not None:
+            rows = rows[:limit]
+
+        total_calls = sum(r["ncalls"] for r in self.stats()["functions"])
+        total_time = self.funcs[PROGRAM][3] if PROGRAM in self.funcs else 0.0
+        print(f"{total_calls} function calls in {total_time:.6f} seconds", file=file)
+        print(f"Ordered by: {sort}", file=file)
+        print("", file=file)
+        print(f"{'ncalls':>12} {'tottime':>10} {'percall':>10} {'cumtime':>10} {'percall':>10}  function", file=file)
+
+        for r in rows:
+            ncalls = str(r["ncalls"])
+            if r["primitive_calls"] != r["ncalls"]:
+                ncalls = f"{r['ncalls']}/{r['primitive_calls']}"
+            tot_per = r["tottime"] / r["ncalls"]
+            cum_per = r["cumtime"] / r["primitive_calls"] if r["primitive_calls"] else 0.0
+            print(
+                f"{ncalls:>12} {r['tottime']:>10.6f} {tot_per:>10.6f} {r['cumtime']:>10.6f} {cum_per:>10.6f}  {r['name']}",
+                file=file,
+            )
+
+        for title, counts in [("node", self.node_counts), ("opcode", self.op_counts)]:
+            if not counts:
+                continue
+            print("", file=file)
+            print(f"{'count':>12}  {title}", file=file)
+            for name, n in sorted(counts.items(), key=lambda kv: kv[1], reverse=True):
+                if n:
+                    print(f"{n:>12}  {name}", file=file)
+
+    def chrome_trace(self):
+        return {
+            "traceEvents": list(self.events),
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_events": self.dropped_events},
+        }
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+EVAL_FILE = cilly_eval.__code__.co_filename
+VM_FILE = cilly_vm.__code__.co_filename
+
+
+class SamplingProfiler:
+    def __init__(self, ast=None, lines=None, pc_table=None, interval=0.001, mode=None):
+        if interval <= 0:
+            raise ValueError("interval 必须大于 0")
+
+        if mode is None:
+            mode = "signal" if hasattr(signal, "setitimer") else "thread"
+        if mode not in ["signal", "thread"]:
+            raise ValueError(f"未知采样方式: {mode}")
+
+        self.interval = interval
+        self.mode = mode
+        self.lines = lines if lines is not None else {}
+        self.pc_table = pc_table if pc_table is not None else []
+        self.fun_names = fun_names(ast) if ast is not None else {}
+
+        # 折叠栈 "f:行;g:行" -> 样本数
+        self.stacks = {}
+        self.samples = 0
+        # 采样时不在 cilly 代码里的次数
+        self.missed = 0
+
+        self.running = False
+        self.old_handler = None
+        self.thread = None
+        self.stop_event = None
+
+    def name_of(self, obj):
+        if obj is None:
+            return PROGRAM
+        return self.fun_names.get(id(obj), ANONYMOUS)
+
+    # ---------- 启停 ----------
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+
+        if self.mode == "signal":
+            if threading.current_thread() is not threading.main_thread():
+                raise ValueError("signal 方式只能在主线程启动")
+            self.old_handler = signal.signal(signal.SIGPROF, self.on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            target = threading.get_ident()
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self.sample_thread, args=(target,), daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self.running = False
+
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.old_handler)
+        else:
+            self.stop_event.set()
+            self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def on_signal(self, signum, frame):
+        self.sample(frame)
+
+    def sample_thread(self, target):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self.sample(frame)
+
+    # ---------- 采样 ----------
+
+    def sample(self, frame):
+        stack = self.cilly_stack(frame)
+        if not stack:
+            self.missed += 1
+            return
+
+        key = ";".join(f"{name}:{line}" if line is not None else name for name, line in stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    # 从 python 调用栈还原 cilly 调用栈，返回 [(函数名, 行号), ...]，最外层在前。
+    # 从内向外找，每层 cilly 函数只需要最内层带行号的节点，找到后就不再读外面帧的局部变量
+    def cilly_stack(self, frame):
+        stack = []
+        line = None
+        need_line = True
+        pc = None
+
+        while frame is not None:
+            code = frame.f_code
+
+            if code.co_filename == EVAL_FILE:
+                if code.co_name == "call_proc":
+                    # 尾调用时 call_proc 的 body 会换成被调函数的函数体，
+                    # 刚进入 call_proc 还没有 body 时取函数值里的函数体；
+                    # 还没有执行到带行号的节点时（传参、复制作用域）只记函数名
+                    local_vars = frame.f_locals
+                    body = local_vars.get("body")
+                    if body is None:
+                        body = local_vars["f"][2]
+                    stack.append((self.name_of(body), line))
+                    line = None
+                    need_line = True
+                elif code.co_name == "cilly_eval":
+                    stack.append((PROGRAM, line))
+                    line = None
+                    need_line = True
+                elif need_line and "node" in code.co_varnames:
+                    line = self.lines.get(id(frame.f_locals.get("node")))
+                    need_line = line is None
+
+            elif code.co_filename == VM_FILE:
+                if code.co_name == "run":
+                    pc = frame.f_locals.get("pc")
+                elif code.co_name == "cilly_vm" and pc is not None:
+                    stack.append(self.vm_position(pc))
+                    # 调用帧的第一项是返回地址，CALL 指令占两个位置
+                    for frame_info in reversed(frame.f_locals["call_stack"]):
+                        stack.append(self.vm_position(frame_info[0] - 2))
+                    pc = None
+
+            frame = frame.f_back
+
+        stack.reverse()
+        return stack
+
+    def vm_position(self, pc):
+        if not 0 <= pc < len(self.pc_table):
+            return (PROGRAM, None)
+
+        line, fun = self.pc_table[pc]
+        return (self.name_of(fun), line)
+
+    # ---------- 输出 ----------
+
+    # flamegraph.pl 的折叠栈格式，每行 "栈 样本数"
+    def collapsed(self):
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items()))
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+
+    # 栈顶（正在执行）的 函数:行 -> 样本数
+    def line_counts(self):
+        counts = {}
+        for stack, n in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            counts[leaf] = counts.get(leaf, 0) + n
+        return counts
+
+    def print_stats(self, limit=None, file=None):
+        file = file or sys.stdout
+
+        rows = sorted(self.line_counts().items(), key=lambda kv: kv[1], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+
+        print(f"{self.samples} samples, interval {self.interval * 1000:g} ms, {self.missed} outside cilly", file=file)
+        print("", file=file)
+        print(f"{'samples':>10} {'percent':>8}  line", file=file)
+        for leaf, n in rows:
+            print(f"{n:>10} {n / self.samples * 100:>7.1f}%  {leaf}", file=file)
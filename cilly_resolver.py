@@ -0,0 +1,660 @@
+from cilly_interpreter import error, mk_num, mk_bool, val, NULL, TRUE, FALSE
+from cilly_interpreter import mk_struct, struct_shape, struct_cache_miss
+from cilly_interpreter import mk_array, array_store, call_builtin, host_arg
+from cilly_interpreter import lookup_var, set_var
+
+"""
+cilly 变量解析 + 词法作用域解释器
+
+cilly_eval 每次调用都 env.copy() 整个环境，代价和全局变量个数成正比，
+局部变量也不会局限在块里。这里先用解析器 cilly_resolve 给每个变量
+算出 (depth, slot) 地址，运行时的环境是一串链起来的帧：
+
+    frame = [parent, slot1, slot2, ...]
+
+depth 是沿 parent 往外走几层，slot 是帧里的下标，变量访问就是一次下标读取，
+函数调用只需要分配一个 [定义处的帧] + 参数 + 局部变量 的新帧。
+
+作用域规则与 cilly vm 相同：块里 var/fun 定义的变量只在块内可见，
+块开头就预先登记，所以同一块里可以先引用后定义（互相递归的函数）；
+函数值捕获定义时的帧。没有声明过的名字当作全局变量，在传入的 env 字典里查，
+主要用于 python 提供的函数。
+
+没有定义任何变量的块不创建帧；函数体的最外层块和参数共用一个帧。
+"""
+
+# 解析后新增的节点：
+#   ["local", depth, slot, name]            读局部变量
+#   ["global", name]                        读 env 里的全局变量
+#   ["assign_local", depth, slot, e, name]  写局部变量
+#   ["assign_global", name, e]              写全局变量
+#   ["define_local", depth, slot, e]        定义变量
+#   ["block", statements, size]             size 为 0 时不创建帧
+#   ["program", statements, size]
+#   ["fun_expr", params, body, size]        size 为参数和函数体局部变量总数
+#   ["struct", fields, shape]               shape 是结构体的形状
+#   ["struct_access", obj, field, cache]    cache 是这一处的内联缓存 [形状, 槽位]
+
+
+def cilly_resolve(ast):
+
+    def err(msg):
+        error("cilly resolver", msg)
+
+    # 编译期作用域链，每个作用域是 名字 -> slot 的字典；
+    # 只有会创建帧的作用域才计入 depth
+    scopes = []
+
+    def declare(scope, name):
+        if name in scope["names"]:
+            error("define var", f"变量已定义{name}")
+
+        scope["size"] += 1
+        scope["names"][name] = scope["size"]
+
+    # 块里定义的变量名，包括不带花括号的 if/while/for 分支里的定义（它们属于这个块）；
+    # 不进入嵌套的块和函数。分支里的名字可以重复（if/else 两边各定义一次）
+    def defined_names(statements):
+        names = []
+
+        def walk(s, nested):
+            if s is None:
+                return
+            tag = s[0]
+            if tag == "define" or tag == "fun_def":
+                if not nested or s[1] not in names:
+                    names.append(s[1])
+            elif tag == "if":
+                walk(s[2], True)
+                walk(s[3], True)
+            elif tag == "while":
+                walk(s[2], True)
+            elif tag == "for":
+                walk(s[4], True)
+
+        for s in statements:
+            walk(s, False)
+        return names
+
+    def declare_statements(scope, statements):
+        for name in defined_names(statements):
+            declare(scope, name)
+
+    def lookup(name):
+        depth = 0
+        for scope in reversed(scopes):
+            if name in scope["names"]:
+                return depth, scope["names"][name]
+            depth += 1
+
+        return None
+
+    def res_program(node):
+        _, statements = node
+        scope = {"names": {}, "size": 0}
+        declare_statements(scope, statements)
+
+        scopes.append(scope)
+        r = [res(s) for s in statements]
+        scopes.pop()
+
+        return ["program", r, scope["size"]]
+
+    def res_block(node):
+        _, statements = node
+        scope = {"names": {}, "size": 0}
+        declare_statements(scope, statements)
+
+        if scope["size"] == 0:
+            return ["block", [res(s) for s in statements], 0]
+
+        scopes.append(scope)
+        r = [res(s) for s in statements]
+        scopes.pop()
+
+        return ["block", r, scope["size"]]
+
+    def res_fun(params, body):
+        scope = {"names": {}, "size": 0}
+        for p in params:
+            declare(scope, p)
+
+        # 函数体最外层的块和参数放在同一个帧里，
+        # 块里和参数同名的定义会遮住参数，与 vm 的行为一致
+        if body[0] == "block":
+            statements = body[1]
+            for name in defined_names(statements):
+                if name in scope["names"] and scope["names"][name] <= len(params):
+                    scope["size"] += 1
+                    scope["names"][name] = scope["size"]
+                else:
+                    declare(scope, name)
+
+            scopes.append(scope)
+            body = ["block", [res(s) for s in statements], 0]
+            scopes.pop()
+        else:
+            scopes.append(scope)
+            body = res(body)
+            scopes.pop()
+
+        return ["fun_expr", params, body, scope["size"]]
+
+    def res_fun_expr(node):
+        _, params, body = node
+        return res_fun(params, body)
+
+    # 定义写到名字所在的帧；块开头登记过的名字都在当前帧（depth 为 0），
+    # 登记时漏掉的名字补登记到当前帧，不会写到外层同名的变量上
+    def define_addr(name):
+        addr = lookup(name)
+        if addr is None or addr[0] != 0:
+            if not scopes:
+                err(f"变量 {name} 不在任何作用域里")
+            declare(scopes[-1], name)
+            addr = lookup(name)
+        return addr
+
+    def res_fun_def(node):
+        _, name, params, body = node
+        depth, slot = define_addr(name)
+        return ["define_local", depth, slot, res_fun(params, body)]
+
+    def res_define(node):
+        _, name, e = node
+        e = res(e)
+        depth, slot = define_addr(name)
+        return ["define_local", depth, slot, e]
+
+    def res_id(node):
+        _, name = node
+        addr = lookup(name)
+        if addr is None:
+            return ["global", name]
+
+        depth, slot = addr
+        return ["local", depth, slot, name]
+
+    def res_assign(node):
+        _, target, e = node
+        e = res(e)
+
+        if target[0] == "id":
+            name = target[1]
+            addr = lookup(name)
+            if addr is None:
+                return ["assign_global", name, e]
+
+            depth, slot = addr
+            return ["assign_local", depth, slot, e, name]
+
+        return ["assign", res(target), e]
+
+    def res_print(node):
+        _, args = node
+        return ["print", [res(a) for a in args]]
+
+    def res_if(node):
+        _, cond, true_s, false_s = node
+        return ["if", res(cond), res(true_s), res(false_s) if false_s is not None else None]
+
+    def res_for(node):
+        _, init, cond, step, body = node
+        return ["for", res(init), res(cond), res(step), res(body)]
+
+    def res_while(node):
+        _, cond, body = node
+        return ["while", res(cond), res(body)]
+
+    def res_return(node):
+        _, e = node
+        return ["return", res(e) if e is not None else None]
+
+    def res_expr_stat(node):
+        _, e = node
+        return ["expr_stat", res(e)]
+
+    def res_unary(node):
+        _, op, e = node
+        return ["unary", op, res(e)]
+
+    def res_binary(node):
+        _, op, e1, e2 = node
+        return ["binary", op, res(e1), res(e2)]
+
+    def res_if_expr(node):
+        _, cond, true_e, false_e = node
+        return ["if_expr", res(cond), res(true_e), res(false_e)]
+
+    def res_call(node):
+        _, f, args = node
+        return ["call", res(f), [res(a) for a in args]]
+
+    def res_array(node):
+        _, elements = node
+        return ["array", [res(e) for e in elements]]
+
+    def res_struct(node):
+        _, fields = node
+        return ["struct", {k: res(e) for k, e in fields.items()}, struct_shape(fields)]
+
+    def res_array_access(node):
+        _, arr, index = node
+        return ["array_access", res(arr), res(index)]
+
+    def res_struct_access(node):
+        _, obj, field = node
+        return ["struct_access", res(obj), field, [None, 0]]
+
+    def res_leaf(node):
+        return list(node)
+
+    resolvers = {
+        "program": res_program,
+        "block": res_block,
+        "expr_stat": res_expr_stat,
+        "print": res_print,
+        "if": res_if,
+        "while": res_while,
+        "for": res_for,
+        "break": res_leaf,
+        "continue": res_leaf,
+        "define": res_define,
+        "assign": res_assign,
+        "return": res_return,
+        "fun_expr": res_fun_expr,
+        "fun_def": res_fun_def,
+        "unary": res_unary,
+        "binary": res_binary,
+        "if_expr": res_if_expr,
+        "call": res_call,
+        "array": res_array,
+        "struct": res_struct,
+        "array_access": res_array_access,
+        "struct_access": res_struct_access,
+        "id": res_id,
+        "num": res_leaf,
+        "str": res_leaf,
+        "true": res_leaf,
+        "false": res_leaf,
+        "null": res_leaf,
+    }
+
+    def res(node):
+        tag = node[0]
+        if tag not in resolvers:
+            err(f"非法节点{node}")
+
+        return resolvers[tag](node)
+
+    return res(ast)
+
+
+def cilly_eval_resolved(ast, env):
+    def err(msg):
+        return error("cilly eval", msg)
+
+    # 沿 parent 链往外走 depth 层
+    def outer(frame, depth):
+        while depth:
+            frame = frame[0]
+            depth -= 1
+        return frame
+
+    def new_frame(parent, size):
+        frame = [NULL] * (size + 1)
+        frame[0] = parent
+        return frame
+
+    def ev_program(node, frame):
+        _, statements, size = node
+        frame = new_frame(frame, size)
+
+        r = NULL
+
+        for s in statements:
+            r = visit(s, frame)
+
+        return r
+
+    def ev_expr_stat(node, frame):
+        _, e = node
+        return visit(e, frame)
+
+    def ev_print(node, frame):
+        _, args = node
+
+        for a in args:
+            print(val(visit(a, frame)), end=" ")
+
+        print("")
+
+        return NULL
+
+    def ev_for(node, frame):
+        _, init, cond, step, body = node
+        visit(init, frame)
+        while True:
+            cond_val = visit(cond, frame)
+            if not val(cond_val):
+                break
+            res = visit(body, frame)
+            if res and res[0] == "break":
+                break
+            visit(step, frame)
+        return NULL
+
+    def ev_literal(node, frame):
+        tag, v = node
+
+        if tag in ["num", "str"]:
+            return node
+
+        if tag in ["true", "false"]:
+            return TRUE if tag == "true" else FALSE
+
+        if tag == "null":
+            return NULL
+
+        err(f"非法字面量{node}")
+
+    def ev_unary(node, frame):
+        _, op, e = node
+
+        v = val(visit(e, frame))
+
+        if op == "-":
+            return mk_num(-v)
+
+        if op == "!":
+            return FALSE if v else TRUE
+
+        err(f"非法一元运算符{op}")
+
+    def ev_binary(node, frame):
+        _, op, e1, e2 = node
+
+        v1 = val(visit(e1, frame))
+        if op == "&&":
+            if v1 == False:
+                return FALSE
+            else:
+                return visit(e2, frame)
+
+        if op == "||":
+            if v1 == True:
+                return TRUE
+            else:
+                return visit(e2, frame)
+
+        v2 = val(visit(e2, frame))
+
+        if op == "+":
+            return mk_num(v1 + v2)
+
+        if op == "-":
+            return mk_num(v1 - v2)
+
+        if op == "*":
+            return mk_num(v1 * v2)
+
+        if op == "/":
+            return mk_num(v1 / v2)
+
+        if op == ">":
+            return mk_bool(v1 > v2)
+        if op == ">=":
+            return mk_bool(v1 >= v2)
+        if op == "<":
+            return mk_bool(v1 < v2)
+        if op == "<=":
+            return mk_bool(v1 <= v2)
+        if op == "==":
+            return mk_bool(v1 == v2)
+        if op == "!=":
+            return mk_bool(v1 != v2)
+        if op == "^":
+            return mk_num(v1**v2)
+
+        err(f"非法二元运算符{op}")
+
+    def ev_if(node, frame):
+        _, cond, true_s, false_s = node
+
+        if visit(cond, frame) == TRUE:
+            return visit(true_s, frame)
+
+        if false_s != None:
+            return visit(false_s, frame)
+
+        return NULL
+
+    def ev_if_expr(node, frame):
+        _, cond, true_e, false_e = node
+        c = visit(cond, frame)
+        return visit(true_e, frame) if val(c) else visit(false_e, frame)
+
+    def ev_while(node, frame):
+        _, cond, body = node
+
+        r = NULL
+        prev_r = NULL
+        while visit(cond, frame) == TRUE:
+            r = visit(body, frame)
+            if r[0] == "break":
+                r = prev_r
+                break
+
+            if r[0] == "continue":
+                continue
+            prev_r = r
+
+        return r
+
+    def ev_break(node, frame):
+        return ["break"]
+
+    def ev_continue(node, frame):
+        return ["continue"]
+
+    def ev_block(node, frame):
+        _, statements, size = node
+
+        # 块里定义了变量才需要新帧
+        if size:
+            frame = new_frame(frame, size)
+
+        r = NULL
+
+        for s in statements:
+            r = visit(s, frame)
+            if r[0] in ["break", "continue"]:
+                return r
+
+        return r
+
+    def ev_local(node, frame):
+        _, depth, slot, _ = node
+
+        if depth == 0:
+            return frame[slot]
+
+        return outer(frame, depth)[slot]
+
+    def ev_global(node, frame):
+        _, name = node
+
+        return lookup_var(env, name)
+
+    def ev_define_local(node, frame):
+        _, depth, slot, e = node
+        value = visit(e, frame)
+
+        if depth == 0:
+            frame[slot] = value
+        else:
+            outer(frame, depth)[slot] = value
+
+        return NULL
+
+    def ev_assign_local(node, frame):
+        _, depth, slot, e, _ = node
+        value = visit(e, frame)
+
+        if depth == 0:
+            frame[slot] = value
+        else:
+            outer(frame, depth)[slot] = value
+
+        return NULL
+
+    def ev_assign_global(node, frame):
+        _, name, e = node
+        set_var(env, name, visit(e, frame))
+        return NULL
+
+    def ev_assign(node, frame):
+        _, target, value_expr = node
+        value = visit(value_expr, frame)
+        if target[0] == "array_access":
+            arr_expr, index_expr = target[1], target[2]
+            arr = visit(arr_expr, frame)
+            index = val(visit(index_expr, frame))
+            if arr[0] != "array":
+                error("assign", "只能对数组类型进行索引赋值")
+            if not isinstance(index, int):
+                error("assign", "数组索引必须是整数")
+            if index < 0 or index >= len(arr[1]):
+                error("assign", f"数组索引越界: {index}")
+            array_store(arr, index, value)
+        elif target[0] == "struct_access":
+            _, obj_expr, field, cache = target
+            obj = visit(obj_expr, frame)
+            if obj[0] != "struct":
+                error("assign", "只能对结构体类型进行属性赋值")
+            fields = obj[1]
+            if fields.shape is cache[0]:
+                fields.values[cache[1]] = value
+            else:
+                fields.values[struct_cache_miss(fields, field, cache, "assign")] = value
+        else:
+            err("非法的左值表达式")
+        return NULL
+
+    def ev_return(node, frame):
+        _, e = node
+
+        if e != None:
+            return visit(e, frame)
+        else:
+            return NULL
+
+    # 函数值多带一个定义处的帧: ["proc", params, body, frame, size]
+    def ev_fun_expr(node, frame):
+        _, params, body, size = node
+        return ["proc", params, body, frame, size]
+
+    def ev_array(node, frame):
+        _, elements = node
+        return mk_array([visit(e, frame) for e in elements])
+
+    def ev_struct(node, frame):
+        _, fields, shape = node
+        return mk_struct(shape, [visit(e, frame) for e in fields.values()])
+
+    def ev_array_access(node, frame):
+        _, arr_expr, index_expr = node
+
+        arr = visit(arr_expr, frame)
+        index = val(visit(index_expr, frame))
+
+        if arr[0] != "array":
+            err("只能对数组类型进行索引访问")
+        if not isinstance(index, int):
+            err("数组索引必须是整数")
+        if index < 0 or index >= len(arr[1]):
+            err(f"数组索引越界: {index}")
+        return arr[1][index]
+
+    def ev_struct_access(node, frame):
+        _, obj_expr, field, cache = node
+        obj = visit(obj_expr, frame)
+
+        if obj[0] != "struct":
+            error("struct_access", "只能对结构体类型进行属性访问")
+        fields = obj[1]
+        if fields.shape is cache[0]:
+            return fields.values[cache[1]]
+        return fields.values[struct_cache_miss(fields, field, cache, "struct_access")]
+
+    def ev_call(node, frame):
+        _, f_expr, args = node
+        f = visit(f_expr, frame)
+        if isinstance(f, list) and f[0] == "proc":
+            _, params, body, closure_frame, size = f
+            if len(params) != len(args):
+                err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(args)} 个")
+            # 新帧: [定义处的帧, 参数..., 函数体局部变量...]，代价只和参数/局部变量个数有关
+            local_frame = [closure_frame]
+            for a in args:
+                local_frame.append(visit(a, frame))
+            if size > len(params):
+                local_frame.extend([NULL] * (size - len(params)))
+            return visit(body, local_frame)
+        elif isinstance(f, list) and f[0] == "builtin":
+            return call_builtin(f, [visit(a, frame) for a in args])
+        elif callable(f):
+            evaluated_args = [host_arg(visit(a, frame)) for a in args]
+            try:
+                f(*evaluated_args)
+                return NULL
+            except Exception as e:
+                err(f"调用 Python 函数时出错: {e}")
+        else:
+            err(f"非法函数: {f}")
+
+    visitors = {
+        "program": ev_program,
+        "expr_stat": ev_expr_stat,
+        "print": ev_print,
+        "if": ev_if,
+        "while": ev_while,
+        "break": ev_break,
+        "continue": ev_continue,
+        "block": ev_block,
+        "define_local": ev_define_local,
+        "assign": ev_assign,
+        "assign_local": ev_assign_local,
+        "assign_global": ev_assign_global,
+        "unary": ev_unary,
+        "binary": ev_binary,
+        "return": ev_return,
+        "fun_expr": ev_fun_expr,
+        "call": ev_call,
+        "local": ev_local,
+        "global": ev_global,
+        "num": ev_literal,
+        "str": ev_literal,
+        "true": ev_literal,
+        "false": ev_literal,
+        "null": ev_literal,
+        "for": ev_for,
+        "if_expr": ev_if_expr,
+        "array": ev_array,
+        "struct": ev_struct,
+        "array_access": ev_array_access,
+        "struct_access": ev_struct_access,
+    }
+
+    def visit(node, frame):
+        tag = node[0]
+        if tag not in visitors:
+            err(f"非法节点{node}")
+
+        return visitors[tag](node, frame)
+
+    # 没有经过 cilly_resolve 的 AST 先解析一遍
+    if ast[0] == "program" and len(ast) == 2:
+        ast = cilly_resolve(ast)
+
+    return visit(ast, None)
@@ -0,0 +1,181 @@
+import heapq
+import time
+from collections import deque
+
+from cilly_interpreter import cilly_lexer, cilly_parser
+from cilly_optimizer import cilly_optimize
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm_machine
+from cilly_output import CaptureSink
+
+"""
+cilly 协作式调度器
+
+在一个 python 线程里轮流执行很多个 cilly 程序：每个程序是一个 VMTask，
+拥有自己的 cilly_vm 实例（栈、作用域、调用栈都在实例里），每次最多执行 quantum 条指令
+就把控制权交回调度器，一个死循环的程序不会让其他程序饿死：
+
+    sched = Scheduler(quantum=1000)
+    a = sched.spawn(src_a, name="a")
+    b = sched.spawn(src_b, name="b", priority=3)
+    sched.run()
+    print(a.output(), a.instructions, b.state)
+
+两种调度方式：
+1. "round_robin"：按加入的顺序轮流执行，每次一个时间片
+2. "priority"：步幅调度（stride scheduling），每个任务得到的时间片个数和 priority 成正比，
+   优先级低的任务也一定会轮到
+
+每个任务默认把 print 的输出写到自己的 CaptureSink，多个程序的输出不会交错在一行里。
+任务出错时状态变为 "error"，错误信息在 task.error 里，不影响其他任务。
+max_instructions 限制单个任务最多执行的指令数，超过时任务状态变为 "killed"。
+python 函数（见 cilly_builtins.HostRegistry）在一条 CALL 指令里执行完，执行期间不会切换任务。
+"""
+
+SCHEDULE_POLICIES = ["round_robin", "priority"]
+
+# 步幅调度里优先级为 1 的任务每个时间片前进的距离
+STRIDE_BASE = 1 << 20
+
+
+class VMTask:
+    # code/consts 是 cilly_vm_compiler 的编译结果，scopes 是运行时最外层的作用域（例如 host.vm_scope() 的值）
+    def __init__(self, code, consts, scopes=None, name=None, priority=1, out=None):
+        if priority < 1:
+            raise ValueError(f"priority 必须是正整数: {priority}")
+
+        self.name = name
+        self.priority = priority
+        self.out = out if out is not None else CaptureSink()
+        _, self.run_for, self.stack, self.call_stack, _ = cilly_vm_machine(code, consts, scopes or [], out=self.out)
+        self.end = len(code)
+        self.pc = 0
+
+        self.state = "ready"
+        self.error = None
+        # 执行过的指令数、时间片个数和占用的时间
+        self.instructions = 0
+        self.slices = 0
+        self.time = 0.0
+
+    # 执行一个时间片，返回任务是否还能继续执行
+    def step(self, quantum):
+        start = time.perf_counter()
+        try:
+            self.pc, executed = self.run_for(self.pc, quantum)
+        except Exception as e:
+            self.state = "error"
+            self.error = str(e)
+            executed = getattr(e, "executed", 0)
+        self.time += time.perf_counter() - start
+        self.instructions += executed
+        self.slices += 1
+
+        if self.state == "ready" and self.pc >= self.end:
+            self.state = "done"
+
+        if self.state != "ready":
+            self.out.flush()
+            return False
+        return True
+
+    def output(self):
+        return self.out.getvalue() if isinstance(self.out, CaptureSink) else None
+
+    def __repr__(self):
+        return f"<VMTask {self.name} {self.state} {self.instructions} 条指令>"
+
+
+class Scheduler:
+    def __init__(self, quantum=1000, policy="round_robin", max_instructions=None):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"未知的调度方式: {policy}，可选 {SCHEDULE_POLICIES}")
+
+        self.quantum = quantum
+        self.policy = policy
+        self.max_instructions = max_instructions
+        self.tasks = []
+        # round_robin: deque(task)；priority: 堆 [(pass, 序号, task)]
+        self.ready = deque() if policy == "round_robin" else []
+        self.seq = 0
+        # priority 方式下新任务从当前最小的 pass 开始，不会因为来得晚一直占着调度器
+        self.min_pass = 0
+
+    def add(self, task):
+        self.tasks.append(task)
+        self.enqueue(task, self.min_pass)
+        return task
+
+    # 编译一段 cilly 源码并加入调度；host 是 cilly_builtins.HostRegistry，程序里可以调用其中的函数；
+    # optimize 为假时不做 AST 优化
+    def spawn(self, src, name=None, priority=1, out=None, host=None, optimize=True):
+        names, values = host.vm_scope() if host is not None else ([], [])
+        ast = cilly_parser(cilly_lexer(src))
+        if optimize:
+            ast = cilly_optimize(ast, "vm")
+        code, consts, _ = cilly_vm_compiler(ast, [], [], [names] if names else [])
+        scopes = [values] if names else []
+        if name is None:
+            name = f"task-{len(self.tasks)}"
+        return self.add(VMTask(code, consts, scopes, name, priority, out))
+
+    def enqueue(self, task, pass_value):
+        if self.policy == "round_robin":
+            self.ready.append(task)
+        else:
+            heapq.heappush(self.ready, (pass_value, self.seq, task))
+            self.seq += 1
+
+    # 执行一个时间片，没有可执行的任务时返回 None
+    def step(self):
+        if not self.ready:
+            return None
+
+        if self.policy == "round_robin":
+            task = self.ready.popleft()
+            pass_value = None
+        else:
+            pass_value, _, task = heapq.heappop(self.ready)
+            self.min_pass = pass_value
+
+        alive = task.step(self.quantum)
+
+        if alive and self.max_instructions is not None and task.instructions >= self.max_instructions:
+            task.state = "killed"
+            task.error = f"超过指令数上限 {self.max_instructions}"
+            task.out.flush()
+            alive = False
+
+        if alive:
+            if pass_value is not None:
+                pass_value += STRIDE_BASE // task.priority
+            self.enqueue(task, pass_value)
+        return task
+
+    # 一直执行到所有任务结束，返回全部任务
+    def run(self):
+        while self.step() is not None:
+            pass
+        return self.tasks
+
+    def stats(self):
+        return [
+            {
+                "name": t.name,
+                "state": t.state,
+                "priority": t.priority,
+                "instructions": t.instructions,
+                "slices": t.slices,
+                "time": t.time,
+                "error": t.error,
+            }
+            for t in self.tasks
+        ]
+
+    def print_stats(self, file=None):
+        print(f"{'name':>12}  {'state':>8}  {'priority':>8}  {'instructions':>12}  {'slices':>8}  {'time':>10}", file=file)
+        for row in self.stats():
+            print(
+                f"{row['name']:>12}  {row['state']:>8}  {row['priority']:>8}  {row['instructions']:>12}  "
+                f"{row['slices']:>8}  {row['time']:>10.6f}",
+                file=file,
+            )
@@ -0,0 +1,458 @@
+import asyncio
+from inspect import isawaitable
+
+from cilly_interpreter import error, mk_num, mk_bool, mk_proc, val, NULL, TRUE, FALSE
+from cilly_interpreter import lookup_var, set_var, define_var
+from cilly_interpreter import mk_struct, struct_shape
+from cilly_interpreter import mk_array, array_store, call_builtin, close_awaitable, host_arg
+
+"""
+cilly 堆栈帧解释器
+
+cilly_eval 的 visit 在 python 的调用栈上递归，非尾递归的 cilly 程序几百层就会
+超过 python 的递归深度限制。这里每个复合节点的求值写成一个生成器，
+需要子节点的值时 yield (子节点, env, 是否尾位置)，由 run 里的循环求值后 send 回去。
+所有正在求值的节点都放在 run 的 stack 列表里（堆上），
+python 调用栈的深度与 cilly 的递归深度无关，10^5 层的递归也不需要调大递归限制。
+stack 最多放 max_depth 个节点（默认 MAX_DEPTH），
+失控的递归超过它时报错，而不是一直占用内存直到进程被杀掉。
+
+尾位置（见 cilly_eval 的 visit_tail）上的 cilly 函数调用返回
+["tail_call", body, local_env]，由外层调用的生成器接着执行，
+尾递归时 stack 不会增长。
+
+值表示、动态作用域和错误信息与 cilly_eval 一致。
+
+async_calls=True 时返回的是协程（见 cilly_async.cilly_eval_async）：内置函数返回 awaitable 时，
+ev_call 把它 yield 给 arun，arun await 它的结果再 send 回去，等待期间事件循环可以执行别的程序。
+"""
+
+# ev_call 遇到 awaitable 时 yield (AWAIT, awaitable, False)
+AWAIT = ["await"]
+
+# stack 里最多同时有多少个正在求值的节点，简单的非尾递归每层占 6 个左右，约 16 万层
+MAX_DEPTH = 1000000
+
+# 异步执行时每求值这么多个节点让出一次事件循环，计算密集的程序也不会一直占着
+ASYNC_QUANTUM = 1000
+
+
+def cilly_eval_stackless(ast, env, async_calls=False, max_depth=MAX_DEPTH):
+    def err(msg):
+        return error("cilly eval", msg)
+
+    # 叶子节点直接求值，不创建生成器
+
+    def ev_literal(node, env):
+        tag, v = node
+
+        if tag in ["num", "str"]:
+            return node
+
+        if tag in ["true", "false"]:
+            return TRUE if tag == "true" else FALSE
+
+        if tag == "null":
+            return NULL
+
+        err(f"非法字面量{node}")
+
+    def ev_id(node, env):
+        _, name = node
+
+        return lookup_var(env, name)
+
+    def ev_break(node, env):
+        return ["break"]
+
+    def ev_continue(node, env):
+        return ["continue"]
+
+    def ev_fun_expr(node, env):
+        _, params, body = node
+        return mk_proc(params, body)
+
+    def ev_fun_def(node, env):
+        _, name, params, body = node
+        define_var(env, name, ["proc", params, body])
+        return NULL
+
+    leaves = {
+        "num": ev_literal,
+        "str": ev_literal,
+        "true": ev_literal,
+        "false": ev_literal,
+        "null": ev_literal,
+        "id": ev_id,
+        "break": ev_break,
+        "continue": ev_continue,
+        "fun_expr": ev_fun_expr,
+        "fun_def": ev_fun_def,
+    }
+
+    # 复合节点：生成器，yield (node, env, tail) 得到子节点的值
+
+    def ev_program(node, env, tail):
+        _, statements = node
+
+        r = NULL
+
+        for s in statements:
+            r = yield (s, env, False)
+
+        return r
+
+    def ev_expr_stat(node, env, tail):
+        _, e = node
+        return (yield (e, env, tail))
+
+    def ev_print(node, env, tail):
+        _, args = node
+
+        for a in args:
+            v = yield (a, env, False)
+            print(val(v), end=" ")
+
+        print("")
+
+        return NULL
+
+    def ev_for(node, env, tail):
+        _, init, cond, step, body = node
+        yield (init, env, False)
+        while True:
+            cond_val = yield (cond, env, False)
+            if not val(cond_val):
+                break
+            res = yield (body, env, False)
+            if res and res[0] == "break":
+                break
+            yield (step, env, False)
+        return NULL
+
+    def ev_unary(node, env, tail):
+        _, op, e = node
+
+        v = val((yield (e, env, False)))
+
+        if op == "-":
+            return mk_num(-v)
+
+        if op == "!":
+            return FALSE if v else TRUE
+
+        err(f"非法一元运算符{op}")
+
+    def ev_binary(node, env, tail):
+        _, op, e1, e2 = node
+
+        v1 = val((yield (e1, env, False)))
+        if op == "&&":
+            if v1 == False:
+                return FALSE
+            else:
+                return (yield (e2, env, False))
+
+        if op == "||":
+            if v1 == True:
+                return TRUE
+            else:
+                return (yield (e2, env, False))
+
+        v2 = val((yield (e2, env, False)))
+
+        if op == "+":
+            return mk_num(v1 + v2)
+
+        if op == "-":
+            return mk_num(v1 - v2)
+
+        if op == "*":
+            return mk_num(v1 * v2)
+
+        if op == "/":
+            return mk_num(v1 / v2)
+
+        if op == ">":
+            return mk_bool(v1 > v2)
+        if op == ">=":
+            return mk_bool(v1 >= v2)
+        if op == "<":
+            return mk_bool(v1 < v2)
+        if op == "<=":
+            return mk_bool(v1 <= v2)
+        if op == "==":
+            return mk_bool(v1 == v2)
+        if op == "!=":
+            return mk_bool(v1 != v2)
+        if op == "^":
+            return mk_num(v1**v2)
+
+        err(f"非法二元运算符{op}")
+
+    def ev_if(node, env, tail):
+        _, cond, true_s, false_s = node
+
+        if (yield (cond, env, False)) == TRUE:
+            return (yield (true_s, env, tail))
+
+        if false_s != None:
+            return (yield (false_s, env, tail))
+
+        return NULL
+
+    def ev_if_expr(node, env, tail):
+        _, cond, true_e, false_e = node
+        c = yield (cond, env, False)
+        if val(c):
+            return (yield (true_e, env, tail))
+        return (yield (false_e, env, tail))
+
+    def ev_while(node, env, tail):
+        _, cond, body = node
+
+        r = NULL
+        prev_r = NULL
+        while (yield (cond, env, False)) == TRUE:
+            r = yield (body, env, False)
+            if r[0] == "break":
+                r = prev_r
+                break
+
+            if r[0] == "continue":
+                continue
+            prev_r = r
+
+        return r
+
+    def ev_block(node, env, tail):
+        _, statements = node
+
+        r = NULL
+        last = len(statements) - 1
+
+        for i, s in enumerate(statements):
+            r = yield (s, env, tail and i == last)
+            if r[0] in ["break", "continue"]:
+                return r
+
+        return r
+
+    def ev_define(node, env, tail):
+        _, name, e = node
+        v = yield (e, env, False)
+
+        define_var(env, name, v)
+        return NULL
+
+    def ev_assign(node, env, tail):
+        _, target, value_expr = node
+        value = yield (value_expr, env, False)
+        if target[0] == "id":
+            set_var(env, target[1], value)
+        elif target[0] == "array_access":
+            arr_expr, index_expr = target[1], target[2]
+            arr = yield (arr_expr, env, False)
+            index = val((yield (index_expr, env, False)))
+            if arr[0] != "array":
+                error("assign", "只能对数组类型进行索引赋值")
+            if not isinstance(index, int):
+                error("assign", "数组索引必须是整数")
+            if index < 0 or index >= len(arr[1]):
+                error("assign", f"数组索引越界: {index}")
+            array_store(arr, index, value)
+        elif target[0] == "struct_access":
+            obj_expr, field = target[1], target[2]
+            obj = yield (obj_expr, env, False)
+            if obj[0] != "struct":
+                error("assign", "只能对结构体类型进行属性赋值")
+            slot = obj[1].shape.get(field)
+            if slot is None:
+                error("assign", f"不存在的字段: {field}")
+            obj[1].values[slot] = value
+        else:
+            err("非法的左值表达式")
+        return NULL
+
+    def ev_return(node, env, tail):
+        _, e = node
+
+        if e != None:
+            return (yield (e, env, tail))
+        else:
+            return NULL
+
+    def ev_array(node, env, tail):
+        _, elements = node
+        evaluated_elements = []
+        for e in elements:
+            evaluated_elements.append((yield (e, env, False)))
+        return mk_array(evaluated_elements)
+
+    def ev_struct(node, env, tail):
+        _, fields = node
+        values = []
+        for value_expr in fields.values():
+            values.append((yield (value_expr, env, False)))
+        return mk_struct(struct_shape(fields), values)
+
+    def ev_array_access(node, env, tail):
+        _, arr_expr, index_expr = node
+
+        arr = yield (arr_expr, env, False)
+        index = val((yield (index_expr, env, False)))
+
+        if arr[0] != "array":
+            err("只能对数组类型进行索引访问")
+        if not isinstance(index, int):
+            err("数组索引必须是整数")
+        if index < 0 or index >= len(arr[1]):
+            err(f"数组索引越界: {index}")
+        return arr[1][index]
+
+    def ev_struct_access(node, env, tail):
+        _, obj_expr, field = node
+        obj = yield (obj_expr, env, False)
+
+        if obj[0] != "struct":
+            error("struct_access", "只能对结构体类型进行属性访问")
+        slot = obj[1].shape.get(field)
+        if slot is None:
+            error("struct_access", f"不存在的字段: {field}")
+        return obj[1].values[slot]
+
+    def ev_call(node, env, tail):
+        _, f_expr, args = node
+        f = yield (f_expr, env, False)
+        if isinstance(f, list) and f[0] == "proc":
+            _, params, body = f
+            evaluated_args = []
+            for a in args:
+                evaluated_args.append((yield (a, env, False)))
+            if len(params) != len(evaluated_args):
+                err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(evaluated_args)} 个")
+            local_env = env.copy()
+            for param, arg in zip(params, evaluated_args):
+                local_env[param] = arg
+            if tail:
+                return ["tail_call", body, local_env]
+
+            r = yield (body, local_env, True)
+            while r[0] == "tail_call":
+                _, body, local_env = r
+                r = yield (body, local_env, True)
+            return r
+        elif isinstance(f, list) and f[0] == "builtin":
+            evaluated_args = []
+            for a in args:
+                evaluated_args.append((yield (a, env, False)))
+            r = call_builtin(f, evaluated_args)
+            # cilly 值都是列表，先比较类型，普通调用不用再调 isawaitable
+            if type(r) is not list and isawaitable(r):
+                r = yield (AWAIT, r, False)
+            return r
+        elif callable(f):
+            evaluated_args = []
+            for a in args:
+                evaluated_args.append(host_arg((yield (a, env, False))))
+            try:
+                f(*evaluated_args)
+                return NULL
+            except Exception as e:
+                err(f"调用 Python 函数时出错: {e}")
+        else:
+            err(f"非法函数: {f}")
+
+    visitors = {
+        "program": ev_program,
+        "expr_stat": ev_expr_stat,
+        "print": ev_print,
+        "if": ev_if,
+        "while": ev_while,
+        "block": ev_block,
+        "define": ev_define,
+        "assign": ev_assign,
+        "unary": ev_unary,
+        "binary": ev_binary,
+        "return": ev_return,
+        "call": ev_call,
+        "for": ev_for,
+        "if_expr": ev_if_expr,
+        "array": ev_array,
+        "struct": ev_struct,
+        "array_access": ev_array_access,
+        "struct_access": ev_struct_access,
+    }
+
+    def run(node, env):
+        stack = []
+        value = NULL
+        tail = False
+
+        while True:
+            if node is not None:
+                tag = node[0]
+                if tag in leaves:
+                    value = leaves[tag](node, env)
+                elif tag in visitors:
+                    if len(stack) >= max_depth:
+                        err(f"递归太深: 正在求值的节点超过 {max_depth} 个")
+                    stack.append(visitors[tag](node, env, tail))
+                    value = None
+                elif node is AWAIT:
+                    close_awaitable(env)
+                    err("python 函数返回了 awaitable，需要用 cilly_eval_async 执行")
+                else:
+                    err(f"非法节点{node}")
+
+            if not stack:
+                return value
+
+            try:
+                node, env, tail = stack[-1].send(value)
+            except StopIteration as e:
+                stack.pop()
+                node = None
+                value = e.value
+
+    # 和 run 相同，只是 AWAIT 时 await 内置函数返回的 awaitable（放在 env 的位置上）
+    async def arun(node, env):
+        stack = []
+        value = NULL
+        tail = False
+        steps = 0
+
+        while True:
+            if node is not None:
+                if node is AWAIT:
+                    value = await env
+                else:
+                    tag = node[0]
+                    if tag in leaves:
+                        value = leaves[tag](node, env)
+                    elif tag in visitors:
+                        if len(stack) >= max_depth:
+                            err(f"递归太深: 正在求值的节点超过 {max_depth} 个")
+                        stack.append(visitors[tag](node, env, tail))
+                        value = None
+                    else:
+                        err(f"非法节点{node}")
+
+                steps += 1
+                if steps >= ASYNC_QUANTUM:
+                    steps = 0
+                    await asyncio.sleep(0)
+
+            if not stack:
+                return value
+
+            try:
+                node, env, tail = stack[-1].send(value)
+            except StopIteration as e:
+                stack.pop()
+                node = None
+                value = e.value
+
+    if async_calls:
+        return arun(ast, env)
+    return run(ast, env)
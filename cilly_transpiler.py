@@ -0,0 +1,748 @@
+import sys
+
+from cilly_interpreter import error, cilly_eval, val, NULL, TRUE, FALSE
+from cilly_interpreter import ast_children, mk_struct, struct_shape, struct_cache_miss
+from cilly_interpreter import mk_array, array_store, call_builtin, host_arg
+from cilly_cache import source_digest, cilly_parse_source
+
+"""
+cilly -> python 源码转译器
+
+把 cilly_parser 的 AST 翻译成 python 源码，compile() 之后 exec 执行：
+while/for/break/continue 变成 python 的原生循环，每个 cilly 函数变成一个 python 函数，
+表达式直接写成对装箱值的运算，例如 a + 1 变成 ["num", (env["a"][1] + 1)]。
+
+运行时的语义和 cilly_eval 一致：
+1. 值仍是 ["num", 1] 这样的列表，函数值仍是 ["proc", params, body]，
+   打印结果、传给 python 函数的参数和 cilly_eval 一样
+2. 动态作用域：调用时复制调用处的环境，变量存放在 env 字典里；
+   没有任何函数能看到的参数（见 analyze）才直接用 python 的局部变量，
+   函数不写环境时也不再复制
+3. return 不会中断所在的块，块的值是最后一条语句的值；
+   break/continue 作为值从函数里返回时，同样会中断调用处的块和循环
+4. 尾位置上的调用不占 python 的调用栈，和 cilly_eval 一样支持深度尾递归
+5. 未定义变量、数组越界等错误的信息和 cilly_eval 相同
+
+cilly_run_python 按源码的 sha256 缓存生成的代码对象，同一段源码只转译一次。
+"""
+
+# 一个源码缓存的代码对象个数上限
+TRANSPILE_CACHE_SIZE = 128
+
+BIN_NUM_OPS = {"+": "+", "-": "-", "*": "*", "/": "/", "^": "**"}
+BIN_BOOL_OPS = {">": ">", ">=": ">=", "<": "<", "<=": "<=", "==": "==", "!=": "!="}
+
+
+def fun_params(fun):
+    return fun[2] if fun[0] == "fun_def" else fun[1]
+
+
+# 函数体里（不进入嵌套函数）满足 pred 的节点
+def walk_body(body, pred):
+    r = []
+
+    def walk(node):
+        if pred(node):
+            r.append(node)
+        if node[0] in ["fun_def", "fun_expr"]:
+            return
+        for c in ast_children(node):
+            walk(c)
+
+    walk(body)
+    return r
+
+
+# 返回 (funs, observed, dyn)
+#   funs: 所有函数节点
+#   observed: 可能被动态作用域看到的名字：函数里读写的非本函数参数的名字，以及函数里定义的名字。
+#     参数名不在 observed 里时，调用处的环境里有没有它、被调函数里有没有它都不影响结果，
+#     可以用 python 局部变量
+#   dyn: 是否有函数会把 break/continue 当作返回值，这时任何表达式的值都可能是 break/continue
+def analyze(ast):
+    funs = []
+
+    def collect(node):
+        if node[0] in ["fun_def", "fun_expr"]:
+            funs.append(node)
+        for c in ast_children(node):
+            collect(c)
+
+    collect(ast)
+
+    observed = set()
+    for f in funs:
+        params = set(fun_params(f))
+        body = f[-1]
+
+        for n in walk_body(body, lambda n: n[0] == "id"):
+            if n[1] not in params:
+                observed.add(n[1])
+
+        for n in walk_body(body, lambda n: n[0] == "assign" and n[1][0] == "id"):
+            if n[1][1] not in params:
+                observed.add(n[1][1])
+
+        # 函数体本身是 fun_def/fun_expr 节点时 walk_body 不会进入它，这里只取函数体里的定义
+        for n in walk_body(body, lambda n: n[0] in ["define", "fun_def"]):
+            if n is not body:
+                observed.add(n[1])
+
+    dyn = any(may_exit(f[-1], False) != (False, False) for f in funs)
+
+    return funs, observed, dyn
+
+
+# 语句的值可能是 (break, continue) 中的哪些
+def may_exit(node, dyn):
+    tag = node[0]
+
+    if tag == "break":
+        return True, False
+
+    if tag == "continue":
+        return False, True
+
+    if tag == "block":
+        b, c = False, False
+        for s in node[1]:
+            sb, sc = may_exit(s, dyn)
+            b, c = b or sb, c or sc
+        return b, c
+
+    if tag == "if":
+        b, c = may_exit(node[2], dyn)
+        if node[3] is not None:
+            fb, fc = may_exit(node[3], dyn)
+            b, c = b or fb, c or fc
+        return b, c
+
+    # break 之后 while 的值是上一轮的值，最后一轮以 continue 结束时 while 的值是 continue
+    if tag == "while":
+        return False, may_exit(node[2], dyn)[1]
+
+    if tag in ["expr_stat", "return"]:
+        e = node[1]
+        if dyn and e is not None and e[0] not in ["num", "str", "true", "false", "null"]:
+            return True, True
+
+    return False, False
+
+
+def cilly_to_python(ast):
+    def err(msg):
+        error("cilly transpiler", msg)
+
+    funs, observed, dyn = analyze(ast)
+
+    consts = []
+    const_index = {}
+
+    def const(obj):
+        i = const_index.get(id(obj))
+        if i is None:
+            i = len(consts)
+            consts.append(obj)
+            const_index[id(obj)] = i
+        return f"K[{i}]"
+
+    fun_names = {}
+    defs = []
+    counter = [0]
+
+    def new_name(prefix):
+        counter[0] += 1
+        return f"{prefix}{counter[0]}"
+
+    # 每个 python 函数的编译状态：局部化的参数名
+    class Scope:
+        def __init__(self, local_params):
+            self.locals = local_params
+
+    # 循环/块的上下文：break/continue 发生时怎样退出
+    #   top:   程序顶层，语句的值不检查
+    #   once:  顶层的块，放在只执行一次的 for 里，退出就是 break
+    #   func:  函数体里，退出就是 return
+    #   while: 原生 while 循环，track 时维护 while 的值 _r 和上一轮的值 prev
+    #   for:   原生 for 循环，continue 之前先执行 step
+    class Ctx:
+        def __init__(self, kind, prev=None, track=False, step=None):
+            self.kind = kind
+            self.prev = prev
+            self.track = track
+            self.step = step
+
+    def emit_exit(lines, ind, scope, ctx, which, value):
+        pad = "    " * ind
+
+        if ctx.kind == "while":
+            if which == "break":
+                if ctx.track:
+                    lines.append(f"{pad}_r = {ctx.prev}")
+                lines.append(f"{pad}break")
+            else:
+                if ctx.track and value != "_r":
+                    lines.append(f"{pad}_r = {value}")
+                lines.append(f"{pad}continue")
+        elif ctx.kind == "for":
+            if which == "break":
+                lines.append(f"{pad}break")
+            else:
+                stat(ctx.step, lines, ind, scope, Ctx("top"), False, False)
+                lines.append(f"{pad}continue")
+        elif ctx.kind == "func":
+            lines.append(f"{pad}return {value}")
+        elif ctx.kind == "once":
+            if value != "_r":
+                lines.append(f"{pad}_r = {value}")
+            lines.append(f"{pad}break")
+        else:
+            if value != "_r":
+                lines.append(f"{pad}_r = {value}")
+
+    # 语句执行后 _r 可能是 break/continue 时的检查
+    def emit_check(lines, ind, scope, ctx, flags):
+        if ctx.kind == "top":
+            return
+
+        pad = "    " * ind
+        b, c = flags
+
+        if ctx.kind in ["func", "once"] or not (b and c):
+            if b and c:
+                lines.append(f'{pad}if _r[0] in ("break", "continue"):')
+                emit_exit(lines, ind + 1, scope, ctx, "break", "_r")
+            elif b:
+                lines.append(f'{pad}if _r[0] == "break":')
+                emit_exit(lines, ind + 1, scope, ctx, "break", "_r")
+            elif c:
+                lines.append(f'{pad}if _r[0] == "continue":')
+                emit_exit(lines, ind + 1, scope, ctx, "continue", "_r")
+            return
+
+        lines.append(f'{pad}if _r[0] == "break":')
+        emit_exit(lines, ind + 1, scope, ctx, "break", "_r")
+        lines.append(f'{pad}elif _r[0] == "continue":')
+        emit_exit(lines, ind + 1, scope, ctx, "continue", "_r")
+
+    # ---------- 表达式 ----------
+
+    # 表达式的 val()：数字运算、比较和字面量直接算出 python 值，省掉中间的装箱
+    def uexpr(node, scope):
+        tag = node[0]
+
+        if tag in ["num", "str"]:
+            return repr(node[1])
+
+        if tag == "unary" and node[1] in ["-", "!"]:
+            _, op, e = node
+            e = uexpr(e, scope)
+            return f"(-{e})" if op == "-" else f"(not {e})"
+
+        if tag == "binary" and (node[1] in BIN_NUM_OPS or node[1] in BIN_BOOL_OPS):
+            _, op, e1, e2 = node
+            py_op = BIN_NUM_OPS.get(op) or BIN_BOOL_OPS[op]
+            return f"({uexpr(e1, scope)} {py_op} {uexpr(e2, scope)})"
+
+        return f"({expr(node, scope)})[1]"
+
+    # if/while 的条件：值 == TRUE。比较运算的结果只会是 TRUE/FALSE，直接用 python 的比较
+    def cond_expr(node, scope):
+        tag = node[0]
+
+        if tag == "binary" and node[1] in BIN_BOOL_OPS:
+            return uexpr(node, scope)
+
+        if tag == "unary" and node[1] == "!":
+            return uexpr(node, scope)
+
+        if tag == "true":
+            return "True"
+
+        return f"{expr(node, scope)} == TRUE"
+
+    def expr(node, scope):
+        tag = node[0]
+
+        if tag in ["num", "str"]:
+            return const(node)
+
+        if tag == "true":
+            return "TRUE"
+
+        if tag == "false":
+            return "FALSE"
+
+        if tag == "null":
+            return "NULL"
+
+        if tag == "id":
+            name = node[1]
+            if name in scope.locals:
+                return f"v_{name}"
+            return f'env["{name}"]'
+
+        if tag == "unary":
+            _, op, e = node
+            if op == "-":
+                return f'["num", -{uexpr(e, scope)}]'
+            if op == "!":
+                return f"(FALSE if {uexpr(e, scope)} else TRUE)"
+            return f'_err_op({uexpr(e, scope)}, "非法一元运算符{op}")'
+
+        if tag == "binary":
+            _, op, e1, e2 = node
+
+            if op == "&&":
+                return f"(FALSE if {uexpr(e1, scope)} == False else {expr(e2, scope)})"
+            if op == "||":
+                return f"(TRUE if {uexpr(e1, scope)} == True else {expr(e2, scope)})"
+            if op in BIN_NUM_OPS:
+                return f'["num", {uexpr(node, scope)}]'
+            if op in BIN_BOOL_OPS:
+                return f"(TRUE if {uexpr(node, scope)} else FALSE)"
+            return f'_err_op({uexpr(e1, scope)}, {uexpr(e2, scope)}, "非法二元运算符{op}")'
+
+        if tag == "if_expr":
+            _, cond, true_e, false_e = node
+            return f"({expr(true_e, scope)} if {uexpr(cond, scope)} else {expr(false_e, scope)})"
+
+        if tag == "call":
+            _, f, args = node
+            args = ", ".join(expr(a, scope) for a in args)
+            return f"_call(_fn({expr(f, scope)}), env, [{args}])"
+
+        if tag == "fun_expr":
+            _, params, body = node
+            return f'["proc", {const(params)}, {const(body)}]'
+
+        if tag == "array":
+            return "_mk_array([" + ", ".join(expr(e, scope) for e in node[1]) + "])"
+
+        if tag == "struct":
+            values = ", ".join(expr(e, scope) for e in node[1].values())
+            return f"_mk_struct({const(struct_shape(node[1]))}, [{values}])"
+
+        if tag == "array_access":
+            _, arr, index = node
+            return f"_index({expr(arr, scope)}, {expr(index, scope)})"
+
+        # 每一处字段访问有自己的内联缓存 [形状, 槽位]，形状相同时直接按槽位读
+        if tag == "struct_access":
+            _, obj, field = node
+            c = const([None, 0])
+            return (
+                f'(_s.values[{c}[1]] if (_o := {expr(obj, scope)})[0] == "struct" and (_s := _o[1]).shape is {c}[0] '
+                f"else _field(_o, {field!r}, {c}))"
+            )
+
+        return f"_err({repr('非法节点' + str(node))})"
+
+    # ---------- 语句 ----------
+    # want: 需要把语句的值放进 _r；tail: 在函数体的尾位置
+
+    def stat(node, lines, ind, scope, ctx, want, tail):
+        pad = "    " * ind
+        tag = node[0]
+
+        if tag in ["expr_stat", "return"]:
+            e = node[1]
+
+            if tail and e is not None:
+                if e[0] == "call":
+                    _, f, args = e
+                    args = ", ".join(expr(a, scope) for a in args)
+                    lines.append(f"{pad}return TailCall(_fn({expr(f, scope)}), env, [{args}])")
+                    return
+
+                if e[0] == "if_expr":
+                    _, cond, true_e, false_e = e
+                    lines.append(f"{pad}if {uexpr(cond, scope)}:")
+                    stat(["return", true_e], lines, ind + 1, scope, ctx, want, tail)
+                    lines.append(f"{pad}else:")
+                    stat(["return", false_e], lines, ind + 1, scope, ctx, want, tail)
+                    return
+
+            flags = may_exit(node, dyn)
+            v = expr(e, scope) if e is not None else "NULL"
+            if want or flags != (False, False):
+                lines.append(f"{pad}_r = {v}")
+                emit_check(lines, ind, scope, ctx, flags)
+            else:
+                lines.append(f"{pad}{v}")
+            return
+
+        if tag == "print":
+            for a in node[1]:
+                lines.append(f'{pad}print({uexpr(a, scope)}, end=" ")')
+            lines.append(f'{pad}print("")')
+            if want:
+                lines.append(f"{pad}_r = NULL")
+            return
+
+        if tag == "define" or tag == "fun_def":
+            if tag == "define":
+                _, name, e = node
+                v = expr(e, scope)
+            else:
+                _, name, params, body = node
+                v = f'["proc", {const(params)}, {const(body)}]'
+
+            lines.append(f"{pad}_t = {v}")
+            lines.append(f'{pad}if "{name}" in env:')
+            lines.append(f'{pad}    _error("define var", "变量已定义{name}")')
+            lines.append(f'{pad}env["{name}"] = _t')
+            if want:
+                lines.append(f"{pad}_r = NULL")
+            return
+
+        if tag == "assign":
+            _, target, e = node
+            v = expr(e, scope)
+
+            if target[0] == "id":
+                name = target[1]
+                if name in scope.locals:
+                    lines.append(f"{pad}v_{name} = {v}")
+                else:
+                    lines.append(f"{pad}_t = {v}")
+                    lines.append(f'{pad}if "{name}" not in env:')
+                    lines.append(f'{pad}    _error("set var", "未定义变量{name}")')
+                    lines.append(f'{pad}env["{name}"] = _t')
+            elif target[0] == "array_access":
+                arr = expr(target[1], scope)
+                index = expr(target[2], scope)
+                lines.append(f"{pad}_set_index({v}, {arr}, {index})")
+            elif target[0] == "struct_access":
+                obj = expr(target[1], scope)
+                c = const([None, 0])
+                lines.append(f"{pad}_t = {v}")
+                lines.append(f"{pad}_o = {obj}")
+                lines.append(f'{pad}if _o[0] == "struct" and _o[1].shape is {c}[0]:')
+                lines.append(f"{pad}    _o[1].values[{c}[1]] = _t")
+                lines.append(f"{pad}else:")
+                lines.append(f"{pad}    _set_field(_t, _o, {target[2]!r}, {c})")
+            else:
+                lines.append(f"{pad}{v}")
+                lines.append(f'{pad}_err("非法的左值表达式")')
+
+            if want:
+                lines.append(f"{pad}_r = NULL")
+            return
+
+        if tag == "block":
+            statements = node[1]
+            if not statements:
+                if want:
+                    lines.append(f"{pad}_r = NULL")
+                return
+
+            last = len(statements) - 1
+            for i, s in enumerate(statements):
+                stat(s, lines, ind, scope, ctx, want and i == last, tail and i == last)
+            return
+
+        if tag == "if":
+            _, cond, true_s, false_s = node
+            lines.append(f"{pad}if {cond_expr(cond, scope)}:")
+            stat_body(true_s, lines, ind + 1, scope, ctx, want, tail)
+            if false_s is not None:
+                lines.append(f"{pad}else:")
+                stat_body(false_s, lines, ind + 1, scope, ctx, want, tail)
+            elif want:
+                lines.append(f"{pad}else:")
+                lines.append(f"{pad}    _r = NULL")
+            return
+
+        if tag == "while":
+            _, cond, body = node
+            flags = (False, may_exit(body, dyn)[1])
+            check = ctx.kind != "top" and flags[1]
+            track = want or check
+
+            prev = new_name("_p")
+            if track:
+                lines.append(f"{pad}_r = NULL")
+                lines.append(f"{pad}{prev} = NULL")
+
+            lines.append(f"{pad}while {cond_expr(cond, scope)}:")
+            loop = Ctx("while", prev, track)
+            stat_body(body, lines, ind + 1, scope, loop, track, False)
+            if track:
+                lines.append(f"{pad}    {prev} = _r")
+
+            if check:
+                emit_check(lines, ind, scope, ctx, flags)
+            return
+
+        if tag == "for":
+            _, init, cond, step, body = node
+            stat(init, lines, ind, scope, Ctx("top"), False, False)
+            lines.append(f"{pad}while True:")
+            lines.append(f"{pad}    if not {uexpr(cond, scope)}:")
+            lines.append(f"{pad}        break")
+            stat_body(body, lines, ind + 1, scope, Ctx("for", step=step), False, False)
+            stat(step, lines, ind + 1, scope, Ctx("top"), False, False)
+            if want:
+                lines.append(f"{pad}_r = NULL")
+            return
+
+        if tag in ["break", "continue"]:
+            value = f'["{tag}"]'
+            if ctx.kind == "top":
+                if want:
+                    lines.append(f"{pad}_r = {value}")
+                return
+            emit_exit(lines, ind, scope, ctx, tag, value)
+            return
+
+        lines.append(f"{pad}_err({repr('非法节点' + str(node))})")
+
+    # python 的块不能为空
+    def stat_body(node, lines, ind, scope, ctx, want, tail):
+        n = len(lines)
+        stat(node, lines, ind, scope, ctx, want, tail)
+        if len(lines) == n:
+            lines.append("    " * ind + "pass")
+
+    def compile_fun(fun):
+        params = fun_params(fun)
+        body = fun[-1]
+        name = new_name("_f")
+        fun_names[id(body)] = name
+
+        local_params = {p for p in params if p not in observed}
+        scope = Scope(local_params)
+
+        # 函数不写环境时直接用调用处的环境，不用复制
+        writes = any(p not in local_params for p in params) or walk_body(
+            body,
+            lambda n: n[0] in ["define", "fun_def"]
+            or (n[0] == "assign" and n[1][0] == "id" and n[1][1] not in local_params),
+        )
+
+        lines = [f"def {name}(env, args):"]
+        lines.append(f"    if len(args) != {len(params)}:")
+        lines.append(f'        _err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {{len(args)}} 个")')
+        if writes:
+            lines.append("    env = env.copy()")
+        for i, p in enumerate(params):
+            if p in local_params:
+                lines.append(f"    v_{p} = args[{i}]")
+            else:
+                lines.append(f'    env["{p}"] = args[{i}]')
+        lines.append("    _r = NULL")
+        stat(body, lines, 1, scope, Ctx("func"), True, True)
+        lines.append("    return _r")
+
+        defs.append("\n".join(lines))
+        return name
+
+    for f in funs:
+        compile_fun(f)
+
+    if ast[0] != "program":
+        err(f"只能转译整个程序: {ast[0]}")
+
+    lines = ["def _main(env):", "    _r = NULL"]
+    statements = ast[1]
+    scope = Scope(set())
+    last = len(statements) - 1
+    for i, s in enumerate(statements):
+        flags = may_exit(s, dyn)
+        # 顶层的块里出现 break/continue 时，跳过块里剩下的语句
+        if s[0] in ["block", "if"] and flags != (False, False):
+            lines.append("    for _once in ONCE:")
+            stat_body(s, lines, 2, scope, Ctx("once"), True, False)
+        else:
+            stat(s, lines, 1, scope, Ctx("top"), i == last, False)
+    lines.append("    return _r")
+    defs.append("\n".join(lines))
+
+    funs_table = ", ".join(f"({const(f[-1])}, {fun_names[id(f[-1])]})" for f in funs)
+    defs.append(f"FUNS = [{funs_table}]")
+
+    return "\n\n\n".join(defs) + "\n", consts
+
+
+# 尾位置上的调用：由 _call 的循环接着执行
+class TailCall:
+    __slots__ = ("fn", "env", "args")
+
+    def __init__(self, fn, env, args):
+        self.fn = fn
+        self.env = env
+        self.args = args
+
+
+def mk_runtime(consts):
+    def err(msg):
+        return error("cilly eval", msg)
+
+    bodies = {}
+
+    def call(fn, env, args):
+        r = fn(env, args)
+        while r.__class__ is TailCall:
+            r = r.fn(r.env, r.args)
+        return r
+
+    def host_fn(f):
+        def run(env, args):
+            evaluated_args = [host_arg(a) for a in args]
+            try:
+                f(*evaluated_args)
+                return NULL
+            except Exception as e:
+                err(f"调用 Python 函数时出错: {e}")
+
+        return run
+
+    def builtin_fn(f):
+        def run(env, args):
+            return call_builtin(f, args)
+
+        return run
+
+    # 不是本程序定义的函数（例如交互环境里前面输入的），交给 cilly_eval 执行
+    def foreign_fn(params, body):
+        def run(env, args):
+            if len(params) != len(args):
+                err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(args)} 个")
+            local_env = env.copy()
+            for param, arg in zip(params, args):
+                local_env[param] = arg
+            return cilly_eval(body, local_env)
+
+        return run
+
+    def fn(f):
+        if isinstance(f, list) and f[0] == "proc":
+            _, params, body = f
+            entry = bodies.get(id(body))
+            if entry is None or entry[0] is not body:
+                return foreign_fn(params, body)
+            return entry[1]
+        elif isinstance(f, list) and f[0] == "builtin":
+            return builtin_fn(f)
+        elif callable(f):
+            return host_fn(f)
+        else:
+            err(f"非法函数: {f}")
+
+    def index(arr, index):
+        index = val(index)
+        if arr[0] != "array":
+            err("只能对数组类型进行索引访问")
+        if not isinstance(index, int):
+            err("数组索引必须是整数")
+        if index < 0 or index >= len(arr[1]):
+            err(f"数组索引越界: {index}")
+        return arr[1][index]
+
+    # 内联缓存没命中时调用
+    def field(obj, field, cache):
+        if obj[0] != "struct":
+            error("struct_access", "只能对结构体类型进行属性访问")
+        fields = obj[1]
+        return fields.values[struct_cache_miss(fields, field, cache, "struct_access")]
+
+    def set_index(value, arr, index):
+        index = val(index)
+        if arr[0] != "array":
+            error("assign", "只能对数组类型进行索引赋值")
+        if not isinstance(index, int):
+            error("assign", "数组索引必须是整数")
+        if index < 0 or index >= len(arr[1]):
+            error("assign", f"数组索引越界: {index}")
+        array_store(arr, index, value)
+
+    def set_field(value, obj, field, cache):
+        if obj[0] != "struct":
+            error("assign", "只能对结构体类型进行属性赋值")
+        fields = obj[1]
+        fields.values[struct_cache_miss(fields, field, cache, "assign")] = value
+
+    def err_op(*args):
+        err(args[-1])
+
+    namespace = {
+        "K": consts,
+        "NULL": NULL,
+        "TRUE": TRUE,
+        "FALSE": FALSE,
+        "ONCE": (None,),
+        "TailCall": TailCall,
+        "_call": call,
+        "_fn": fn,
+        "_index": index,
+        "_field": field,
+        "_mk_struct": mk_struct,
+        "_mk_array": mk_array,
+        "_set_index": set_index,
+        "_set_field": set_field,
+        "_err": err,
+        "_err_op": err_op,
+        "_error": error,
+    }
+
+    return namespace, bodies
+
+
+def cilly_transpile(ast):
+    src, consts = cilly_to_python(ast)
+    code = compile(src, "<cilly>", "exec")
+    return code, consts
+
+
+def cilly_exec_python(code, consts, env):
+    namespace, bodies = mk_runtime(consts)
+    exec(code, namespace)
+
+    for body, f in namespace["FUNS"]:
+        bodies[id(body)] = (body, f)
+
+    missing = None
+    try:
+        return namespace["_main"](env)
+    except KeyError as e:
+        # 生成的代码里只有读变量 env["x"] 会抛 KeyError
+        missing = e.args[0]
+
+    error("lookup var", f"未定义变量{missing}")
+
+
+def cilly_eval_python(ast, env):
+    code, consts = cilly_transpile(ast)
+    return cilly_exec_python(code, consts, env)
+
+
+# (源码的 sha256, optimize) -> (ast, code, consts)
+transpile_cache = {}
+
+
+# optimize: 同 cilly_cache.cilly_parse_source，None 时不做 AST 优化
+def cilly_run_python(src, env, optimize="eval"):
+    key = (source_digest(src), optimize)
+    entry = transpile_cache.get(key)
+
+    if entry is None:
+        # 在内存里解析：没有文件名时磁盘缓存按内容命名，每段新源码都会在当前目录留下一个文件，
+        # 这里 transpile_cache 已经避免了重复解析
+        ast = cilly_parse_source(src, optimize)
+        code, consts = cilly_transpile(ast)
+        entry = (ast, code, consts)
+
+        if len(transpile_cache) >= TRANSPILE_CACHE_SIZE:
+            del transpile_cache[next(iter(transpile_cache))]
+        transpile_cache[key] = entry
+
+    _, code, consts = entry
+    return cilly_exec_python(code, consts, env)
+
+
+# python cilly_transpiler.py prog.cilly 打印生成的 python 代码
+if __name__ == "__main__":
+    from cilly_cache import cilly_load_file
+
+    print(cilly_to_python(cilly_load_file(sys.argv[1]))[0])
@@ -0,0 +1,209 @@
+import math
+
+from cilly_interpreter import error
+
+"""
+cilly 海龟绘图后端
+
+cilly.py 里 forward/right/pencolor 等函数原来直接调用 turtle，每一步都重画窗口，
+画得多的程序要跑几分钟，而且必须有图形界面。这里提供两个后端，env() 返回同样的一组函数：
+
+1. TurtleBatcher：仍然画在 turtle 窗口里。tracer(0) 关掉逐步动画，
+   移动和转向先放进队列，连续的 forward/backward、left/right 合并成一步，
+   每 batch_size 个命令（或 flush() 时）才真正执行并 update() 一次屏幕。
+   颜色命令立即执行，颜色写错时仍在出错的那一行报错。
+2. TurtleRecorder：不需要 Tk，只在内存里记下画出的折线，write_svg() 写成 SVG 文件，
+   适合在服务器上批量渲染：
+
+    rec = TurtleRecorder()
+    cilly_eval(ast, rec.env())
+    rec.write_svg("out.svg")
+
+两个后端的坐标、角度约定和 turtle 一致：起点在原点，朝向东，left 逆时针转，单位是度。
+"""
+
+TURTLE_COMMANDS = ["forward", "backward", "right", "left", "penup", "pendown", "pencolor", "color"]
+
+
+# turtle 的颜色参数：颜色名 / "#rrggbb"，或者 r, g, b（0~1，turtle 默认的 colormode）
+def svg_color(args):
+    if len(args) == 1 and isinstance(args[0], str):
+        return args[0]
+
+    if len(args) == 1 and isinstance(args[0], (tuple, list)):
+        args = args[0]
+
+    if len(args) == 3 and all(isinstance(c, (int, float)) and 0 <= c <= 1 for c in args):
+        return "#" + "".join(f"{round(c * 255):02x}" for c in args)
+
+    error("turtle", f"非法颜色: {args}")
+
+
+def number(name, v):
+    if type(v) is not int and type(v) is not float:
+        error("turtle", f"{name} 的参数必须是数字: {v}")
+    return v
+
+
+class TurtleRecorder:
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.pen = True
+        self.pen_color = "black"
+        self.fill_color = "black"
+        # 画出的折线：[颜色, [(x, y), ...]]，抬笔或换颜色后开始新的一条
+        self.paths = []
+        self.current = None
+
+    def forward(self, distance):
+        distance = number("forward", distance)
+        a = math.radians(self.heading)
+        x = self.x + distance * math.cos(a)
+        y = self.y + distance * math.sin(a)
+
+        if self.pen:
+            if self.current is None:
+                self.current = [self.pen_color, [(self.x, self.y)]]
+                self.paths.append(self.current)
+            self.current[1].append((x, y))
+
+        self.x = x
+        self.y = y
+
+    def backward(self, distance):
+        self.forward(-number("backward", distance))
+
+    def left(self, angle):
+        self.heading = (self.heading + number("left", angle)) % 360
+
+    def right(self, angle):
+        self.left(-number("right", angle))
+
+    def penup(self):
+        self.pen = False
+        self.current = None
+
+    def pendown(self):
+        self.pen = True
+
+    def pencolor(self, *args):
+        self.pen_color = svg_color(args)
+        self.current = None
+
+    # color(c) 同时设置画笔和填充颜色，color(c1, c2) 分别设置
+    def color(self, *args):
+        if len(args) == 2:
+            self.pen_color = svg_color(args[:1])
+            self.fill_color = svg_color(args[1:])
+        else:
+            self.pen_color = self.fill_color = svg_color(args)
+        self.current = None
+
+    def flush(self):
+        pass
+
+    def env(self):
+        return {name: getattr(self, name) for name in TURTLE_COMMANDS}
+
+    # turtle 的 y 轴向上，SVG 的 y 轴向下，输出时翻转
+    def svg(self, margin=10, stroke_width=1):
+        points = [p for _, ps in self.paths for p in ps] or [(0.0, 0.0)]
+        min_x = min(x for x, _ in points)
+        max_x = max(x for x, _ in points)
+        min_y = min(y for _, y in points)
+        max_y = max(y for _, y in points)
+        width = max_x - min_x + 2 * margin
+        height = max_y - min_y + 2 * margin
+
+        def fmt(v):
+            return f"{round(v, 3):g}"
+
+        lines = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{fmt(width)}" height="{fmt(height)}" '
+            f'viewBox="0 0 {fmt(width)} {fmt(height)}">'
+        ]
+        for color, ps in self.paths:
+            coords = " ".join(f"{fmt(x - min_x + margin)},{fmt(max_y - y + margin)}" for x, y in ps)
+            lines.append(
+                f'<polyline points="{coords}" fill="none" stroke="{color}" '
+                f'stroke-width="{stroke_width}" stroke-linecap="round" stroke-linejoin="round"/>'
+            )
+        lines.append("</svg>")
+        return "\n".join(lines) + "\n"
+
+    def write_svg(self, path, margin=10, stroke_width=1):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.svg(margin, stroke_width))
+
+
+class TurtleBatcher:
+    def __init__(self, batch_size=1000):
+        import turtle
+
+        self.turtle = turtle
+        self.batch_size = batch_size
+        # 还没执行的移动/转向：[命令名, 参数]，合并后 forward 的参数是总距离，left 的是总角度
+        self.queue = []
+        self.pending = 0
+        turtle.tracer(0, 0)
+
+    def push(self, name, amount):
+        amount = number(name, amount)
+        queue = self.queue
+        if queue and queue[-1][0] == name:
+            queue[-1][1] += amount
+        else:
+            queue.append([name, amount])
+
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def forward(self, distance):
+        self.push("forward", distance)
+
+    def backward(self, distance):
+        self.push("forward", -number("backward", distance))
+
+    def left(self, angle):
+        self.push("left", angle)
+
+    def right(self, angle):
+        self.push("left", -number("right", angle))
+
+    # 执行队列里的命令，不刷新屏幕
+    def apply(self):
+        t = self.turtle
+        for name, amount in self.queue:
+            if name == "forward":
+                t.forward(amount)
+            else:
+                t.left(amount)
+        self.queue.clear()
+
+    # 抬笔、落笔、换颜色改变之后的画法，先把前面的移动执行掉
+    def penup(self):
+        self.apply()
+        self.turtle.penup()
+
+    def pendown(self):
+        self.apply()
+        self.turtle.pendown()
+
+    def pencolor(self, *args):
+        self.apply()
+        self.turtle.pencolor(*args)
+
+    def color(self, *args):
+        self.apply()
+        self.turtle.color(*args)
+
+    def flush(self):
+        self.apply()
+        self.pending = 0
+        self.turtle.update()
+
+    def env(self):
+        return {name: getattr(self, name) for name in TURTLE_COMMANDS}
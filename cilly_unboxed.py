@@ -0,0 +1,475 @@
+from cilly_interpreter import error, val, NULL, TRUE, FALSE
+from cilly_interpreter import lookup_var, set_var, define_var
+from cilly_interpreter import mk_struct, struct_shape
+from cilly_interpreter import NumArray, NUM_ARRAY_MIN_LEN, pack_nums, call_builtin, host_arg
+from cilly_interpreter import StructView, ArrayView
+
+"""
+cilly 非装箱解释器
+
+cilly_eval 里每个值都是 ["num", v] 这样的列表，每次运算都要 val() 拆箱、
+mk_num() 重新装箱。这里 num/str/bool/null 直接用 python 的
+int/float/str/bool/None 表示，只有 proc、array、struct 仍是带标签的列表
+（["proc", params, body]、["array", items]、["struct", fields]，
+里面的元素也是非装箱的值），用 type(v) is list 就能和普通值区分开。
+数值数组的 NumArray 本来就存放非装箱的数，两边共用同一个对象。
+
+只有在和外界打交道的地方才装箱：print 的输出、传给 python 函数的参数、
+cilly_eval_unboxed 的返回值（交互环境打印结果用），输出与 cilly_eval 一致。
+env 里保存的也是非装箱的值。
+"""
+
+# 本解释器里 break/continue 只会产生这两个对象，按 is 判断
+BREAK = ["break"]
+CONTINUE = ["continue"]
+
+
+# 非装箱值 -> cilly_eval 的装箱值
+def box(v):
+    if v is None:
+        return NULL
+
+    if v is True:
+        return TRUE
+
+    if v is False:
+        return FALSE
+
+    if type(v) is str:
+        return ["str", v]
+
+    if type(v) is not list:
+        return ["num", v]
+
+    tag = v[0]
+
+    if tag == "array":
+        if type(v[1]) is NumArray:
+            return v
+        return ["array", [box(e) for e in v[1]]]
+
+    if tag == "struct":
+        return mk_struct(v[1].shape, [box(e) for e in v[1].values])
+
+    return v
+
+
+# 装箱值 -> 非装箱值
+def unbox(v):
+    tag = v[0]
+
+    if tag == "array":
+        if type(v[1]) is NumArray:
+            return v
+        return ["array", [unbox(e) for e in v[1]]]
+
+    if tag == "struct":
+        return mk_struct(v[1].shape, [unbox(e) for e in v[1].values])
+
+    if tag in ["proc", "builtin"]:
+        return v
+
+    return v[1]
+
+
+# 与 cilly_eval 的 == 一致。cilly_eval 比较的是 val() 的值，数组、结构体里的元素是装箱值，
+# 类型不同就不相等（[1] != [true]），而 python 里 1 == True，所以有一边是列表时装箱后再比较
+def equal(v1, v2):
+    if type(v1) is list or type(v2) is list:
+        return val(box(v1)) == val(box(v2))
+    return v1 == v2
+
+
+# 与 cilly_eval 里 val(v) 看到的值一致，用于 print
+def host_val(v):
+    if type(v) is not list:
+        return v
+
+    return host_arg(box(v))
+
+
+# 非装箱的元素 -> python 函数看到的装箱值，结构体、数组换成视图
+def host_elem(v):
+    if type(v) is not list:
+        return box(v)
+
+    tag = v[0]
+    if tag == "array":
+        return ["array", UnboxedArrayView(v)]
+    if tag == "struct":
+        return ["struct", UnboxedStructView(v[1])]
+    return v
+
+
+def host_store(v):
+    x = v[1]
+    if isinstance(x, StructView):
+        return ["struct", x.fields]
+    if isinstance(x, ArrayView):
+        return x.arr
+    return unbox(v)
+
+
+# python 函数看到的结构体、数组和 cilly_eval 里一样是装箱的值，修改直接作用在非装箱的结构体、数组上
+class UnboxedStructView(StructView):
+    __slots__ = ()
+    load = staticmethod(host_elem)
+    save = staticmethod(host_store)
+
+
+class UnboxedArrayView(ArrayView):
+    __slots__ = ()
+    load = staticmethod(host_elem)
+    save = staticmethod(host_store)
+
+
+# 传给旧式 python 函数的参数
+def host_call_arg(v):
+    if type(v) is not list:
+        return v
+
+    return host_elem(v)[1]
+
+
+def cilly_eval_unboxed(ast, env):
+    def err(msg):
+        return error("cilly eval", msg)
+
+    def ev_program(node, env):
+        _, statements = node
+
+        r = None
+
+        for s in statements:
+            r = visit(s, env)
+
+        return r
+
+    def ev_expr_stat(node, env):
+        _, e = node
+        return visit(e, env)
+
+    def ev_print(node, env):
+        _, args = node
+
+        for a in args:
+            print(host_val(visit(a, env)), end=" ")
+
+        print("")
+
+        return None
+
+    def ev_for(node, env):
+        _, init, cond, step, body = node
+        visit(init, env)
+        while True:
+            if not visit(cond, env):
+                break
+            res = visit(body, env)
+            if res is BREAK:
+                break
+            visit(step, env)
+        return None
+
+    def ev_literal(node, env):
+        tag, v = node
+
+        if tag in ["num", "str"]:
+            return v
+
+        if tag in ["true", "false"]:
+            return tag == "true"
+
+        if tag == "null":
+            return None
+
+        err(f"非法字面量{node}")
+
+    def ev_unary(node, env):
+        _, op, e = node
+
+        v = visit(e, env)
+
+        if op == "-":
+            return -v
+
+        if op == "!":
+            return not v
+
+        err(f"非法一元运算符{op}")
+
+    def ev_binary(node, env):
+        _, op, e1, e2 = node
+
+        v1 = visit(e1, env)
+        if op == "&&":
+            if v1 == False:
+                return False
+            else:
+                return visit(e2, env)
+
+        if op == "||":
+            if v1 == True:
+                return True
+            else:
+                return visit(e2, env)
+
+        v2 = visit(e2, env)
+
+        if op == "+":
+            return v1 + v2
+
+        if op == "-":
+            return v1 - v2
+
+        if op == "*":
+            return v1 * v2
+
+        if op == "/":
+            return v1 / v2
+
+        if op == ">":
+            return v1 > v2
+        if op == ">=":
+            return v1 >= v2
+        if op == "<":
+            return v1 < v2
+        if op == "<=":
+            return v1 <= v2
+        if op == "==":
+            return equal(v1, v2)
+        if op == "!=":
+            return not equal(v1, v2)
+        if op == "^":
+            return v1**v2
+
+        err(f"非法二元运算符{op}")
+
+    # cilly_eval 判断条件时比较的是 == TRUE，只有布尔值 true 才算成立
+    def ev_if(node, env):
+        _, cond, true_s, false_s = node
+
+        if visit(cond, env) is True:
+            return visit(true_s, env)
+
+        if false_s != None:
+            return visit(false_s, env)
+
+        return None
+
+    # 和 cilly_eval 一样按 val() 的真假判断，空结构体是假
+    def ev_if_expr(node, env):
+        _, cond, true_e, false_e = node
+        c = visit(cond, env)
+        if type(c) is list:
+            c = c[1]
+        return visit(true_e, env) if c else visit(false_e, env)
+
+    def ev_while(node, env):
+        _, cond, body = node
+
+        r = None
+        prev_r = None
+        while visit(cond, env) is True:
+            r = visit(body, env)
+            if r is BREAK:
+                r = prev_r
+                break
+
+            if r is CONTINUE:
+                continue
+            prev_r = r
+
+        return r
+
+    def ev_break(node, env):
+        return BREAK
+
+    def ev_continue(node, env):
+        return CONTINUE
+
+    def ev_block(node, env):
+        _, statements = node
+
+        r = None
+
+        for s in statements:
+            r = visit(s, env)
+            if r is BREAK or r is CONTINUE:
+                return r
+
+        return r
+
+    def ev_id(node, env):
+        _, name = node
+
+        return lookup_var(env, name)
+
+    def ev_define(node, env):
+        _, name, e = node
+        v = visit(e, env)
+
+        define_var(env, name, v)
+        return None
+
+    def is_array(v):
+        return type(v) is list and v[0] == "array"
+
+    def is_struct(v):
+        return type(v) is list and v[0] == "struct"
+
+    def ev_assign(node, env):
+        _, target, value_expr = node
+        value = visit(value_expr, env)
+        # 根据左值类型处理
+        if target[0] == "id":
+            set_var(env, target[1], value)
+        elif target[0] == "array_access":
+            arr_expr, index_expr = target[1], target[2]
+            arr = visit(arr_expr, env)
+            index = visit(index_expr, env)
+            if not is_array(arr):
+                error("assign", "只能对数组类型进行索引赋值")
+            if not isinstance(index, int):
+                error("assign", "数组索引必须是整数")
+            if index < 0 or index >= len(arr[1]):
+                error("assign", f"数组索引越界: {index}")
+            items = arr[1]
+            if type(items) is not NumArray:
+                items[index] = value
+            elif not items.store_raw(index, value):
+                # 放不下这个值，换回普通列表
+                items = arr[1] = list(items.data)
+                items[index] = value
+        elif target[0] == "struct_access":
+            obj_expr, field = target[1], target[2]
+            obj = visit(obj_expr, env)
+            if not is_struct(obj):
+                error("assign", "只能对结构体类型进行属性赋值")
+            slot = obj[1].shape.get(field)
+            if slot is None:
+                error("assign", f"不存在的字段: {field}")
+            obj[1].values[slot] = value
+        else:
+            err("非法的左值表达式")
+        return None
+
+    def ev_return(node, env):
+        _, e = node
+
+        if e != None:
+            return visit(e, env)
+        else:
+            return None
+
+    def ev_fun_expr(node, env):
+        _, params, body = node
+        return ["proc", params, body]
+
+    def ev_fun_def(node, env):
+        _, name, params, body = node
+        define_var(env, name, ["proc", params, body])
+        return None
+
+    def ev_array(node, env):
+        _, elements = node
+        values = [visit(e, env) for e in elements]
+        data = pack_nums(values) if len(values) >= NUM_ARRAY_MIN_LEN else None
+        return ["array", values if data is None else NumArray(data)]
+
+    def ev_struct(node, env):
+        _, fields = node
+        return mk_struct(struct_shape(fields), [visit(value_expr, env) for value_expr in fields.values()])
+
+    def ev_array_access(node, env):
+        _, arr_expr, index_expr = node
+
+        arr = visit(arr_expr, env)
+        index = visit(index_expr, env)
+
+        if not is_array(arr):
+            err("只能对数组类型进行索引访问")
+        if not isinstance(index, int):
+            err("数组索引必须是整数")
+        if index < 0 or index >= len(arr[1]):
+            err(f"数组索引越界: {index}")
+        items = arr[1]
+        if type(items) is NumArray:
+            return items.data[index]
+        return items[index]
+
+    def ev_struct_access(node, env):
+        _, obj_expr, field = node
+        obj = visit(obj_expr, env)
+
+        if not is_struct(obj):
+            error("struct_access", "只能对结构体类型进行属性访问")
+        slot = obj[1].shape.get(field)
+        if slot is None:
+            error("struct_access", f"不存在的字段: {field}")
+        return obj[1].values[slot]
+
+    def ev_call(node, env):
+        _, f_expr, args = node
+        f = visit(f_expr, env)
+        if type(f) is list and f[0] == "proc":
+            _, params, body = f
+            evaluated_args = [visit(a, env) for a in args]
+            if len(params) != len(evaluated_args):
+                err(f"参数数量不匹配: 期望 {len(params)} 个，实际 {len(evaluated_args)} 个")
+            local_env = env.copy()
+            for param, arg in zip(params, evaluated_args):
+                local_env[param] = arg
+            return visit(body, local_env)
+        elif type(f) is list and f[0] == "builtin":
+            return unbox(call_builtin(f, [box(visit(a, env)) for a in args]))
+        elif callable(f):
+            # 和 python 函数之间按 cilly_eval 的方式传参
+            evaluated_args = [host_call_arg(visit(a, env)) for a in args]
+            try:
+                f(*evaluated_args)
+                return None
+            except Exception as e:
+                err(f"调用 Python 函数时出错: {e}")
+        else:
+            err(f"非法函数: {box(f)}")
+
+    visitors = {
+        "program": ev_program,
+        "expr_stat": ev_expr_stat,
+        "print": ev_print,
+        "if": ev_if,
+        "while": ev_while,
+        "break": ev_break,
+        "continue": ev_continue,
+        "block": ev_block,
+        "define": ev_define,
+        "assign": ev_assign,
+        "unary": ev_unary,
+        "binary": ev_binary,
+        "return": ev_return,
+        "fun_expr": ev_fun_expr,
+        "call": ev_call,
+        "id": ev_id,
+        "num": ev_literal,
+        "str": ev_literal,
+        "true": ev_literal,
+        "false": ev_literal,
+        "null": ev_literal,
+        "for": ev_for,
+        "fun_def": ev_fun_def,
+        "if_expr": ev_if_expr,
+        "array": ev_array,
+        "struct": ev_struct,
+        "array_access": ev_array_access,
+        "struct_access": ev_struct_access,
+    }
+
+    def visit(node, env):
+        tag = node[0]
+        if tag not in visitors:
+            err(f"非法节点{node}")
+
+        return visitors[tag](node, env)
+
+    return box(visit(ast, env))
@@ -1,5 +1,7 @@
 from cilly_interpreter import error
 from cilly_interpreter import mk_num, mk_str, mk_bool, val, NULL, TRUE, FALSE
+from cilly_interpreter import call_builtin, close_awaitable
+from inspect import isawaitable
 
 from cilly_interpreter import cilly_lexer, cilly_parser
 
@@ -34,23 +36,13 @@ very simple stack machine
 class Stack:
     def __init__(self):
         self.stack = []
-        self.push_count = 0 #记录 push 次数
-        self.pop_count = 0  #记录 pop 次数
-        self.current_depth = 0 #记录当前栈的深度
-        self.max_depth = 0   #记录栈的最大深度
         
     def push(self, v):
         self.stack.append(v)
-        self.push_count += 1
-        self.current_depth += 1
-        if self.current_depth > self.max_depth:
-            self.max_depth = self.current_depth
         
     def pop(self):
         if self.empty():
             raise RuntimeError("Stack underflow")
-        self.pop_count += 1
-        self.current_depth -= 1
         return self.stack.pop()
     
     def top(self):
@@ -188,19 +180,42 @@ OPS_NAME = {
 }
 
 
-def cilly_vm(code, consts, scopes):
+# 创建一个虚拟机实例，返回 (run, run_for, stack, call_stack, suspended)：
+#   run() 从头执行到结束
+#   run_for(pc, budget) 从 pc 开始最多执行 budget 条指令，返回 (下一条指令的地址, 执行了几条)，
+#     地址等于 len(code) 时程序已结束；状态都在实例里，下次接着调用就能继续执行（见 cilly_scheduler）
+#   suspended: async_calls 为真时，内置函数返回 awaitable 的 CALL 把 (awaitable, 返回地址) 放进来，
+#     并让 run_for 停下；调用方 await 得到结果后压栈，再从返回地址继续执行（见 cilly_async）
+#   stats: VMStats，传入时统计操作数栈的 push/pop 次数和最大深度；不传时 push/pop 就是 list 的方法，
+#     没有额外开销
+#   procs: 传给 cilly_vm_compiler 的 procs（函数入口地址 -> 函数节点），memo 和 profiler 要用
+def cilly_vm_machine(
+    code, consts, scopes, memo=None, profiler=None, out=None, async_calls=False, stats=None, procs=None
+):
 
     def err(msg):
         error("cilly vm", msg)
 
-    stack = Stack()
-    call_stack = Stack()
-
-    def push(v):
-        stack.push(v)
-
-    def pop():
-        return stack.pop()
+    # 操作数栈和调用栈都是普通的 list，栈顶是最后一个元素。
+    # 不统计时 pop 就是 list.pop，栈空时抛出的 IndexError 由 run / run_for 换成 Stack underflow 错误
+    stack = []
+    call_stack = []
+
+    if stats is None:
+        push = stack.append
+        pop = stack.pop
+    else:
+        def push(v):
+            stack.append(v)
+            stats.push_count += 1
+            if len(stack) > stats.max_depth:
+                stats.max_depth = len(stack)
+
+        def pop():
+            if not stack:
+                err("Stack underflow")
+            stats.pop_count += 1
+            return stack.pop()
 
     # load 指令进行压栈操作用于运算或赋值
     def load_const(pc):
@@ -280,26 +295,44 @@ def cilly_vm(code, consts, scopes):
 
         push(("compiled_proc", proc_entry, param_count, scopes))    
         return pc + 1
+    suspended = []
+
+    def call_host(f, args, return_addr):
+        r = call_builtin(f, args)
+        # cilly 值都是列表，先比较类型，普通调用不用再调 isawaitable
+        if type(r) is not list and isawaitable(r):
+            if not async_calls:
+                close_awaitable(r)
+                err("python 函数返回了 awaitable，需要用 cilly_vm_async 执行")
+            suspended.append((r, return_addr))
+            return len(code)
+        push(r)
+        return return_addr
+
     def call(pc):
 
         arg_count = code[pc + 1]
         return_addr = pc + 2
 
-        nonlocal scopes
-        call_stack.push((return_addr, scopes))
-
         scope = []
         for _ in range(arg_count):
             scope.append(pop())
         scope.reverse()
 
-        tag, proc_entry, param_count, outer_scopes = pop()
+        f = pop()
+        # python 内置函数（见 cilly_builtins）直接执行，不进入新的调用帧
+        if f[0] == "builtin":
+            return call_host(f, scope, return_addr)
+
+        tag, proc_entry, param_count, outer_scopes = f
 
         if tag != "compiled_proc":
             err(f"非法调用: {tag}")
         if param_count != arg_count:
             err(f"参数个数不匹配: {param_count} != {arg_count}")
- 
+
+        nonlocal scopes
+        call_stack.append((return_addr, scopes))
         scopes = outer_scopes + [scope]
 
         return proc_entry
@@ -308,6 +341,51 @@ def cilly_vm(code, consts, scopes):
         nonlocal scopes
         return_addr, scopes = call_stack.pop()
         return return_addr
+
+    # 记忆化的 CALL：命中时直接压入缓存的值，不进入函数；
+    # 没命中时把缓存的键记在调用帧里，由 memo_ret 在返回时存入缓存
+    def memo_call(pc):
+        arg_count = code[pc + 1]
+        return_addr = pc + 2
+
+        scope = []
+        for _ in range(arg_count):
+            scope.append(pop())
+        scope.reverse()
+
+        f = pop()
+        if f[0] == "builtin":
+            return call_host(f, scope, return_addr)
+
+        tag, proc_entry, param_count, outer_scopes = f
+
+        if tag != "compiled_proc":
+            err(f"非法调用: {tag}")
+        if param_count != arg_count:
+            err(f"参数个数不匹配: {param_count} != {arg_count}")
+
+        key = None
+        if proc_entry in pure_entries:
+            key = memo.key(("vm", proc_entry), scope)
+            if key is not None:
+                hit, v = memo.lookup(key)
+                if hit:
+                    push(v)
+                    return return_addr
+
+        nonlocal scopes
+        call_stack.append((return_addr, scopes, key))
+
+        scopes = outer_scopes + [scope]
+
+        return proc_entry
+
+    def memo_ret(pc):
+        nonlocal scopes
+        return_addr, scopes, key = call_stack.pop()
+        if key is not None:
+            memo.store(key, stack[-1])
+        return return_addr
     def print_item(pc):
         v = val(pop())
         print(v, end=" ")
@@ -318,6 +396,14 @@ def cilly_vm(code, consts, scopes):
 
         return pc + 1
 
+    def print_item_out(pc):
+        out.write(str(val(pop())) + " ")
+        return pc + 1
+
+    def print_newline_out(pc):
+        out.write("\n")
+        return pc + 1
+
     def pop_proc(pc):
         pop()
         return pc + 1
@@ -420,6 +506,17 @@ def cilly_vm(code, consts, scopes):
         BINARY_LT: binary_op,
         BINARY_GE: binary_op,      
     }
+
+    if memo is not None:
+        if procs is None:
+            err("使用 memo 时需要传入 cilly_vm_compiler 记下的 procs")
+        pure_entries = memo.vm_entries(procs)
+        ops[CALL] = memo_call
+        ops[RETURN] = memo_ret
+
+    if out is not None:
+        ops[PRINT_ITEM] = print_item_out
+        ops[PRINT_NEWLINE] = print_newline_out
     
     def get_opcode_proc(opcode):
         if opcode not in ops:
@@ -430,20 +527,90 @@ def cilly_vm(code, consts, scopes):
     def run():
         pc = 0
         
-        while pc < len(code):
-            opcode = code[pc]
-            
-            proc = get_opcode_proc(opcode)
-            
-            pc = proc(pc)
-                            
-    run()
-    # 输出栈统计信息
-    print("\n--- Stack Statistics ---")
-    print(f"Push count: {stack.push_count}")
-    print(f"Pop count: {stack.pop_count}")
-    print(f"Max stack depth: {stack.max_depth}")
-    print(f"Final stack depth: {stack.current_depth}")
+        try:
+            while pc < len(code):
+                opcode = code[pc]
+
+                proc = get_opcode_proc(opcode)
+
+                pc = proc(pc)
+        except IndexError:
+            if not stack:
+                err("Stack underflow")
+            raise
+
+    # 只在传入 profiler 时替换 ops 里的函数，不传时没有额外开销
+    if profiler is not None:
+        opcode_names = {op: name for op, (name, _) in OPS_NAME.items()}
+        run = profiler.instrument_vm(
+            ops, run, opcode_names, procs or {}, lambda: len(call_stack), CALL, RETURN
+        )
+
+    # 出错时异常的 executed 属性是这个时间片里开始执行的指令数（包括出错的那条）
+    def run_for(pc, budget):
+        executed = 0
+        end = len(code)
+        try:
+            try:
+                while pc < end and executed < budget:
+                    pc = get_opcode_proc(code[pc])(pc)
+                    executed += 1
+            except IndexError:
+                if not stack:
+                    err("Stack underflow")
+                raise
+        except Exception as e:
+            e.executed = executed + 1
+            raise
+        return pc, executed
+
+    return run, run_for, stack, call_stack, suspended
+
+
+# 操作数栈的统计信息，cilly_vm(..., stats=True) 时返回
+class VMStats:
+    __slots__ = ("push_count", "pop_count", "max_depth", "final_depth")
+
+    def __init__(self):
+        self.push_count = 0
+        self.pop_count = 0
+        self.max_depth = 0
+        self.final_depth = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        return (
+            "--- Stack Statistics ---\n"
+            f"Push count: {self.push_count}\n"
+            f"Pop count: {self.pop_count}\n"
+            f"Max stack depth: {self.max_depth}\n"
+            f"Final stack depth: {self.final_depth}"
+        )
+
+    def __repr__(self):
+        return f"VMStats({', '.join(f'{k}={v}' for k, v in self.as_dict().items())})"
+
+
+# memo: cilly_memo.MemoCache，传入时缓存纯函数的调用结果
+# profiler: cilly_profiler.Profiler，传入时记录函数耗时和指令执行次数
+# out: cilly_output 的 BufferedSink / CaptureSink 等，传入时 print 的输出写到 out
+# stats: 为真时统计操作数栈的使用情况，返回 VMStats，否则返回 None
+# procs: 传给 cilly_vm_compiler 的 procs，使用 memo 时必须传入，profiler 靠它得到函数名
+def cilly_vm(code, consts, scopes, memo=None, profiler=None, out=None, stats=False, procs=None):
+    stats = VMStats() if stats else None
+    run, _, stack, call_stack, _ = cilly_vm_machine(
+        code, consts, scopes, memo, profiler, out, stats=stats, procs=procs
+    )
+    try:
+        run()
+    finally:
+        if out is not None:
+            out.flush()
+    if stats is not None:
+        stats.final_depth = len(stack)
+    return stats
            
 consts = [
     mk_num(3),
@@ -622,10 +789,18 @@ vars_name = {}
 Cilly vm compiler
 '''
 
-def cilly_vm_compiler(ast, code, consts, scopes):
+# lines: cilly_parser 记下的 id(节点) -> 行号
+# pc_table: 传入列表时，code 的每个位置对应一项 (行号, 所在函数节点)，顶层代码的函数节点为 None
+# procs: 传入字典时，记下 函数入口地址 -> 函数的 AST 节点，cilly_vm 的 memo（找出纯函数）和
+#   profiler（函数名）要用
+def cilly_vm_compiler(ast, code, consts, scopes, lines=None, pc_table=None, procs=None):
     
     def err(msg):
         error('cilly vm compiler', msg)
+
+    # 正在编译的代码所在的行和函数
+    cur_line = None
+    cur_fun = None
     
     def add_const(c):
         for i in range(len(consts)):
@@ -653,6 +828,9 @@ def cilly_vm_compiler(ast, code, consts, scopes):
         if operand2 != None:
             code.append(operand2)
 
+        if pc_table is not None:
+            pc_table.extend([(cur_line, cur_fun)] * (len(code) - addr))
+
         return addr
 
     def backpatch(addr, operand1=None, operand2=None):
@@ -885,12 +1063,20 @@ def cilly_vm_compiler(ast, code, consts, scopes):
         addr2 = emit(JMP, -1)
 
         proc_entry = get_next_emit_addr()
+        if procs is not None:
+            procs[proc_entry] = node
+
+        nonlocal cur_fun
+        outer_fun = cur_fun
+        cur_fun = node
 
         visit(body)
 
         emit(LOAD_NULL)
         emit(RETURN)
 
+        cur_fun = outer_fun
+
         backpatch(addr2, get_next_emit_addr())
         index = add_const(("fun", proc_entry, params_count))
         backpatch(addr1, index)
@@ -983,7 +1169,15 @@ def cilly_vm_compiler(ast, code, consts, scopes):
 
         v = visitors[tag]
 
+        if lines is None or id(node) not in lines:
+            v(node)
+            return
+
+        nonlocal cur_line
+        outer_line = cur_line
+        cur_line = lines[id(node)]
         v(node)
+        cur_line = outer_line
 
     visit(ast)
     return code, consts, scopes
@@ -1098,13 +1292,14 @@ print(add(1,2));
 print(even(3), odd(3));
 """
 
-ts = cilly_lexer(p1)
-ast = cilly_parser(ts)
-print(ast)
-code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
-print(code)
-print(consts)
-cilly_vm_dis(code, consts, vars_name)
-cilly_vm(code, consts, scopes)
+if __name__ == "__main__":
+    ts = cilly_lexer(p1)
+    ast = cilly_parser(ts)
+    print(ast)
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
+    print(code)
+    print(consts)
+    cilly_vm_dis(code, consts, vars_name)
+    print(cilly_vm(code, consts, scopes, stats=True))
         
 
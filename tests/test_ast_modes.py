@@ -0,0 +1,25 @@
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+
+PROGRAMS = [
+    "var a = [1, 2]; a[0] = 0 + 1; print(a == [1, 2], a);",
+    'var s = {x: 1, y: "a"}; var t = {x: 0 + 1, y: "a"}; print(s == t, s);',
+    "var a = [true, null, 1.5]; print(a[0] == true, a[1] == null, a);",
+    'var f = fun(x) { return [x, 2]; }; print(f(1) == [1, 2], f("s"));',
+]
+
+
+def run(src, mode):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cilly_eval(cilly_parser(cilly_lexer(src), mode), {})
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_slots_mode_matches_list_mode(src):
+    assert run(src, "slots") == run(src, "list")
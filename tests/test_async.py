@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import io
+
+import pytest
+
+from cilly_async import cilly_eval_async, cilly_vm_async, compile_program
+from cilly_builtins import HostRegistry
+from cilly_interpreter import cilly_eval
+from cilly_output import CaptureSink
+from cilly_stackless import cilly_eval_stackless
+from cilly_vm_compiler import cilly_vm
+
+
+def run_async(src, host, backend):
+    ast, code, consts, values = compile_program(src, host)
+    if backend == "vm":
+        return cilly_vm_async(code, consts, [values], out=CaptureSink())
+    return cilly_eval_async(ast, host.env())
+
+
+@pytest.fixture
+def host():
+    host = HostRegistry()
+    host.log = []
+    host.ready = None
+
+    @host.function()
+    def log(x):
+        host.log.append(x)
+
+    @host.function()
+    async def wait():
+        await host.ready.wait()
+        return "woke"
+
+    @host.function()
+    def wake():
+        host.ready.set()
+
+    @host.function()
+    async def slow(x):
+        await asyncio.sleep(0)
+        return x * 10
+
+    @host.function()
+    async def boom():
+        raise ValueError("bad io")
+
+    return host
+
+
+@pytest.mark.parametrize("backend", ["vm", "eval"])
+def test_program_suspends_at_async_call(host, backend):
+    waiter = 'log("a1"); log(wait()); log("a2");'
+    waker = 'log("b1"); wake(); log("b2");'
+
+    async def main():
+        host.ready = asyncio.Event()
+        await asyncio.gather(run_async(waiter, host, backend), run_async(waker, host, backend))
+
+    asyncio.run(main())
+    # waiter 停在 wait() 上，waker 先跑完，之后 waiter 从调用处继续
+    assert host.log == ["a1", "b1", "b2", "woke", "a2"]
+
+
+SRC = """
+var f = fun(n) {
+    if (n == 0) { return slow(1); } else { return f(n - 1) + slow(n); }
+};
+print(f(5), slow(slow(2)));
+"""
+
+
+def test_async_results_match_in_both_backends(host):
+    ast, code, consts, values = compile_program(SRC, host)
+
+    vm_out = CaptureSink()
+    asyncio.run(cilly_vm_async(code, consts, [values], out=vm_out))
+
+    eval_out = io.StringIO()
+    with contextlib.redirect_stdout(eval_out):
+        asyncio.run(cilly_eval_async(ast, host.env()))
+
+    assert vm_out.getvalue() == eval_out.getvalue() == "160 200 \n"
+
+
+@pytest.mark.parametrize("backend", ["vm", "eval"])
+def test_sync_programs_match_sync_interpreters(host, backend):
+    src = "var i = 0; var s = 0; while (i < 10) { i = i + 1; s = s + i; } print(s, i);"
+    ast, code, consts, values = compile_program(src, host)
+
+    sync_out = CaptureSink()
+    if backend == "vm":
+        cilly_vm(code, consts, [values], out=sync_out)
+        async_out = CaptureSink()
+        asyncio.run(cilly_vm_async(code, consts, [values], out=async_out))
+        assert async_out.getvalue() == sync_out.getvalue()
+    else:
+        cilly_eval(ast, host.env(), out=sync_out)
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            asyncio.run(cilly_eval_async(ast, host.env()))
+        assert buf.getvalue() == sync_out.getvalue()
+
+
+@pytest.mark.parametrize("backend", ["vm", "eval"])
+def test_sync_interpreters_reject_async_calls(host, backend):
+    ast, code, consts, values = compile_program("print(slow(1));", host)
+    with pytest.raises(Exception, match=f"需要用 cilly_{backend}_async 执行"):
+        if backend == "vm":
+            cilly_vm(code, consts, [values], out=CaptureSink())
+        else:
+            cilly_eval_stackless(ast, host.env())
+
+
+@pytest.mark.parametrize("backend", ["vm", "eval"])
+def test_errors_in_async_calls_propagate(host, backend):
+    with pytest.raises(ValueError, match="bad io"):
+        asyncio.run(run_async("print(boom());", host, backend))
+
+
+@pytest.mark.parametrize("backend", ["vm", "eval"])
+def test_busy_program_yields_to_others(host, backend):
+    busy = 'var i = 0; while (i < 100000) { i = i + 1; } log("busy");'
+    waiter = 'var k = 0; while (k < 3) { slow(k); k = k + 1; } log("io");'
+
+    async def main():
+        await asyncio.gather(run_async(busy, host, backend), run_async(waiter, host, backend))
+
+    asyncio.run(main())
+    assert host.log == ["io", "busy"]
@@ -0,0 +1,70 @@
+import multiprocessing
+import time
+
+import pytest
+
+import cilly_batch
+from cilly_batch import run_batch
+
+PROGRAMS = {
+    "ok.cl": "var x = 40; print(x + 2); x + 2;",
+    "error.cl": "print(1); print(y);",
+    "loop.cl": "while (true) { }",
+    "syntax.cl": "print(;",
+}
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    paths = {}
+    for name, src in PROGRAMS.items():
+        path = tmp_path / name
+        path.write_text(src, encoding="utf-8")
+        paths[name] = str(path)
+    return paths
+
+
+def test_results_timeout_and_errors(scripts):
+    paths = [scripts["ok.cl"], scripts["error.cl"], scripts["loop.cl"]]
+    results, stats = run_batch(paths, workers=2, timeout=0.5, chunksize=1)
+
+    ok, error, loop = results
+    assert [r["path"] for r in results] == paths
+    assert ok["ok"] and ok["stdout"] == "42 \n" and ok["result"] == "42"
+    assert not error["ok"] and error["stdout"] == "1 \n" and "未定义变量y" in error["error"]
+    assert not loop["ok"] and loop["error"] == "超时: 0.5 秒"
+    assert stats["scripts"] == 3 and stats["failed"] == 2
+
+
+def test_parse_errors_and_missing_files(scripts, tmp_path):
+    missing = str(tmp_path / "missing.cl")
+    results, stats = run_batch([scripts["syntax.cl"], missing, scripts["ok.cl"]], workers=1)
+
+    syntax, gone, ok = results
+    assert not syntax["ok"] and "非法token: ; (第1行第7列)" in syntax["error"]
+    assert not gone["ok"] and "No such file" in gone["error"]
+    assert ok["ok"]
+    assert stats["scripts"] == 3 and stats["failed"] == 2
+
+
+def test_vm_backend_has_no_result(scripts):
+    results, _ = run_batch([scripts["ok.cl"]], workers=1, backend="vm")
+    assert results[0]["ok"] and results[0]["stdout"] == "42 \n" and results[0]["result"] is None
+
+
+class SlowError(Exception):
+    def __str__(self):
+        time.sleep(0.5)
+        return "slow"
+
+
+def slow_failure(path, src, out):
+    raise SlowError()
+
+
+# 定时器在处理程序的错误时到期，也只影响这一个程序
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="worker 要继承替换过的 run_source")
+def test_timer_firing_in_error_handler(scripts, monkeypatch):
+    monkeypatch.setattr(cilly_batch, "run_source", slow_failure)
+    results, stats = run_batch([scripts["ok.cl"], scripts["error.cl"]], workers=1, timeout=0.2)
+    assert [r["error"] for r in results] == ["slow", "slow"]
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import cilly_cache
+from cilly_cache import cache_header, cache_path, cilly_load_file, source_digest
+from cilly_interpreter import cilly_lexer, cilly_parser
+
+SRC = "var x = 1 + 2; print(x);"
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    # 记下真正调用解析器的次数
+    calls = []
+    parser = cilly_cache.cilly_parser
+
+    def counting_parser(tokens):
+        calls.append(tokens)
+        return parser(tokens)
+
+    monkeypatch.setattr(cilly_cache, "cilly_parser", counting_parser)
+    return calls
+
+
+def write(path, src):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(src)
+
+
+def test_second_load_hits_the_cache(tmp_path, parses):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+
+    first = cilly_load_file(str(prog), optimize=None)
+    assert os.path.exists(cache_path(str(prog), optimize=None))
+    second = cilly_load_file(str(prog), optimize=None)
+
+    assert first == second == cilly_parser(cilly_lexer(SRC))
+    assert len(parses) == 1
+
+
+def test_changed_source_invalidates_the_cache(tmp_path, parses):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+    cilly_load_file(str(prog), optimize=None)
+
+    write(prog, "print(2);")
+    assert cilly_load_file(str(prog), optimize=None) == cilly_parser(cilly_lexer("print(2);"))
+    assert len(parses) == 2
+
+
+@pytest.mark.parametrize("damage", ["garbage", "truncated", "bad_magic"])
+def test_damaged_cache_is_reparsed_and_rewritten(tmp_path, parses, damage):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+    cilly_load_file(str(prog), optimize=None)
+    path = cache_path(str(prog), optimize=None)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    header = cache_header(source_digest(SRC))
+    if damage == "garbage":
+        data = b"not a cache file"
+    elif damage == "truncated":
+        data = data[: len(header) + 3]
+    else:
+        data = b"X" + data[1:]
+    with open(path, "wb") as f:
+        f.write(data)
+
+    assert cilly_load_file(str(prog), optimize=None) == cilly_parser(cilly_lexer(SRC))
+    assert len(parses) == 2
+
+    # 重新写入的缓存可以直接命中
+    cilly_load_file(str(prog), optimize=None)
+    assert len(parses) == 2
+
+
+def test_each_optimize_mode_has_its_own_cache_file(tmp_path):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+
+    plain = cilly_load_file(str(prog), optimize=None)
+    folded = cilly_load_file(str(prog), optimize="eval")
+
+    assert plain != folded
+    assert cache_path(str(prog), optimize=None) != cache_path(str(prog), optimize="eval")
+    assert cilly_load_file(str(prog), optimize=None) == plain
+    assert cilly_load_file(str(prog), optimize="eval") == folded
+
+
+def test_unwritable_cache_dir_still_parses(tmp_path, parses):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+    blocker = tmp_path / "blocker"
+    write(blocker, "")
+
+    # cache_dir 是个文件，无法创建缓存目录
+    cache_dir = str(blocker / "cache")
+    assert cilly_load_file(str(prog), cache_dir=cache_dir, optimize=None) == cilly_parser(cilly_lexer(SRC))
+    assert len(parses) == 1
+
+
+def test_parser_version_change_invalidates_the_cache(tmp_path, parses, monkeypatch):
+    prog = tmp_path / "a.cilly"
+    write(prog, SRC)
+    cilly_load_file(str(prog), optimize=None)
+
+    monkeypatch.setattr(cilly_cache, "PARSER_VERSION", cilly_cache.PARSER_VERSION + 1)
+    cilly_load_file(str(prog), optimize=None)
+    assert len(parses) == 2
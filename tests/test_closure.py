@@ -0,0 +1,38 @@
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_closure_compiler import cilly_eval_closure
+
+PROGRAMS = [
+    "var i = 0; var s = 0; while (i < 10) { i = i + 1; if (i == 3) continue; if (i > 7) break; s = s + i; } print(s, i);",
+    "var i = 0; for (i = 0; i < 3; i = i + 1) { print(i, i < 2 ? \"a\" : \"b\"); }",
+    "var c = 0; var inc = fun() { c = c + 1; return c; }; print(inc(), inc(), c);",
+    "var mk = fun(n) { var c = n; return fun() { c = c + 1; return c; }; }; var a = mk(0); var b = mk(10); print(a(), a(), b(), a());",
+    "fun fib(n) { if (n < 2) return n; else return fib(n - 1) + fib(n - 2); } print(fib(12));",
+    "fun g() { if (true) { return 1; } return 2; } print(g());",
+    "fun h() { return 1; print(\"after\"); } print(h());",
+    "var a = [1, [2, 3]]; a[1][0] = {x: 5}; a[1][0].x = a[1][0].x * 2; print(a, a[1][0] == {x: 10});",
+    "var s = {x: 1, y: \"s\"}; var t = s; t.x = 2; print(s.x, s == t, !s.y, -s.x, 2 ^ 3 ^ 2);",
+    "print(1 == true, 0 && 5, 1 || 7, null == null, 7 / 2, \"a\" + \"b\");",
+    "var a = [1]; print(a[1.5]);",
+    "var s = {x: 1}; s.q = 1;",
+    "print(undefined_name);",
+]
+
+
+def run(evaluate, src):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            print("RESULT", evaluate(cilly_parser(cilly_lexer(src)), {}))
+        except Exception as e:
+            print("ERR", e)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_closure_backend_matches_cilly_eval(src):
+    assert run(cilly_eval_closure, src) == run(cilly_eval, src)
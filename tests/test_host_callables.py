@@ -0,0 +1,75 @@
+from collections.abc import MutableMapping, MutableSequence
+
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_closure_compiler import cilly_closure_compile
+from cilly_unboxed import cilly_eval_unboxed
+from cilly_resolver import cilly_resolve, cilly_eval_resolved
+from cilly_stackless import cilly_eval_stackless
+from cilly_transpiler import cilly_run_python
+
+SRC = """
+var s = {x: 1, name: "a"};
+var a = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16];
+got(s, a);
+"""
+
+BACKENDS = {
+    "eval": lambda src, env: cilly_eval(cilly_parser(cilly_lexer(src)), env),
+    "closure": lambda src, env: cilly_closure_compile(cilly_parser(cilly_lexer(src)))(env),
+    "unboxed": lambda src, env: cilly_eval_unboxed(cilly_parser(cilly_lexer(src)), env),
+    "resolved": lambda src, env: cilly_eval_resolved(cilly_resolve(cilly_parser(cilly_lexer(src))), env),
+    "stackless": lambda src, env: cilly_eval_stackless(cilly_parser(cilly_lexer(src)), env),
+    "python": lambda src, env: cilly_run_python(src, env),
+}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_legacy_callable_gets_dict_and_list(backend):
+    seen = []
+    BACKENDS[backend](SRC, {"got": lambda s, a: seen.append((s, a))})
+
+    [(s, a)] = seen
+    assert isinstance(s, MutableMapping) and dict(s) == {"x": ["num", 1], "name": ["str", "a"]}
+    assert isinstance(a, MutableSequence) and list(a) == [["num", i] for i in range(1, 17)]
+
+
+MUTATE = """
+var s = {x: 1, inner: [1, 2], sub: {k: 1}};
+var a = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16];
+var b = [1, 2];
+poke(s, a, b);
+print(s.x, s.y, s.inner[0], s.sub.k, a[0], a[1], a[16], b[0], b[2]);
+"""
+
+
+def poke(s, a, b):
+    s["x"] = ["num", 10]
+    s["y"] = ["str", "new"]
+    s["inner"][1][0] = ["num", 7]
+    s["sub"][1]["k"] = ["num", 9]
+    a[0] = ["num", 100]
+    a[1] = ["str", "two"]
+    a.append(["num", 17])
+    b[0] = ["num", 5]
+    b.append(["true", True])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_legacy_callable_mutations_reach_the_program(backend):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        BACKENDS[backend](MUTATE, {"poke": poke})
+    assert out.getvalue() == "10 new 7 9 100 two 17 5 True \n"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_empty_struct_is_falsy(backend):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        BACKENDS[backend]("print({} ? 1 : 2, {a: 1} ? 1 : 2, [0] ? 1 : 2);", {})
+    assert out.getvalue() == "2 1 1 \n"
@@ -0,0 +1,141 @@
+import math
+from array import array
+
+import pytest
+
+from cilly_builtins import HostRegistry
+from cilly_interpreter import NumArray, cilly_lexer, cilly_parser, cilly_eval
+from cilly_output import CaptureSink
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+
+def run(src, host, backend):
+    ast = cilly_parser(cilly_lexer(src))
+    out = CaptureSink()
+    if backend == "eval":
+        cilly_eval(ast, host.env(), out=out)
+    else:
+        names, values = host.vm_scope()
+        code, consts, _ = cilly_vm_compiler(ast, [], [], [names])
+        cilly_vm(code, consts, [values], out=out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def host():
+    host = HostRegistry()
+    host.register("hypot", math.hypot, 2)
+    host.register("upper", lambda s: s.upper())
+    host.register("inc", lambda v: ["num", v[1] + 1], mode="boxed")
+    host.register("nothing", lambda: None)
+    host.register("three", lambda a, b, c: a + b + c)
+    host.register("same", lambda f: f)
+    host.register("opt", lambda a, b=2: a * b)
+
+    @host.function(arity=1)
+    def double(x):
+        return x * 2
+
+    return host
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_calls_return_values(host, backend):
+    src = 'print(hypot(3, 4), upper("ab"), inc(inc(1)), nothing(), three(1, 2, 3), double(4), opt(5));'
+    assert run(src, host, backend) == "5.0 AB 3 None 6 8 10 \n"
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_functions_pass_through_unchanged(host, backend):
+    src = "var f = fun(x) { return x + 1; }; print(same(f)(1), same(inc)(1), same(same) == same);"
+    assert run(src, host, backend) == "2 2 True \n"
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+@pytest.mark.parametrize(
+    "src, msg",
+    [
+        ("hypot(1);", "hypot : 参数数量不匹配: 期望 2 个，实际 1 个"),
+        ("three(1, 2, 3, 4);", "three : 参数数量不匹配: 期望 3 个，实际 4 个"),
+        ("nothing(1);", "nothing : 参数数量不匹配: 期望 0 个，实际 1 个"),
+    ],
+)
+def test_wrong_argument_count(host, backend, src, msg):
+    with pytest.raises(Exception, match=msg):
+        run(src, host, backend)
+
+
+def test_raw_and_batch_convert_arrays_and_structs():
+    seen = []
+    host = HostRegistry()
+    host.register("raw", lambda a, s: seen.append((a, s)) or {"n": len(a), "first": a[0]})
+    host.register("batch", lambda a: seen.append(a) or array("d", [x * 2 for x in a]), mode="batch")
+    host.register("boxed", lambda a: seen.append(a) or a, mode="boxed")
+
+    big = "[" + ", ".join(f"{i}.5" for i in range(16)) + "]"
+    src = f"var r = raw([1, 2], {{x: [true]}}); var b = batch({big}); var c = boxed([1]); print(r.n, r.first, b[15], c);"
+    assert run(src, host, "eval") == "2 1 31.0 [['num', 1]] \n"
+
+    raw_args, batch_arg, boxed_arg = seen
+    assert raw_args == ([1, 2], {"x": [True]})
+    assert type(batch_arg) is array and batch_arg.typecode == "d"
+    assert boxed_arg == ["array", [["num", 1]]]
+
+
+def test_batch_returns_num_array():
+    host = HostRegistry()
+    host.register("mk", lambda: array("q", [1, 2, 3]), mode="batch")
+    env = host.env()
+    cilly_eval(cilly_parser(cilly_lexer("var a = mk(); a[0] = 7;")), env)
+    assert type(env["a"][1]) is NumArray and list(env["a"][1].data) == [7, 2, 3]
+
+
+# 读不到签名的可调用对象，和部分 C 函数一样
+class NoSignature:
+    def __call__(self, x):
+        return x
+
+    @property
+    def __signature__(self):
+        raise ValueError("no signature")
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_declared_arity_without_signature(backend):
+    host = HostRegistry()
+    host.register("ident", NoSignature(), 1)
+    assert run("print(ident(3));", host, backend) == "3 \n"
+
+
+@pytest.mark.parametrize(
+    "register, msg",
+    [
+        (lambda h: h.register("f", lambda *a: 0), "参数个数不固定"),
+        (lambda h: h.register("f", lambda a: 0, 2), "声明了 2 个参数"),
+        (lambda h: h.register("f", lambda a: 0, -1), "参数个数必须是非负整数"),
+        (lambda h: h.register("f", lambda a: 0, mode="fast"), "未知的调用方式 fast"),
+        (lambda h: h.register("1f", lambda: 0), "非法函数名"),
+        (lambda h: h.register("f", 3), "不是可调用对象"),
+        (lambda h: h.register("f", NoSignature()), "无法读取函数签名"),
+        (lambda h: (h.register("f", lambda: 0), h.register("f", lambda: 0)), "重复登记"),
+    ],
+)
+def test_bad_registrations(register, msg):
+    host = HostRegistry()
+    with pytest.raises(Exception, match=msg):
+        register(host)
+
+
+def test_unsupported_return_value():
+    host = HostRegistry()
+    host.register("obj", lambda: object())
+    with pytest.raises(Exception, match="不支持的返回值类型: object"):
+        run("obj();", host, "eval")
+
+
+def test_registry_contents(host):
+    assert "hypot" in host and "nope" not in host
+    assert len(host) == 8
+    names, values = host.vm_scope()
+    assert names == list(host.env())
+    assert values == list(host.env().values())
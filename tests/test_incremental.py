@@ -0,0 +1,64 @@
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, make_incremental_parser
+
+
+def feed_lines(lines):
+    feed, _, has_pending = make_incremental_parser()
+    results = []
+    for line in lines:
+        results.append((feed(line + "\n"), has_pending()))
+    return results
+
+
+def test_complete_statement_on_one_line():
+    assert feed_lines(["print(1 + 2);"]) == [(["complete", cilly_parser(cilly_lexer("print(1 + 2);"))], False)]
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        ["var f = fun(x) {", "  return x;", "};"],
+        ["print(1)", ";"],
+        ["var a = [1,", "2,", "3];"],
+        ['print("a', 'b");'],
+        ["if (true)", "print(1);"],
+    ],
+)
+def test_incomplete_until_the_last_line(lines):
+    results = feed_lines(lines)
+
+    assert results[:-1] == [(["incomplete"], True)] * (len(lines) - 1)
+    assert results[-1] == (["complete", cilly_parser(cilly_lexer("\n".join(lines) + "\n"))], False)
+
+
+@pytest.mark.parametrize(
+    "line, msg",
+    [("var = 1;", "期望id"), ("x = @;", "非法字符@"), (")", "非法token: )"), ("print(1));", "期望;")],
+)
+def test_error_clears_pending_input(line, msg):
+    feed, _, has_pending = make_incremental_parser()
+    assert feed("var a = 1;\n")[0] == "complete"
+
+    r = feed(line + "\n")
+    assert r[0] == "error" and msg in r[1]
+    assert not has_pending()
+
+    # 出错后可以继续输入
+    assert feed("print(a);\n") == ["complete", cilly_parser(cilly_lexer("print(a);"))]
+
+
+def test_reset_drops_pending_input():
+    feed, reset, has_pending = make_incremental_parser()
+    assert feed("print(\n") == ["incomplete"]
+    reset()
+    assert not has_pending()
+    assert feed("print(2);\n")[0] == "complete"
+
+
+def test_slots_mode():
+    feed, _, _ = make_incremental_parser("slots")
+    feed("var x = {\n")
+    r = feed("a: 1};\n")
+    assert r[0] == "complete"
+    assert r[1] == cilly_parser(cilly_lexer("var x = {a: 1};"), "slots")
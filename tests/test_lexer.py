@@ -0,0 +1,51 @@
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_lexer_compact
+
+SOURCES = [
+    "var x = 12; var y = 3.25; var z = 7.;",
+    'print("hello world", "", x_1, _y);',
+    "if (a >= 1 && b <= 2 || !c) { a = a != b; } else { b = a == b; }",
+    "var f = fun(a, b) { return a ^ b - -a * b / 2; };",
+    "var s = {x: [1, 2], y: null}; s.x[0] = true ? false : null;",
+    "for (i = 0; i < 10; i = i + 1) { while (false) { break; continue; } }",
+    "a&b|c<d>e=f!g",
+    "varx iff fun_ null1 \t\r\n  ",
+    "",
+]
+
+
+@pytest.mark.parametrize("src", SOURCES)
+def test_regex_lexer_matches_char_lexer(src):
+    assert cilly_lexer(src, "regex") == cilly_lexer(src, "char")
+
+
+@pytest.mark.parametrize("src", ["var x = @;", 'print("abc);', "x = 1 # 2;"])
+def test_regex_lexer_reports_the_same_errors(src):
+    with pytest.raises(Exception) as char_err:
+        cilly_lexer(src, "char")
+    with pytest.raises(Exception) as regex_err:
+        cilly_lexer(src, "regex")
+    assert str(regex_err.value) == str(char_err.value)
+
+
+@pytest.mark.parametrize("src", SOURCES)
+def test_compact_tokens_match_list_tokens(src):
+    buf = cilly_lexer_compact(src)
+    assert len(buf) == len(cilly_lexer(src))
+    assert list(buf) == cilly_lexer(src)
+
+
+def test_compact_tokens_keep_source_positions():
+    buf = cilly_lexer_compact("var x = 1;\n  print(x);")
+    assert [buf.token_line_col(i) for i in range(len(buf))] == [
+        (1, 1), (1, 5), (1, 7), (1, 9), (1, 10),
+        (2, 3), (2, 8), (2, 9), (2, 10), (2, 11),
+    ]
+    # 越过最后一个 token 时是源码末尾
+    assert buf.token_line_col(len(buf)) == (2, 12)
+
+
+def test_compact_lexer_reports_error_position():
+    with pytest.raises(Exception, match="非法字符@ \\(第2行第5列\\)"):
+        cilly_lexer_compact("x = 1;\nx = @;")
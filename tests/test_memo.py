@@ -0,0 +1,83 @@
+import contextlib
+import io
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+from cilly_memo import MemoCache
+
+LOOP = """
+var loop = fun(n, acc) {
+    if (n == 0) { return acc; } else { return loop(n - 1, acc + n); }
+};
+print(loop(3000, 0));
+print(loop(3000, 0));
+"""
+
+
+def run_eval(src, memo):
+    ast = cilly_parser(cilly_lexer(src))
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cilly_eval(ast, {}, memo=MemoCache(ast) if memo else None)
+    return out.getvalue()
+
+
+def test_tail_calls_survive_memo():
+    assert run_eval(LOOP, memo=True) == run_eval(LOOP, memo=False) == "4501500 \n4501500 \n"
+
+
+def test_tail_call_results_are_cached():
+    ast = cilly_parser(cilly_lexer(LOOP))
+    memo = MemoCache(ast, maxsize=4096)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cilly_eval(ast, {}, memo=memo)
+    # 第二次调用直接命中
+    assert memo.stats()["hits"] == 1
+
+
+def test_vm_procs_are_per_compilation():
+    ast = cilly_parser(cilly_lexer("var f = fun(n) { return n + 1; }; print(f(1), f(1));"))
+    procs = {}
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [], procs=procs)
+    cilly_vm_compiler(cilly_parser(cilly_lexer("var g = fun() { return 1; }; g();")), [], [], [], procs={})
+    assert list(procs.values()) == [ast[1][0][2]]
+
+    memo = MemoCache(ast)
+    out = io.StringIO()
+    cilly_vm(code, consts, scopes, memo=memo, procs=procs, out=out)
+    assert out.getvalue() == "2 2 \n"
+    assert memo.stats()["hits"] == 1
+
+
+# if 里的 var x 没有执行时，读到的是全局的 x，f 不是纯函数
+SHADOWED_GLOBAL = """
+var x = 5;
+var f = fun(a) { if (a) { var x = 1; } return x; };
+print(f(false));
+x = 6;
+print(f(false));
+"""
+
+
+def test_conditional_define_does_not_hide_global():
+    ast = cilly_parser(cilly_lexer(SHADOWED_GLOBAL))
+    assert MemoCache(ast).stats()["pure_functions"] == 0
+    assert run_eval(SHADOWED_GLOBAL, memo=True) == run_eval(SHADOWED_GLOBAL, memo=False) == "5 \n6 \n"
+
+    procs = {}
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [], procs=procs)
+    out = io.StringIO()
+    cilly_vm(code, consts, scopes, memo=MemoCache(ast), procs=procs, out=out)
+    assert out.getvalue() == "5 \n6 \n"
+
+
+def test_block_local_names_and_fun_defs_stay_pure():
+    ast = cilly_parser(cilly_lexer("""
+fun fib(n) { if (n < 2) { return n; } else { return fib(n - 1) + fib(n - 2); } }
+var sum = fun(n) { var t = 0; while (n > 0) { var d = n; t = t + d; n = n - 1; } return t; };
+var g = fun(a) { var y = x; var x = 1; return y; };
+var x = 2;
+"""))
+    fib, sum_, g = ast[1][0], ast[1][1][2], ast[1][2][2]
+    pure = MemoCache(ast).pure_funs
+    assert id(fib) in pure and id(sum_) in pure and id(g) not in pure
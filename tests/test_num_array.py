@@ -0,0 +1,111 @@
+import contextlib
+import io
+from array import array
+
+import pytest
+
+import cilly_interpreter
+from cilly_builtins import array_builtins
+from cilly_interpreter import NumArray, cilly_lexer, cilly_parser, cilly_eval
+from cilly_closure_compiler import cilly_eval_closure
+from cilly_unboxed import cilly_eval_unboxed
+from cilly_transpiler import cilly_eval_python
+
+INTS = "[" + ", ".join(str(i) for i in range(20)) + "]"
+FLOATS = "[" + ", ".join(f"{i}.5" for i in range(20)) + "]"
+
+# 数值数组和普通数组的结果应该完全一样
+PROGRAMS = [
+    f"var a = {INTS}; print(a, a[3], a == {INTS});",
+    f'var a = {INTS}; a[0] = "s"; a[1] = 2.5; a[2] = [1]; print(a[0], a[1], a[2], a[3], a);',
+    f"var a = {FLOATS}; a[0] = 1; a[1] = null; print(a[0], a[1], a[19]);",
+    f"var a = {INTS}; var i = 0; var s = 0; while (i < 20) {{ a[i] = a[i] * 2; s = s + a[i]; i = i + 1; }} print(s, a);",
+    f"var a = {INTS}; a[0] = 9223372036854775807 * 2; print(a[0], a[1]);",
+    f"var a = {INTS}; print(a[20]);",
+    f"var a = [{INTS}, {FLOATS}]; a[1][0] = true; print(a[0][19], a[1][0], a[1][1]);",
+]
+
+
+def run(evaluate, src, env=None):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            evaluate(cilly_parser(cilly_lexer(src)), env if env is not None else array_builtins())
+        except Exception as e:
+            print("ERR", e)
+    return out.getvalue()
+
+
+@pytest.fixture
+def plain_arrays(monkeypatch):
+    # 所有数组字面量都用普通列表
+    def run_plain(src):
+        with monkeypatch.context() as m:
+            m.setattr(cilly_interpreter, "NUM_ARRAY_MIN_LEN", 10**9)
+            return run(cilly_eval, src)
+
+    return run_plain
+
+
+def test_long_number_literals_are_packed():
+    env = {}
+    cilly_eval(cilly_parser(cilly_lexer(f"var a = {INTS}; var b = {FLOATS}; var c = [1, 2];")), env)
+    assert type(env["a"][1]) is NumArray and env["a"][1].data.typecode == "q"
+    assert type(env["b"][1]) is NumArray and env["b"][1].data.typecode == "d"
+    assert type(env["c"][1]) is list
+
+
+def test_mutation_falls_back_to_a_plain_list():
+    env = {}
+    cilly_eval(cilly_parser(cilly_lexer(f'var a = {INTS}; a[1] = 5; var b = {INTS}; b[1] = "x";')), env)
+    assert type(env["a"][1]) is NumArray
+    assert type(env["b"][1]) is list
+    assert env["b"][1][:3] == [["num", 0], ["str", "x"], ["num", 2]]
+
+
+@pytest.mark.parametrize("evaluate", [cilly_eval, cilly_eval_closure, cilly_eval_unboxed, cilly_eval_python])
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_num_arrays_behave_like_plain_arrays(src, evaluate, plain_arrays):
+    assert run(evaluate, src) == plain_arrays(src)
+
+
+BUILTINS = [
+    (f"var a = {INTS}; print(sum(a), min(a), max(a), dot(a, a));", "190 0 19 2470 \n"),
+    ("print(sum([1.5, 2]), min([3, -1, 2]), max([1, 2.5]), dot([1, 2], [3, 4]));", "3.5 -1 2.5 11 \n"),
+    ("var a = num_array(3, 2); print(add(a, [1, 2, 3]), scale(a, 0.5));",
+     "[['num', 3], ['num', 4], ['num', 5]] [['num', 1.0], ['num', 1.0], ['num', 1.0]] \n"),
+    ("print(num_array(2, 1.5) == [1.5, 1.5], scale([1, 2], 3) == [3, 6]);", "True True \n"),
+    ("var e = num_array(0, 1); print(sum(e), e, add(e, e), scale(e, 3), dot(e, e));", "0 [] [] [] 0 \n"),
+    ("print(min(num_array(0, 1)));", "ERR min : 数组不能为空\n"),
+    ("print(max(num_array(0, 1.5)));", "ERR max : 数组不能为空\n"),
+    ("print(add(num_array(2, 1), num_array(3, 1)));", "ERR add : 数组长度不一致: 2 和 3\n"),
+    ('print(sum([1, "a"]));', "ERR sum : 数组元素必须是数字: ['str', 'a']\n"),
+    ("print(num_array(-1, 0));", "ERR num_array : 数组长度必须是非负整数: -1\n"),
+    # 超出 64 位时得到普通数组
+    ("print(scale(num_array(2, 9223372036854775807), 2));",
+     "[['num', 18446744073709551614], ['num', 18446744073709551614]] \n"),
+]
+
+
+@pytest.mark.parametrize("src, expected", BUILTINS)
+def test_array_builtins(src, expected):
+    assert run(cilly_eval, src) == expected
+
+
+def test_builtins_match_a_cilly_loop():
+    src = f"""
+    var a = {FLOATS};
+    var b = scale(a, 2);
+    var i = 0; var s = 0; var d = 0;
+    while (i < 20) {{ s = s + a[i] + b[i]; d = d + a[i] * b[i]; i = i + 1; }}
+    print(s == sum(add(a, b)), d == dot(a, b));
+    """
+    assert run(cilly_eval, src) == "True True \n"
+
+
+def test_num_array_equality():
+    a = NumArray(array("q", [1, 2]))
+    assert a == NumArray(array("q", [1, 2]))
+    assert a == [["num", 1], ["num", 2]]
+    assert a == [1, 2]
+    assert a != [["num", 1]]
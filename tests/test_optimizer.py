@@ -0,0 +1,93 @@
+import io
+import os
+
+from cilly_interpreter import cilly_lexer, cilly_parser
+from cilly_optimizer import cilly_optimize
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+
+def run_vm(src, optimize):
+    ast = cilly_parser(cilly_lexer(src))
+    if optimize:
+        ast = cilly_optimize(ast, "vm")
+    code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
+    out = io.StringIO()
+    cilly_vm(code, consts, scopes, out=out)
+    return out.getvalue()
+
+
+def test_keeps_declarations_after_return():
+    src = """
+    var f = fun() {
+        var g = fun() { return x; };
+        return g();
+        var x = 1;
+    };
+    print(f());
+    """
+    assert run_vm(src, True) == run_vm(src, False)
+
+
+def test_drops_initializers_after_return():
+    ast = cilly_optimize(cilly_parser(cilly_lexer("var f = fun() { return 1; var x = g(); };")), "vm")
+    body = ast[1][0][2][2]
+    assert body == ["block", [["return", ["num", 1]], ["define", "x", ["null", None]]]]
+
+
+def test_if_expr_folds_only_bool_literals():
+    ast = cilly_optimize(cilly_parser(cilly_lexer("var a = true ? 1 : 2; var b = 0 ? 1 : 2;")))
+    assert ast[1][0][2] == ["num", 1]
+    assert ast[1][1][2][0] == "if_expr"
+
+
+PIPELINE = """
+var s = 0;
+var i = 0;
+while (i < 10) {
+    s = s + 60 * 60 - 2 ^ 3;
+    if (false) { print("debug", i); }
+    i = i + 1;
+}
+print(s);
+"""
+
+
+def test_load_file_optimizes_by_default(tmp_path):
+    from cilly_cache import cilly_load_file
+    from cilly_interpreter import cilly_eval
+
+    path = tmp_path / "prog.cl"
+    path.write_text(PIPELINE, encoding="utf-8")
+
+    outputs = []
+    for optimize in ["eval", None]:
+        ast = cilly_load_file(str(path), optimize=optimize)
+        out = io.StringIO()
+        cilly_eval(ast, {}, out=out)
+        outputs.append(out.getvalue())
+    assert outputs[0] == outputs[1] == "35920 \n"
+
+    # 折叠后的常量，没有 if(false)
+    loop_body = cilly_load_file(str(path))[1][2][2][1]
+    assert loop_body[0] == ["assign", ["id", "s"], ["binary", "-", ["binary", "+", ["id", "s"], ["num", 3600]], ["num", 8]]]
+    assert len(loop_body) == 2
+
+    # 每种优化方式各自一个缓存文件
+    names = sorted(os.listdir(tmp_path / "__cillycache__"))
+    assert names == ["prog.cl.cillyc", "prog.cl.opt-eval.cillyc"]
+
+
+def test_batch_runner_no_opt(tmp_path):
+    import cilly_batch
+
+    path = tmp_path / "prog.cl"
+    path.write_text(PIPELINE, encoding="utf-8")
+    for backend in ["eval", "vm"]:
+        for optimize in [True, False]:
+            results, _ = cilly_batch.run_batch([str(path)], workers=1, backend=backend, optimize=optimize)
+            assert results[0]["stdout"] == "35920 \n"
+    assert sorted(os.listdir(tmp_path / "__cillycache__")) == [
+        "prog.cl.cillyc",
+        "prog.cl.opt-eval.cillyc",
+        "prog.cl.opt-vm.cillyc",
+    ]
@@ -0,0 +1,96 @@
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_output import BufferedSink, CaptureSink
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+PROGRAMS = [
+    'print(1, 2.5, "s", true, false, null); print(); print("");',
+    "var i = 0; while (i < 3) { print(i, i * i); i = i + 1; }",
+    "var f = fun(x) { print(\"in f\", x); return x + 1; }; print(f(1), f);",
+    'print("a" + "b", 7 / 2, -2 ^ 2, 1 == 1 && 2 > 1);',
+]
+
+ARRAYS = 'var a = [1, [2], {x: 3}]; print(a, a[2]); print({y: "s"});'
+
+
+def run(src, backend, out=None):
+    ast = cilly_parser(cilly_lexer(src))
+    if backend == "eval":
+        cilly_eval(ast, {}, out=out)
+    else:
+        code, consts, scopes = cilly_vm_compiler(ast, [], [], [])
+        cilly_vm(code, consts, scopes, out=out)
+
+
+def printed(src, backend):
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        run(src, backend)
+    return buf.getvalue()
+
+
+def captured(src, backend):
+    sink = CaptureSink()
+    run(src, backend, sink)
+    return sink.getvalue()
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_capture_sink_matches_print(src, backend):
+    assert captured(src, backend) == printed(src, backend)
+
+
+def test_capture_sink_matches_print_for_arrays_and_structs():
+    assert captured(ARRAYS, "eval") == printed(ARRAYS, "eval")
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_sink_is_flushed_on_error(backend):
+    out = io.StringIO()
+    sink = BufferedSink(out, buffer_size=1 << 20, flush_interval=1e9)
+    with pytest.raises(Exception):
+        run('print("before"); print(1 / 0);', backend, sink)
+    assert out.getvalue() == "before \n"
+
+
+def test_capture_sink_lines():
+    sink = CaptureSink()
+    run('print(1, "a"); print(); print("b");', "eval", sink)
+    assert sink.lines() == ["1 a", "", "b"]
+    sink.clear()
+    assert sink.getvalue() == ""
+
+
+def test_buffered_sink_holds_output_until_full():
+    out = io.StringIO()
+    sink = BufferedSink(out, buffer_size=10, flush_interval=1e9)
+
+    sink.write("12345")
+    assert out.getvalue() == ""
+    sink.write("67890")
+    assert out.getvalue() == "1234567890"
+
+    sink.write("x")
+    with sink:
+        pass
+    assert out.getvalue() == "1234567890x"
+
+
+def test_buffered_sink_flushes_after_interval():
+    out = io.StringIO()
+    sink = BufferedSink(out, buffer_size=1 << 20, flush_interval=0)
+    sink.write("a")
+    assert out.getvalue() == "a"
+
+
+def test_buffered_sink_follows_redirected_stdout():
+    sink = BufferedSink()
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        run("print(1); print(2);", "vm", sink)
+    assert buf.getvalue() == "1 \n2 \n"
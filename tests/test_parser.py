@@ -0,0 +1,126 @@
+import pytest
+
+from cilly_interpreter import (
+    CillyIncompleteError,
+    TokenBuffer,
+    cilly_lexer,
+    cilly_lexer_compact,
+    cilly_lexer_iter,
+    cilly_parser,
+)
+
+PROGRAMS = [
+    "var x = 1; x = x + 2 * 3; print(x);",
+    "var f = fun(a, b) { if (a > b) { return a; } else { return b; } }; print(f(1, 2));",
+    "fun g(n) { while (n > 0) { n = n - 1; if (n == 3) break; } return n; } g(10);",
+    "var s = {x: [1, , 3], y: {z: null}}; s.x[1] = s.y.z; s.y.z = -s.x[0] ^ 2;",
+    'for (i = 0; i < 3; i = i + 1) { print(i < 2 ? "a" : "b"); }',
+    "f(1)(2); a[0][1] = !b; {} x;",
+]
+
+BAD = ["var = 1;", "print(1;", "x + ;", "{ var a = 1; } }"]
+
+INCOMPLETE = ["var x = 1", "fun f(a) {", "print(1, 2"]
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_streaming_parse_matches_list_parse(src):
+    assert cilly_parser(cilly_lexer_iter(src)) == cilly_parser(cilly_lexer(src))
+
+
+def test_streaming_parse_reads_tokens_lazily():
+    pulled = []
+
+    def tokens():
+        for t in cilly_lexer_iter("var = 1;" + " print(2);" * 1000):
+            pulled.append(t)
+            yield t
+
+    # 第二个 token 就出错，后面的 token 不应该被读出来
+    with pytest.raises(Exception, match="期望id"):
+        cilly_parser(tokens())
+    assert len(pulled) <= 3
+
+
+@pytest.mark.parametrize("src", BAD)
+def test_streaming_parse_reports_the_same_errors(src):
+    with pytest.raises(Exception) as list_err:
+        cilly_parser(cilly_lexer(src))
+    with pytest.raises(Exception) as stream_err:
+        cilly_parser(cilly_lexer_iter(src))
+    assert str(stream_err.value) == str(list_err.value)
+
+
+@pytest.mark.parametrize("src", INCOMPLETE)
+def test_streaming_parse_reports_incomplete_input(src):
+    with pytest.raises(CillyIncompleteError):
+        cilly_parser(cilly_lexer_iter(src))
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_compact_parse_matches_list_parse(src):
+    assert cilly_parser(cilly_lexer_compact(src)) == cilly_parser(cilly_lexer(src))
+
+
+def test_compact_parse_reports_error_position():
+    with pytest.raises(Exception, match="期望id,实际为\\['=', None\\] \\(第2行第5列\\)"):
+        cilly_parser(cilly_lexer_compact("print(1);\nvar = 1;"))
+
+
+@pytest.mark.parametrize("src", INCOMPLETE)
+def test_compact_parse_reports_incomplete_input(src):
+    with pytest.raises(CillyIncompleteError):
+        cilly_parser(cilly_lexer_compact(src))
+
+
+def test_compact_parse_records_statement_lines():
+    lines = {}
+    ast = cilly_parser(cilly_lexer_compact("var x = 1;\n\nprint(x);"), lines=lines)
+    assert [lines[id(s)] for s in ast[1]] == [1, 3]
+
+
+# 以前的回溯解析器给出的 AST
+STATEMENTS = [
+    ("a = 1;", ["assign", ["id", "a"], ["num", 1]]),
+    ("a[0] = f(1);", ["assign", ["array_access", ["id", "a"], ["num", 0]], ["call", ["id", "f"], [["num", 1]]]]),
+    ("s.x.y = 2;", ["assign", ["struct_access", ["struct_access", ["id", "s"], "x"], "y"], ["num", 2]]),
+    ("f(1);", ["expr_stat", ["call", ["id", "f"], [["num", 1]]]]),
+    ("a[0];", ["expr_stat", ["array_access", ["id", "a"], ["num", 0]]]),
+    ("-x + 1;", ["expr_stat", ["binary", "+", ["unary", "-", ["id", "x"]], ["num", 1]]]),
+    (
+        "for (i = 0; i < 2; i = i + 1) x = i;",
+        [
+            "for",
+            ["assign", ["id", "i"], ["num", 0]],
+            ["binary", "<", ["id", "i"], ["num", 2]],
+            ["assign", ["id", "i"], ["binary", "+", ["id", "i"], ["num", 1]]],
+            ["assign", ["id", "x"], ["id", "i"]],
+        ],
+    ),
+]
+
+
+@pytest.mark.parametrize("src, stat", STATEMENTS)
+def test_assign_and_expr_statements(src, stat):
+    assert cilly_parser(cilly_lexer(src)) == ["program", [stat]]
+
+
+@pytest.mark.parametrize("src, msg", [("a = ;", "非法token: ;"), ("a b;", "期望;,实际为\\['id', 'b'\\]")])
+def test_assign_statement_errors(src, msg):
+    with pytest.raises(Exception, match=msg):
+        cilly_parser(cilly_lexer(src))
+
+
+def test_statements_read_each_token_once(monkeypatch):
+    src = "a[f(1, 2)].x = g(b[0])(3); h(a.x[1] + 2); x = -y;"
+    made = []
+    token = TokenBuffer.token
+
+    def counting_token(self, i):
+        made.append(i)
+        return token(self, i)
+
+    monkeypatch.setattr(TokenBuffer, "token", counting_token)
+    buf = cilly_lexer_compact(src)
+    cilly_parser(buf)
+    assert made == list(range(len(buf)))
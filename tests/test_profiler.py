@@ -0,0 +1,122 @@
+import io
+import itertools
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_output import CaptureSink
+from cilly_profiler import ANONYMOUS, PROGRAM, Profiler
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+SRC = """
+var fib = fun(n) { if (n < 2) { return n; } else { return fib(n - 1) + fib(n - 2); } };
+var sq = fun(x) { return x * x; };
+print(fib(10), sq(3), fun(y) { return y; }(1));
+"""
+
+LOOP = """
+var loop = fun(n) { if (n == 0) { return 0; } else { return loop(n - 1); } };
+print(loop(100));
+"""
+
+
+def run(ast, backend, profiler, out):
+    if backend == "eval":
+        cilly_eval(ast, {}, profiler=profiler, out=out)
+    else:
+        procs = {}
+        code, consts, scopes = cilly_vm_compiler(ast, [], [], [], procs=procs)
+        cilly_vm(code, consts, scopes, profiler=profiler, procs=procs, out=out)
+
+
+def profile(src, backend):
+    ast = cilly_parser(cilly_lexer(src))
+    # 每次读时钟前进 1，耗时是确定的
+    profiler = Profiler(ast, timer=itertools.count().__next__)
+    out = CaptureSink()
+    run(ast, backend, profiler, out)
+    return profiler, out.getvalue()
+
+
+def calls(profiler):
+    return {r["name"]: (r["ncalls"], r["primitive_calls"]) for r in profiler.stats()["functions"]}
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_function_counts_and_names(backend):
+    profiler, out = profile(SRC, backend)
+
+    assert out == "55 9 1 \n"
+    assert calls(profiler) == {PROGRAM: (1, 1), "fib": (177, 1), "sq": (1, 1), ANONYMOUS: (1, 1)}
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_times_add_up(backend):
+    profiler, _ = profile(SRC, backend)
+    rows = {r["name"]: r for r in profiler.stats()["functions"]}
+
+    for r in rows.values():
+        assert 0 < r["tottime"] <= r["cumtime"]
+    assert sum(r["tottime"] for r in rows.values()) == rows[PROGRAM]["cumtime"]
+
+
+def test_node_counts():
+    profiler, _ = profile(SRC, "eval")
+    nodes = profiler.stats()["nodes"]
+
+    assert nodes["call"] == 179
+    assert nodes["if"] == 177
+    assert nodes["return"] == 179
+    assert nodes["program"] == 1
+    assert profiler.stats()["opcodes"] == {}
+
+
+def test_opcode_counts():
+    profiler, _ = profile(SRC, "vm")
+    ops = profiler.stats()["opcodes"]
+
+    assert ops["CALL"] == 179
+    assert ops["RETURN"] == 179
+    assert ops["JMP_FALSE"] == 177
+    assert profiler.stats()["nodes"] == {}
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_tail_calls_are_counted(backend):
+    profiler, out = profile(LOOP, backend)
+
+    assert out == "0 \n"
+    assert calls(profiler)["loop"][0] == 101
+
+
+def test_chrome_trace_events_are_balanced():
+    profiler, _ = profile(SRC, "eval")
+    events = profiler.chrome_trace()["traceEvents"]
+
+    assert len(events) > 0
+    assert [e["name"] for e in events].count("fib") == 177
+    assert profiler.stack == []
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_error_unwinds_the_profiler_stack(backend):
+    src = "var f = fun(n) { return n / 0; }; var g = fun() { return f(1); }; g();"
+    ast = cilly_parser(cilly_lexer(src))
+    profiler = Profiler(ast)
+    with pytest.raises(Exception):
+        run(ast, backend, profiler, CaptureSink())
+    assert profiler.stack == []
+    assert calls(profiler) == {PROGRAM: (1, 1), "g": (1, 1), "f": (1, 1)}
+
+
+def test_print_stats_lists_every_function():
+    profiler, _ = profile(SRC, "vm")
+    buf = io.StringIO()
+    profiler.print_stats(sort="ncalls", file=buf)
+    text = buf.getvalue()
+
+    assert "180 function calls" in text
+    for name in ["fib", "sq", ANONYMOUS, PROGRAM, "CALL"]:
+        assert name in text
+    with pytest.raises(ValueError):
+        profiler.print_stats(sort="nope")
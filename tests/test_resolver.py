@@ -0,0 +1,50 @@
+from cilly_interpreter import cilly_lexer, cilly_parser
+from cilly_resolver import cilly_resolve, cilly_eval_resolved
+
+
+def run(src, capsys):
+    cilly_eval_resolved(cilly_resolve(cilly_parser(cilly_lexer(src))), {})
+    return capsys.readouterr().out.split("\n")[:-1]
+
+
+def test_define_in_unbraced_if(capsys):
+    assert run("if (true) var y = 2; print(y);", capsys) == ["2 "]
+
+
+def test_define_in_both_branches(capsys):
+    assert run("var c = false; if (c) var y = 1; else var y = 2; print(y);", capsys) == ["2 "]
+
+
+def test_nested_define_in_function(capsys):
+    src = """
+    var f = fun() {
+        if (true) var x = 5;
+        return x;
+    };
+    print(f());
+    """
+    assert run(src, capsys) == ["5 "]
+
+
+def test_shadowed_define_stays_in_block(capsys):
+    src = """
+    var x = 1;
+    {
+        if (true) var x = 2;
+        print(x);
+    }
+    print(x);
+    """
+    assert run(src, capsys) == ["2 ", "1 "]
+
+
+def test_shadowed_define_in_function(capsys):
+    src = """
+    var x = 1;
+    var f = fun() {
+        if (true) var x = 5;
+        return x;
+    };
+    print(f(), x);
+    """
+    assert run(src, capsys) == ["5 1 "]
@@ -0,0 +1,99 @@
+import io
+import signal
+import sys
+
+import pytest
+
+from cilly_builtins import HostRegistry
+from cilly_interpreter import cilly_lexer_compact, cilly_parser, cilly_eval
+from cilly_output import CaptureSink
+from cilly_profiler import PROGRAM, SamplingProfiler
+from cilly_vm_compiler import cilly_vm_compiler, cilly_vm
+
+# probe 在 g 的第 2 行里取一次样本
+SRC = """var g = fun(x) {
+    probe();
+    return x;
+};
+var f = fun() {
+    return g(1) + 1;
+};
+print(f());
+"""
+
+HOT = """var spin = fun(n) {
+    var i = 0;
+    while (i < n) {
+        i = i + 1;
+    }
+    return i;
+};
+print(spin(%d));
+"""
+
+
+def run(src, backend, host=None, **kw):
+    buf = cilly_lexer_compact(src)
+    lines = {}
+    ast = cilly_parser(buf, lines=lines)
+    out = CaptureSink()
+    names, values = host.vm_scope() if host is not None else ([], [])
+
+    if backend == "eval":
+        sampler = SamplingProfiler(ast, lines, **kw)
+        env = host.env() if host is not None else {}
+        return sampler, lambda: cilly_eval(ast, env, out=out)
+
+    pc_table = []
+    code, consts, _ = cilly_vm_compiler(ast, [], [], [names] if names else [], lines=lines, pc_table=pc_table)
+    sampler = SamplingProfiler(ast, lines, pc_table, **kw)
+    return sampler, lambda: cilly_vm(code, consts, [values] if names else [], out=out)
+
+
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_sample_maps_to_cilly_functions_and_lines(backend):
+    host = HostRegistry()
+    samplers = []
+    host.register("probe", lambda: samplers[0].sample(sys._getframe()), 0)
+
+    sampler, execute = run(SRC, backend, host)
+    samplers.append(sampler)
+    execute()
+
+    assert sampler.stacks == {f"{PROGRAM}:8;f:6;g:2": 1}
+    assert sampler.line_counts() == {"g:2": 1}
+    assert sampler.collapsed() == f"{PROGRAM}:8;f:6;g:2 1\n"
+    assert sampler.samples == 1 and sampler.missed == 0
+
+
+def test_sample_outside_cilly_is_missed():
+    sampler = SamplingProfiler()
+    sampler.sample(sys._getframe())
+    assert sampler.samples == 0 and sampler.missed == 1
+
+
+@pytest.mark.parametrize("mode", ["signal", "thread"])
+@pytest.mark.parametrize("backend", ["eval", "vm"])
+def test_timer_samples_the_hot_loop(backend, mode):
+    if mode == "signal" and not hasattr(signal, "setitimer"):
+        pytest.skip("没有 setitimer")
+
+    sampler, execute = run(HOT % 100000, backend, interval=0.001, mode=mode)
+    with sampler:
+        execute()
+
+    assert sampler.samples > 0
+    # 时间几乎都花在 spin 的循环里
+    hot = sum(n for leaf, n in sampler.line_counts().items() if leaf.startswith("spin:"))
+    assert hot >= sampler.samples * 0.8
+
+    buf = io.StringIO()
+    sampler.print_stats(file=buf)
+    assert f"{sampler.samples} samples" in buf.getvalue()
+
+
+def test_bad_arguments():
+    with pytest.raises(ValueError):
+        SamplingProfiler(interval=0)
+    with pytest.raises(ValueError):
+        SamplingProfiler(mode="perf")
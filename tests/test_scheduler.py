@@ -0,0 +1,14 @@
+from cilly_scheduler import Scheduler
+
+
+def test_error_counts_instructions_of_failing_slice():
+    sched = Scheduler(quantum=1000)
+    ok = sched.spawn("var i = 0; while (i < 10) { i = i + 1; } print(i);")
+    bad = sched.spawn("var i = 0; while (i < 10) { i = i + 1; } print(i); var n = 1; n();")
+    sched.run()
+
+    assert ok.state == "done"
+    assert bad.state == "error"
+    # 出错前执行的指令和正常结束的程序一样多，再加上出错的那几条
+    assert bad.instructions > ok.instructions
+    assert sum(row["instructions"] for row in sched.stats()) == ok.instructions + bad.instructions
@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_stackless import cilly_eval_stackless
+from cilly_async import cilly_eval_async
+
+SUM = """
+var sum = fun(n) {
+    if (n == 0) { return 0; } else { return n + sum(n - 1); }
+};
+print(sum(%d));
+"""
+
+RUNAWAY = "var f = fun(n) { return 1 + f(n + 1); }; f(0);"
+
+LOOP = """
+var loop = fun(n, acc) {
+    if (n == 0) { return acc; } else { return loop(n - 1, acc + n); }
+};
+print(loop(%d, 0));
+"""
+
+PROGRAMS = [
+    "var i = 0; var s = 0; while (i < 10) { i = i + 1; if (i == 3) continue; if (i > 7) break; s = s + i; } print(s, i);",
+    "fun fib(n) { if (n < 2) return n; else return fib(n - 1) + fib(n - 2); } print(fib(12));",
+    "fun g() { if (true) { return 1; } return 2; } print(g());",
+    "fun h() { return 1; print(\"after\"); } print(h());",
+    "var c = 0; var inc = fun() { c = c + 1; return c; }; print(inc(), inc(), c);",
+    "var f = fun(x) { return x > 0 ? f(x - 1) : \"done\"; }; print(f(5));",
+    "var a = [1, [2, 3]]; a[1][0] = {x: 5}; a[1][0].x = a[1][0].x * 2; print(a, a[1][0] == {x: 10});",
+    "print(1 == true, 0 && 5, 1 || 7, null == null, 7 / 2, \"a\" + \"b\", -2 ^ 2);",
+    "var a = [1]; print(a[1.5]);",
+    "print(undefined_name);",
+]
+
+
+def run(src, **kw):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cilly_eval_stackless(cilly_parser(cilly_lexer(src)), {}, **kw)
+    return out.getvalue()
+
+
+def run_both(src):
+    results = []
+    for evaluate in [cilly_eval_stackless, cilly_eval]:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            try:
+                print("RESULT", evaluate(cilly_parser(cilly_lexer(src)), {}))
+            except Exception as e:
+                print("ERR", e)
+        results.append(out.getvalue())
+    return results
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_programs_match_cilly_eval(src):
+    stackless, tree = run_both(src)
+    assert stackless == tree
+
+
+def test_tail_calls_do_not_grow_the_stack():
+    # 尾调用在两种模式下都不占栈，max_depth 很小也能跑完
+    assert run(LOOP % 50000, max_depth=100) == "1250025000 \n"
+    stackless, tree = run_both(LOOP % 50000)
+    assert stackless == tree
+
+
+def test_deep_recursion_succeeds():
+    # 远超 python 的递归深度限制
+    assert run(SUM % 20000) == "200010000 \n"
+
+
+def test_runaway_recursion_hits_the_limit():
+    with pytest.raises(Exception, match="递归太深"):
+        run(RUNAWAY, max_depth=10000)
+
+
+def test_limit_is_configurable():
+    with pytest.raises(Exception, match="递归太深"):
+        run(SUM % 2000, max_depth=10000)
+    assert run(SUM % 2000, max_depth=20000) == "2001000 \n"
+
+
+def test_async_runaway_recursion_hits_the_limit():
+    ast = cilly_parser(cilly_lexer(RUNAWAY))
+    with pytest.raises(Exception, match="递归太深"):
+        asyncio.run(cilly_eval_async(ast, {}, max_depth=10000))
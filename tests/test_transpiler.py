@@ -0,0 +1,63 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_transpiler import cilly_eval_python, cilly_run_python, transpile_cache
+
+PROGRAMS = [
+    "var i = 0; var s = 0; while (i < 10) { i = i + 1; if (i == 3) continue; if (i > 7) break; s = s + i; } print(s, i);",
+    "var i = 0; for (i = 0; i < 3; i = i + 1) { print(i, i < 2 ? \"a\" : \"b\"); }",
+    "fun fib(n) { if (n < 2) return n; else return fib(n - 1) + fib(n - 2); } print(fib(12));",
+    "fun g() { if (true) { return 1; } return 2; } print(g());",
+    "fun h() { return 1; print(\"after\"); } print(h());",
+    "var c = 0; var inc = fun() { c = c + 1; return c; }; print(inc(), inc(), c);",
+    "var f = fun(a, b) { return a + b; }; print(f(1, 2), f(\"a\", \"b\"), f);",
+    "var a = [1, [2, 3]]; a[1][0] = {x: 5}; a[1][0].x = a[1][0].x * 2; print(a, a[1][0] == {x: 10});",
+    "var s = {x: 1, y: \"s\"}; var t = s; t.x = 2; print(s.x, s == t, !s.y, -s.x, 2 ^ 3 ^ 2);",
+    "print(!0, !1, -true, true + 1, 0 && 5, 1 && 5, 0 || 7, 1 || 7, 7 / 2, null);",
+    "if (1) print(\"y\"); else print(\"n\"); print(1 ? \"t\" : \"f\");",
+    "var a = [1]; print(a[1.5]);",
+    "var s = {x: 1}; s.q = 1;",
+    "print(undefined_name);",
+]
+
+
+def run(evaluate, src, mode):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            print("RESULT", evaluate(cilly_parser(cilly_lexer(src), mode), {}))
+        except Exception as e:
+            print("ERR", e)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["list", "slots"])
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_python_backend_matches_cilly_eval(src, mode):
+    assert run(cilly_eval_python, src, mode) == run(cilly_eval, src, mode)
+
+
+def test_run_python_writes_no_cache_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for i in range(3):
+            cilly_run_python(f"print({i} + 1);", {})
+    assert out.getvalue() == "1 \n2 \n3 \n"
+    assert os.listdir(tmp_path) == []
+
+
+def test_run_python_reuses_transpiled_code():
+    transpile_cache.clear()
+    src = "var x = 40; print(x + 2);"
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cilly_run_python(src, {})
+        (entry,) = transpile_cache.values()
+        cilly_run_python(src, {})
+    assert out.getvalue() == "42 \n42 \n"
+    assert list(transpile_cache.values()) == [entry]
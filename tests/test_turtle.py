@@ -0,0 +1,108 @@
+import sys
+import types
+
+import pytest
+
+import cilly
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_turtle import TurtleBatcher, TurtleRecorder
+
+SQUARE = """
+var i = 0;
+while (i < 4) { forward(10); left(90); i = i + 1; }
+penup(); forward(20); pendown();
+pencolor("red"); backward(5);
+color(1, 0, 0.5); right(90); forward(5);
+"""
+
+SQUARE_SVG = """\
+<svg xmlns="http://www.w3.org/2000/svg" width="40" height="35" viewBox="0 0 40 35">
+<polyline points="10,20 20,20 20,10 10,10 10,20" fill="none" stroke="black" stroke-width="1" stroke-linecap="round" stroke-linejoin="round"/>
+<polyline points="30,20 25,20" fill="none" stroke="red" stroke-width="1" stroke-linecap="round" stroke-linejoin="round"/>
+<polyline points="25,20 25,25" fill="none" stroke="#ff0080" stroke-width="1" stroke-linecap="round" stroke-linejoin="round"/>
+</svg>
+"""
+
+
+def draw(src, renderer):
+    cilly_eval(cilly_parser(cilly_lexer(src)), renderer.env())
+    renderer.flush()
+
+
+def test_recorder_writes_svg(tmp_path):
+    rec = TurtleRecorder()
+    draw(SQUARE, rec)
+    assert rec.svg() == SQUARE_SVG
+
+    path = tmp_path / "square.svg"
+    rec.write_svg(str(path))
+    assert path.read_text(encoding="utf-8") == SQUARE_SVG
+
+
+def test_empty_drawing():
+    rec = TurtleRecorder()
+    draw("penup(); forward(10);", rec)
+    assert rec.paths == []
+    assert rec.svg().startswith('<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20"')
+
+
+@pytest.mark.parametrize("src, msg", [('forward("a");', "forward 的参数必须是数字"), ("pencolor(2, 0, 0);", "非法颜色")])
+def test_recorder_errors(src, msg):
+    with pytest.raises(Exception, match=msg):
+        draw(src, TurtleRecorder())
+
+
+def test_render_svg_keeps_going_after_a_failed_file(tmp_path, capsys):
+    good = tmp_path / "good.cilly"
+    bad = tmp_path / "bad.cilly"
+    good.write_text(SQUARE + 'print("done");', encoding="utf-8")
+    bad.write_text("forward(1); nope();", encoding="utf-8")
+    out_dir = tmp_path / "svg"
+
+    failed = cilly.render_svg([str(bad), str(good)], str(out_dir))
+
+    assert failed == 1
+    assert (out_dir / "good.svg").read_text(encoding="utf-8") == SQUARE_SVG
+    assert not (out_dir / "bad.svg").exists()
+    captured = capsys.readouterr()
+    assert captured.out == "done \n"
+    assert "bad.cilly: 执行错误" in captured.err
+
+
+class FakeTurtle(types.ModuleType):
+    def __init__(self):
+        super().__init__("turtle")
+        self.calls = []
+        for name in ["tracer", "forward", "left", "penup", "pendown", "pencolor", "color", "update"]:
+            setattr(self, name, self.recorder(name))
+
+    def recorder(self, name):
+        return lambda *args: self.calls.append((name, *args))
+
+
+def test_batcher_merges_moves(monkeypatch):
+    fake = FakeTurtle()
+    monkeypatch.setitem(sys.modules, "turtle", fake)
+
+    batcher = TurtleBatcher(batch_size=100)
+    draw("forward(10); forward(5); backward(3); left(90); right(30); penup(); forward(1);", batcher)
+
+    assert fake.calls == [
+        ("tracer", 0, 0),
+        ("forward", 12),
+        ("left", 60),
+        ("penup",),
+        ("forward", 1),
+        ("update",),
+    ]
+
+
+def test_batcher_updates_every_batch(monkeypatch):
+    fake = FakeTurtle()
+    monkeypatch.setitem(sys.modules, "turtle", fake)
+
+    batcher = TurtleBatcher(batch_size=3)
+    cilly_eval(cilly_parser(cilly_lexer("var i = 0; while (i < 7) { forward(1); i = i + 1; }")), batcher.env())
+
+    assert fake.calls.count(("update",)) == 2
+    assert [c for c in fake.calls if c[0] == "forward"] == [("forward", 3), ("forward", 3)]
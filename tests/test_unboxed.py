@@ -0,0 +1,49 @@
+import contextlib
+import io
+
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser, cilly_eval
+from cilly_unboxed import cilly_eval_unboxed
+
+
+def run(evaluate, src):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            print("RESULT", evaluate(cilly_parser(cilly_lexer(src)), {}))
+        except Exception as e:
+            print("ERR", e)
+    return out.getvalue()
+
+
+PROGRAMS = [
+    "var i = 0; var s = 0; while (i < 10) { i = i + 1; if (i == 3) continue; if (i > 7) break; s = s + i; } print(s, i);",
+    "fun fib(n) { if (n < 2) return n; else return fib(n - 1) + fib(n - 2); } print(fib(12));",
+    "var f = fun(a, b) { return a + b; }; print(f(1, 2), f(\"a\", \"b\"), f);",
+    "var a = [1, true, \"s\", null, [2.5]]; print(a, a[1], a[4]);",
+    "var n = {inner: {v: 10}, w: [1, 2]}; n.inner.v = n.inner.v + 5; n.w[0] = {}; print(n.inner.v, n);",
+    "print(!0, !1, -true, true + 1, 0 && 5, 1 && 5, 0 || 7, 1 || 7, 2 ^ 10, 7 / 2);",
+    "if (1) print(\"y\"); else print(\"n\"); print(1 ? \"t\" : \"f\", {} ? 1 : 2);",
+    "var e = {}; print(e, e == {}, [null] == [false]);",
+    "var a = [1]; print(a[1.5]);",
+    "var s = {x: 1}; s.q = 1;",
+]
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+def test_programs_match_cilly_eval(src):
+    assert run(cilly_eval_unboxed, src) == run(cilly_eval, src)
+
+
+EQUALITY = [
+    "print([1] == [true], [1] != [true], [[1]] == [[true]]);",
+    "print({a: 1} == {a: true}, {a: [1]} == {a: [1]}, {a: 1} != {a: 1});",
+    "print([1.0] == [1], [null] == [false], [] == [], [1] == 1);",
+    "print(1 == true, 0 == false, null == null, \"1\" == 1);",
+]
+
+
+@pytest.mark.parametrize("src", EQUALITY)
+def test_equality_matches_cilly_eval(src):
+    assert run(cilly_eval_unboxed, src) == run(cilly_eval, src)
@@ -0,0 +1,73 @@
+import pytest
+
+from cilly_interpreter import cilly_lexer, cilly_parser
+from cilly_output import CaptureSink
+from cilly_vm_compiler import cilly_vm, cilly_vm_compiler, cilly_vm_machine, VMStats, POP, PRINT_ITEM
+
+FIB = "var f = fun(n) { if (n < 2) { return n; } else { return f(n - 1) + f(n - 2); } }; print(f(10));"
+
+
+def compile_src(src):
+    return cilly_vm_compiler(cilly_parser(cilly_lexer(src)), [], [], [])
+
+
+@pytest.mark.parametrize("stats", [False, True])
+@pytest.mark.parametrize("opcode", [POP, PRINT_ITEM])
+def test_stack_underflow_is_a_cilly_error(opcode, stats):
+    with pytest.raises(Exception, match="cilly vm : Stack underflow"):
+        cilly_vm([opcode], [], [], stats=stats)
+
+
+def test_stack_underflow_in_time_slice():
+    _, run_for, _, _, _ = cilly_vm_machine([POP], [], [])
+    with pytest.raises(Exception, match="Stack underflow") as e:
+        run_for(0, 10)
+    assert e.value.executed == 1
+
+
+@pytest.mark.parametrize(
+    "src, counts",
+    [
+        # LOAD_CONST 1, LOAD_CONST 2, BINARY_ADD, PRINT_ITEM
+        ("print(1 + 2);", {"push_count": 3, "pop_count": 3, "max_depth": 2, "final_depth": 0}),
+        ("var x = 1; x = x * (2 + 3);", {"push_count": 6, "pop_count": 6, "max_depth": 3, "final_depth": 0}),
+        (FIB, {"push_count": 1416, "pop_count": 1416, "max_depth": 8, "final_depth": 0}),
+    ],
+)
+def test_stats_count_stack_use(src, counts):
+    code, consts, scopes = compile_src(src)
+    stats = cilly_vm(code, consts, scopes, stats=True, out=CaptureSink())
+    assert isinstance(stats, VMStats)
+    assert stats.as_dict() == counts
+
+
+def test_stats_do_not_change_output():
+    code, consts, scopes = compile_src(FIB)
+    plain, counted = CaptureSink(), CaptureSink()
+    assert cilly_vm(code, consts, scopes, out=plain) is None
+    cilly_vm(code, consts, scopes, stats=True, out=counted)
+    assert plain.getvalue() == counted.getvalue() == "55 \n"
+
+
+def test_stats_report():
+    code, consts, scopes = compile_src("print(1 + 2);")
+    stats = cilly_vm(code, consts, scopes, stats=True, out=CaptureSink())
+    assert repr(stats) == "VMStats(push_count=3, pop_count=3, max_depth=2, final_depth=0)"
+    assert str(stats).splitlines() == [
+        "--- Stack Statistics ---",
+        "Push count: 3",
+        "Pop count: 3",
+        "Max stack depth: 2",
+        "Final stack depth: 0",
+    ]
+
+
+def test_stats_in_time_slices():
+    # 分时间片执行时统计的结果和一次执行完一样
+    code, consts, scopes = compile_src(FIB)
+    stats = VMStats()
+    _, run_for, _, _, _ = cilly_vm_machine(code, consts, scopes, out=CaptureSink(), stats=stats)
+    pc = 0
+    while pc < len(code):
+        pc, _ = run_for(pc, 7)
+    assert (stats.push_count, stats.pop_count, stats.max_depth) == (1416, 1416, 8)